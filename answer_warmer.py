@@ -0,0 +1,106 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger("answer_warmer")
+
+def ensure_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS rag_answers
+        (user_email TEXT NOT NULL,
+         question TEXT NOT NULL,
+         data_version BIGINT NOT NULL,
+         answer TEXT NOT NULL,
+         created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+         PRIMARY KEY (user_email, question))
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS rag_activity
+        (user_email TEXT PRIMARY KEY,
+         last_used TIMESTAMPTZ NOT NULL DEFAULT now())
+    ''')
+
+def load_answers(cur, user_email, questions, data_version):
+    """{question: answer} for those of `questions` answered at this data version"""
+    cur.execute(
+        "SELECT question, answer FROM rag_answers WHERE user_email = %s AND question = ANY(%s) AND data_version = %s",
+        (user_email, list(questions), data_version)
+    )
+    return dict(cur.fetchall())
+
+def store_answer(cur, user_email, question, data_version, answer):
+    # Never overwrite an answer computed for newer data
+    cur.execute(
+        "INSERT INTO rag_answers (user_email, question, data_version, answer) VALUES (%s, %s, %s, %s) "
+        "ON CONFLICT (user_email, question) DO UPDATE SET data_version = EXCLUDED.data_version, "
+        "answer = EXCLUDED.answer, created_at = now() WHERE rag_answers.data_version <= EXCLUDED.data_version",
+        (user_email, question, data_version, answer)
+    )
+
+def touch_activity(cur, user_email):
+    cur.execute(
+        "INSERT INTO rag_activity (user_email) VALUES (%s) ON CONFLICT (user_email) DO UPDATE SET last_used = now()",
+        (user_email,)
+    )
+
+def is_active(cur, user_email, active_days):
+    cur.execute(
+        "SELECT 1 FROM rag_activity WHERE user_email = %s AND last_used > now() - make_interval(days => %s)",
+        (user_email, active_days)
+    )
+    return cur.fetchone() is not None
+
+class AnswerWarmer:
+    """Low-priority background recomputation of a user's predefined answers.
+
+    schedule() is debounced per user: several saves within `debounce` seconds lead to one
+    warm-up, run `debounce` seconds after the last of them. Warm-ups are spaced at least
+    `min_interval` seconds apart across all users, and a user is not re-warmed within
+    `user_cooldown` seconds; `should_warm(user)` can veto the job (e.g. inactive users).
+    """
+
+    def __init__(self, warm, should_warm=lambda user_email: True, debounce=15.0, min_interval=2.0, user_cooldown=60.0):
+        self._warm = warm
+        self._should_warm = should_warm
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.user_cooldown = user_cooldown
+        self._due = {}  # user -> time the warm-up may start
+        self._last_warmed = {}
+        self._heap = []
+        self._lock = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="answer-warmer", daemon=True)
+        self._thread.start()
+
+    def schedule(self, user_email):
+        now = time.monotonic()
+        due = max(now + self.debounce, self._last_warmed.get(user_email, float("-inf")) + self.user_cooldown)
+        with self._lock:
+            self._due[user_email] = due
+            heapq.heappush(self._heap, (due, user_email))
+            self._lock.notify()
+
+    def _next_job(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                # Skip heap items superseded by a later schedule() of the same user
+                while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if self._heap and self._heap[0][0] <= now:
+                    due, user_email = heapq.heappop(self._heap)
+                    del self._due[user_email]
+                    return user_email
+                self._lock.wait(timeout=(self._heap[0][0] - now) if self._heap else None)
+
+    def _run(self):
+        while True:
+            user_email = self._next_job()
+            try:
+                if self._should_warm(user_email):
+                    self._warm(user_email)
+            except Exception:
+                logger.exception("Warming predefined answers failed")
+            self._last_warmed[user_email] = time.monotonic()
+            time.sleep(self.min_interval)
@@ -1,104 +1,371 @@
 import streamlit as st
 import os
-from openai import OpenAI
-from datetime import datetime
+from datetime import datetime, timedelta
 import psycopg2
 from psycopg2 import sql
-from urllib.parse import urlparse
-import pytz
 import streamlit.components.v1 as components
-from st_supabase_connection import SupabaseConnection, execute_query
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_cookies_controller import CookieController
 import time
 import pandas as pd
 import plotly.graph_objects as go
+from emotion_classifier import classify_messages
+from mood_analytics import EMOTIONS, MoodData, analyze, bucket_counts, choose_granularity
+import plotly.io as pio
+from cache_sync import CacheSync, MISSING
+from similar_entries import LSHIndex, entry_signature_bytes, from_bytes
+import user_memory
+import digests
+import answer_warmer
+import usage_ledger
+import log_partitions
+import transcripts
+from fingerprints import entry_fingerprint
+from session_store import PostgresSessionStore, DebouncedSessionWriter, DraftTurnLog, snapshot
+from llm_metrics import stream_text
+from model_router import ModelRouter
+from async_bridge import BackgroundLoop
+from async_db import AsyncDatabase
+from data_loader import RequestLoader
+from auth_tokens import InvalidToken, VerificationUnavailable
+from sharding import load_shard_urls
+from hedging import Hedger
+from openai_cassette import CassetteClient
+import logging
+from resources import (
+    timezone, LOGS_MONTHS_AHEAD, get_db, get_openai_client, make_openai_client, open_direct_connection, init_db,
+    get_supabase, get_token_verifier, get_session_refresher,
+)
+import queue
+import threading
+import uuid
+import av
+from streamlit_webrtc import webrtc_streamer, WebRtcMode
+from voice import VoiceSession, OpenAISpeechToText, LocalSpeechToText, frames_to_samples, SAMPLE_RATE
 
 # Set page config at the very beginning
 st.set_page_config(layout="wide")
 
 # Load environment variables
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-timezone = pytz.timezone('Asia/Singapore')  # GMT+8
+client = get_openai_client()
+# Local emotion tags below this confidence fall back to the LLM
+EMOTION_CONFIDENCE_THRESHOLD = float(os.environ.get("EMOTION_CONFIDENCE_THRESHOLD", "0.6"))
+# Opt-in request hedging for the idempotent enrichment calls
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "0") == "1"
+# Speech-to-text backend for voice journaling: "openai" or "local" (offline stand-in)
+VOICE_STT_BACKEND = os.environ.get("VOICE_STT_BACKEND", "openai")
+# Per-user daily LLM token budget (0 disables); past 80% chat gets a shorter context and answers, past 100% every
+# task also runs on the economy model. Background work (digests, warmed answers) is recorded apart and never degraded
+LLM_DAILY_TOKEN_BUDGET = int(os.environ.get("LLM_DAILY_TOKEN_BUDGET", "200000"))
+BUDGET_ECONOMY_MODEL = os.environ.get("BUDGET_ECONOMY_MODEL", "gpt-4.1-nano")  # cheaper per token than every routed model
+BUDGET_REDUCED_MESSAGES = 12  # non-system messages kept when over the soft budget
+BUDGET_REDUCED_CHARS = 8000  # per message
+# Only these tasks are trimmed; the rest feed stored entries, digests and answers, so they only change model
+BUDGET_REDUCED_TASKS = {"chat"}
+# Monthly log partitions: when to move them to the compressed archive tier
+LOGS_ARCHIVE_AFTER_MONTHS = int(os.environ.get("LOGS_ARCHIVE_AFTER_MONTHS", "12"))  # 0 disables archiving
+LOGS_ARCHIVE_TABLESPACE = os.environ.get("LOGS_ARCHIVE_TABLESPACE") or None
+LOGS_ARCHIVE_COMPRESSION = os.environ.get("LOGS_ARCHIVE_COMPRESSION", "lz4") or None
+# The Past Entries page reads only this many months back unless older entries are asked for
+PAST_ENTRIES_RECENT_MONTHS = int(os.environ.get("PAST_ENTRIES_RECENT_MONTHS", "3"))
+# In-progress chat turns are written to the draft log every this many turns or seconds, whichever comes first
+DRAFT_FLUSH_TURNS = int(os.environ.get("DRAFT_FLUSH_TURNS", "4"))
+DRAFT_FLUSH_SECONDS = float(os.environ.get("DRAFT_FLUSH_SECONDS", "5"))
 today = datetime.now(timezone).strftime('%Y-%m-%d')
 
-st_supabase = st.connection(
-    name="supabase",
-    type=SupabaseConnection,
-    ttl=None,
-    url=os.environ["SUPABASE_URL"],
-    key=os.environ["SUPABASE_KEY"]
-)
+# One loader per rerun memoizes, batches and counts this rerun's DB reads. A rerun cut short
+# by st.rerun() never reaches the end of the script, so the previous one is closed here too
+if "request_loader" in st.session_state:
+    st.session_state.request_loader.close()
+request_loader = st.session_state.request_loader = RequestLoader().activate()
+
+st_supabase = get_supabase()
+
+def get_db_connection(read_only=False, user_email=None):
+    """Pooled connection to the shard holding the user's data (the catalog shard without a user);
+    read-only work may be served by a replica. close() returns it to the pool"""
+    return get_db().connect(user_email, read_only=read_only)
+
+@st.cache_resource
+def get_cache_sync():
+    # One listener per shard keeps cached reads in step with writes from other replicas
+    # Any change this process hears about, or version it reads afresh, pins that user's reads to the primary for a moment
+    return CacheSync(
+        lambda user_email: get_db_connection(user_email=user_email),
+        listen_connect=[lambda url=url: open_direct_connection(url) for url, _ in load_shard_urls(os.environ).values()],
+        on_change=get_db().pin,
+    ).start()
+
+@st.cache_resource
+def get_session_writer():
+    # Conversation drafts live in Postgres so any replica can resume them; session ids are
+    # user emails, so each draft is stored on its user's shard
+    return DebouncedSessionWriter(PostgresSessionStore(
+        lambda session_id: get_db_connection(user_email=session_id),
+        shard_for=get_db().shard_for,
+    ))
 
-# Database setup and functions
-def get_db_connection():
-    db_url = os.environ['DATABASE_URL']
-    result = urlparse(db_url)
-    username = result.username
-    password = result.password
-    database = result.path[1:]
-    hostname = result.hostname
-    port = result.port
-    conn = psycopg2.connect(
-        database=database,
-        user=username,
-        password=password,
-        host=hostname,
-        port=port
+@st.cache_resource
+def get_draft_log():
+    # Chat turns are appended in batches, so a refresh mid-conversation loses at most a few seconds
+    return DraftTurnLog(
+        lambda user_email: get_db_connection(user_email=user_email),
+        shard_for=get_db().shard_for,
+        max_turns=DRAFT_FLUSH_TURNS,
+        max_delay=DRAFT_FLUSH_SECONDS,
     )
-    with conn.cursor() as cur:
-        cur.execute("SET TIME ZONE 'Asia/Singapore';")
-    conn.commit()
-    return conn
 
-def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Create the table if it doesn't exist
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS logs
-        (id SERIAL PRIMARY KEY,
-         user_email TEXT,
-         user_name TEXT,
-         date TEXT,
-         time TEXT,
-         summary TEXT,
-         emotions TEXT,
-         people TEXT,
-         topics TEXT)
-    ''')
-    conn.commit()
-    cur.close()
-    conn.close()
+def session_snapshot():
+    """What a later session resumes: the conversation while it is pending, a fresh entry page once it is saved"""
+    if st.session_state.summary_generated:
+        # No conversation id, so the session that resumes this starts a new conversation
+        return {"conversation_ended": False, "first_response_given": False, "summary_generated": False, "page": st.session_state.page}
+    return snapshot(st.session_state)
+
+def start_conversation():
+    """Drop the current conversation's draft and give the next one its own id"""
+    if "conversation_id" in st.session_state:
+        get_draft_log().clear(st.session_state.user_email, st.session_state.conversation_id)
+    st.session_state.conversation_id = uuid.uuid4().hex
+    st.session_state.messages = []
+
+def add_message(role, content):
+    # Append a chat turn to the conversation and to its durable draft
+    st.session_state.messages.append({"role": role, "content": content})
+    get_draft_log().append(st.session_state.user_email, st.session_state.conversation_id,
+                           len(st.session_state.messages) - 1, st.session_state.messages[-1])
+
+@st.cache_resource
+def get_model_router():
+    # Per-process routing table plus live latency, TTFT and error rates per (task, model)
+    return ModelRouter()
+
+@st.cache_resource
+def get_async_loop():
+    # Long-lived event loop that async clients are bound to
+    return BackgroundLoop()
+
+def with_script_run_ctx(fn):
+    """fn, run on another thread as part of this rerun, so the st.* calls it makes (e.g.
+    cached resources) find the rerun's ScriptRunContext instead of logging a warning"""
+    ctx = get_script_run_ctx()
+
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn()
+    return run
+
+@st.cache_resource
+def get_async_db():
+    # Independent queries of one rerun run concurrently, each on its own pooled connection
+    return AsyncDatabase(max_workers=8, bind=with_script_run_ctx)
+
+@st.cache_resource
+def get_hedger():
+    hedger = Hedger(
+        get_model_router().tracker,
+        percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", "95")),
+        budget=float(os.environ.get("LLM_HEDGE_BUDGET", "0.05")),
+    )
+    return hedger, make_openai_client(use_async=True)
+
+@st.cache_resource
+def get_usage_ledger():
+    # Usage records go to the catalog shard in batches, off the request path
+    return usage_ledger.UsageLedger(
+        get_db_connection,
+        day_start=lambda: datetime.now(timezone).replace(hour=0, minute=0, second=0, microsecond=0),
+    )
+
+@st.cache_resource
+def get_budget_policy():
+    return usage_ledger.BudgetPolicy(get_usage_ledger(), LLM_DAILY_TOKEN_BUDGET)
+
+def budgeted_request(task, messages, user_email, level=None):
+    """Route the task, then degrade it if the user is over their daily budget; returns (model, params, messages, level).
+    A given level is used as is instead of the user's current one"""
+    model, params = get_model_router().choose(task)
+    if level is None:
+        level = get_budget_policy().level(user_email)
+    if level != usage_ledger.NORMAL and task in BUDGET_REDUCED_TASKS:
+        messages = usage_ledger.trim_messages(messages, BUDGET_REDUCED_MESSAGES, BUDGET_REDUCED_CHARS)
+        params = dict(params, max_tokens=min(params["max_tokens"], max(64, params["max_tokens"] // 2)))
+    if level == usage_ledger.ECONOMY:
+        model = BUDGET_ECONOMY_MODEL
+    return model, params, messages, level
+
+def background_account(user_email):
+    # Ledger account for work the user didn't ask for: reported per user, but not counted toward their budget
+    return f"background:{user_email}"
+
+def record_usage(user_email, task, model, usage, latency, ttft=None, error=False, level=usage_ledger.NORMAL):
+    get_usage_ledger().record(
+        user_email, task, model,
+        getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None),
+        latency, ttft, error, level,
+    )
+
+def chat_completion(task, messages, hedge=False, user_email=None, level=None):
+    """Non-streaming completion on the model routed for this task, optionally hedged"""
+    router = get_model_router()
+    model, params, messages, level = budgeted_request(task, messages, user_email, level)
+    started = time.perf_counter()
+    try:
+        if hedge and LLM_HEDGING:
+            hedger, async_client = get_hedger()
+            hedges_before = hedger.hedges
+
+            async def call():
+                return await async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=False,
+                    **params,
+                )
+
+            response = get_async_loop().run(hedger.run((task, model), call))
+            if hedger.hedges != hedges_before:
+                logging.getLogger("hedging").info("hedged %s on %s: %s", task, model, hedger.stats())
+        else:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=False,
+                **params,
+            )
+    except Exception:
+        router.record(task, model, time.perf_counter() - started, error=True)
+        record_usage(user_email, task, model, None, time.perf_counter() - started, error=True, level=level)
+        raise
+    latency = time.perf_counter() - started
+    router.record(task, model, latency)
+    record_usage(user_email, task, model, getattr(response, "usage", None), latency, level=level)
+    return response.choices[0].message.content
+
+def stream_chat(messages, placeholder, task, user_email=None, level=None):
+    """Stream a completion into a Streamlit placeholder with a typing cursor, recording TTFT"""
+    router = get_model_router()
+    model, params, messages, level = budgeted_request(task, messages, user_email, level)
+    started = time.perf_counter()
+    usage = []
+    try:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        )
+        full_response, ttft, total = stream_text(stream, lambda text: placeholder.markdown(text + "▌"), started, usage.append)
+    except Exception:
+        router.record(task, model, time.perf_counter() - started, error=True)
+        record_usage(user_email, task, model, None, time.perf_counter() - started, error=True, level=level)
+        raise
+    # Remove the blinking cursor
+    placeholder.markdown(full_response)
+    router.record(task, model, total, ttft)
+    record_usage(user_email, task, model, usage[-1] if usage else None, total, ttft, level=level)
+    return full_response
+
+@st.cache_resource
+def get_partition_maintainers():
+    # Keeps future monthly partitions in place and archives old ones, on every shard
+    db = get_db()
+    return [
+        log_partitions.PartitionMaintainer(
+            lambda shard=shard: db.connect_shard(shard),
+            months_ahead=LOGS_MONTHS_AHEAD,
+            archive_after_months=LOGS_ARCHIVE_AFTER_MONTHS or None,
+            tablespace=LOGS_ARCHIVE_TABLESPACE,
+            compression=LOGS_ARCHIVE_COMPRESSION,
+            today=lambda: datetime.now(timezone).date(),
+        )
+        for shard in db.shards
+    ]
 
-def save_to_db(user_email, user_name, summary, emotions, people, topics):
-    conn = get_db_connection()
+@st.cache_resource
+def get_transcript_codecs():
+    # Each shard trains its own compression dictionary from its transcripts
+    db = get_db()
+    return {shard: transcripts.TranscriptCodec(lambda shard=shard: db.connect_shard(shard)) for shard in db.shards}
+
+def save_to_db(user_email, user_name, summary, emotions, people, topics, messages):
+    """Insert an entry; returns False if this conversation was already saved today"""
+    conn = get_db_connection(user_email=user_email)
     cur = conn.cursor()
     current_time = datetime.now(timezone).strftime('%H:%M:%S')
+    fingerprint = entry_fingerprint(messages, summary)
     cur.execute(
-        "INSERT INTO logs (user_email, user_name, date, time, summary, emotions, people, topics) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-        (user_email, user_name, today, current_time, summary, emotions, people, topics)
+        "INSERT INTO logs (user_email, user_name, date, time, summary, emotions, people, topics, fingerprint, minhash, entry_date) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (user_email, entry_date, (fingerprint >> 32)) DO NOTHING RETURNING id",
+        (user_email, user_name, today, current_time, summary, emotions, people, topics, fingerprint,
+         psycopg2.Binary(entry_signature_bytes(summary, topics, people)), today)
     )
+    inserted = cur.fetchone() is not None
+    version = None
+    if inserted:
+        # Merge just this entry into the long-term profile the chat uses
+        user_memory.record_entry(cur, user_email, today, summary, emotions, people, topics)
+        # The conversation itself, compressed, next to its summary
+        transcripts.save(cur, get_transcript_codecs()[get_db().shard_for(user_email)], user_email, today, fingerprint, messages)
+        version = get_cache_sync().bump_version(cur, user_email)
     conn.commit()
     cur.close()
     conn.close()
+    if inserted:
+        get_cache_sync().committed(user_email, version)
+        get_digest_scheduler().schedule(user_email)
+        get_answer_warmer().schedule(user_email)
+    return inserted
 
 def get_entries_count(user_email):
-    conn = get_db_connection()
+    cache_sync = get_cache_sync()
+    version = cache_sync.get_version(user_email)
+    # Derived from the full entry list when this rerun or the cache already has it
+    entries = request_loader.peek(("entries", user_email, None, version), MISSING)
+    if entries is MISSING:
+        entries = cache_sync.cache.get(user_email, ("entries", None), version)
+    if entries is not MISSING:
+        return len(entries)
+    return request_loader.load(("count", user_email, version), lambda: read_entries_count(user_email, version))
+
+def read_entries_count(user_email, version):
+    cache_sync = get_cache_sync()
+    count = cache_sync.cache.get(user_email, "count", version)
+    if count is not MISSING:
+        return count
+    conn = get_db_connection(read_only=True, user_email=user_email)
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM logs WHERE user_email = %s", (user_email,))
     count = cur.fetchone()[0]
     cur.close()
     conn.close()
+    cache_sync.cache.set(user_email, "count", version, count)
     return count
 
-def get_past_entries(user_email):
-    conn = get_db_connection()
+def get_past_entries(user_email, since=None):
+    """Formatted entries, newest first; `since` (a date) limits the read to the partitions from that month on"""
+    version = get_cache_sync().get_version(user_email)
+    return request_loader.load(("entries", user_email, since, version), lambda: read_past_entries(user_email, since, version))
+
+def read_past_entries(user_email, since, version):
+    cache_sync = get_cache_sync()
+    cached = cache_sync.cache.get(user_email, ("entries", since), version)
+    if cached is not MISSING:
+        return cached
+    conn = get_db_connection(read_only=True, user_email=user_email)
     cur = conn.cursor()
-    cur.execute(
-        "SELECT id, date, time, summary, emotions, people, topics FROM logs WHERE user_email = %s ORDER BY date DESC, time DESC",
-        (user_email,)
-    )
+    if since is None:
+        cur.execute(
+            "SELECT id, date, time, summary, emotions, people, topics FROM logs WHERE user_email = %s ORDER BY date DESC, time DESC",
+            (user_email,)
+        )
+    else:
+        cur.execute(
+            "SELECT id, date, time, summary, emotions, people, topics FROM logs WHERE user_email = %s AND entry_date >= %s "
+            "ORDER BY date DESC, time DESC",
+            (user_email, since)
+        )
     entries = cur.fetchall()
     cur.close()
     conn.close()
@@ -113,75 +380,417 @@ def get_past_entries(user_email):
         formatted_time = time_obj.strftime('%I:%M%p').lower()
         formatted_entries.append((entry_id, formatted_date, formatted_time, summary, emotions, people, topics))
     
+    cache_sync.cache.set(user_email, ("entries", since), version, formatted_entries)
     return formatted_entries
 
-def delete_entry(entry_id):
-    conn = get_db_connection()
+def past_entries_since():
+    # Start of the Past Entries window, or None when older entries are included
+    if st.session_state.get("past_entries_show_older"):
+        return None
+    return log_partitions.add_months(datetime.now(timezone).date(), -PAST_ENTRIES_RECENT_MONTHS)
+
+def prefetch_page_data(user_email, page):
+    """Load what this rerun's sidebar and page read, concurrently; the calls further down then hit the cache"""
+    db = get_async_db()
+    calls = []
+    since = None
+    if page == "past_entries":
+        since = past_entries_since()
+        calls += [db.call(get_past_entries, user_email, since), db.call(get_similar_index, user_email)]
+    elif page == "rag":
+        calls += [db.call(get_past_entries, user_email), db.call(get_digests, user_email)]
+    elif page == "visualisations":
+        calls.append(db.call(get_past_entries, user_email))
+    if not calls or since is not None:
+        # Nothing here loads the full entry list, so the sidebar's count is queried alongside;
+        # otherwise get_entries_count takes it from the loaded list
+        calls.append(db.call(get_entries_count, user_email))
+    get_async_loop().gather(*calls, timeout=60)
+
+def summarize_period(user_email, kind, period_label, text):
+    """LLM summary used for weekly digests (of entries) and monthly digests (of weekly digests)"""
+    source = "journal entries" if kind == "week" else "weekly journal digests"
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant condensing someone's reflection journal. Write in the first-person."},
+        {"role": "user", "content": f"Summarize these {source} from {period_label} into one short digest covering the main events, people, recurring topics and how my mood shifted. Do not add information that is not in the text.\n\n{text}"},
+    ]
+    return chat_completion("digest", messages, user_email=background_account(user_email), level=usage_ledger.NORMAL)
+
+def digests_built(user_email, version):
+    # The bump reaches other replicas by NOTIFY; answers warmed from the old digests are redone
+    get_cache_sync().committed(user_email, version)
+    get_answer_warmer().schedule(user_email)
+
+@st.cache_resource
+def get_digest_scheduler():
+    # Digests are built off the request path; a build that changes them bumps the user's data version
+    return digests.DigestScheduler(
+        lambda user_email: get_db_connection(user_email=user_email),
+        summarize_period,
+        bump_version=get_cache_sync().bump_version,
+        on_built=digests_built,
+        today=lambda: datetime.now(timezone).date(),
+    )
+
+def get_digests(user_email):
+    version = get_cache_sync().get_version(user_email)
+    return request_loader.load(("digests", user_email, version), lambda: read_digests(user_email, version))
+
+def read_digests(user_email, version):
+    cache_sync = get_cache_sync()
+    user_digests = cache_sync.cache.get(user_email, "digests", version)
+    if user_digests is MISSING:
+        conn = get_db_connection(read_only=True, user_email=user_email)
+        cur = conn.cursor()
+        user_digests = digests.load_digests(cur, user_email)
+        cur.close()
+        conn.close()
+        cache_sync.cache.set(user_email, "digests", version, user_digests)
+    return user_digests
+
+# Past this many entries the RAG context switches from raw entries to digests for older periods
+RAG_RAW_ENTRY_LIMIT = 40
+RAG_RECENT_DAYS = 14  # always sent as raw entries
+RAG_WEEKLY_DAYS = 90  # older than this is covered by monthly digests
+
+def format_entry_context(entry):
+    _, date, time, summary, emotions, people, topics = entry
+    return f"Date: {date}, Time: {time}\n{summary}\nEmotions: {emotions}\nPeople: {people}\nTopics: {topics}"
+
+def build_rag_context(user_email, entries):
+    """Raw entries for recent days, weekly then monthly digests further back, raw entries wherever a digest is missing"""
+    if len(entries) <= RAG_RAW_ENTRY_LIMIT:
+        return "\n\n".join(format_entry_context(entry) for entry in entries)
+
+    user_digests = get_digests(user_email)
+    current_day = datetime.now(timezone).date()
+    raw_from = digests.week_start(current_day - timedelta(days=RAG_RECENT_DAYS))
+    weekly_from = digests.month_start(current_day - timedelta(days=RAG_WEEKLY_DAYS))
+    sections = {}  # sort key -> text, so each digest appears once
+    for entry in entries:
+        entry_day = datetime.strptime(entry[1], '%d %B %Y').date()
+        digest = None
+        if entry_day < weekly_from:
+            digest = user_digests.get(("month", digests.month_start(entry_day)))
+        if digest is None and entry_day < raw_from:
+            digest = user_digests.get(("week", digests.week_start(entry_day)))
+        if digest is not None:
+            label = f"Week of {digest['period_start']:%d %B %Y}" if digest["period_type"] == "week" else f"{digest['period_start']:%B %Y}"
+            sections[(digest["period_start"], 0, digest["period_type"])] = f"Digest for {label} ({digest['entry_count']} entries):\n{digest['summary']}"
+        else:
+            sections[(entry_day, 1, entry[2], entry[0])] = format_entry_context(entry)
+    return "\n\n".join(sections[key] for key in sorted(sections, key=lambda k: (k[0], k[1]), reverse=True))
+
+# Predefined questions on the RAG page; their answers are precomputed after each save
+PREDEFINED_QUESTIONS = [
+    "What brings me the most joy?",
+    "What drains my energy most?",
+    "What are some recurring topics from my entries?",
+    "What book recommendations do you have based on my entries?",
+    "Count of entries by emotions and give the corresponding dates",
+]
+RAG_WARM_ACTIVE_DAYS = 30  # only warm answers for users who used the RAG page this recently
+
+def rag_messages(context, question):
+    return [
+        {"role": "system", "content": "You are an AI assistant analyzing journal entries. Use the provided context to answer the user's question."},
+        {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
+    ]
+
+def get_cached_answer(user_email, question, version):
+    """Answer for this exact data version from the process cache, else from the warmed answers table"""
+    cache_sync = get_cache_sync()
+    answer = cache_sync.cache.get(user_email, ("answer", question), version)
+    if answer is MISSING and question in PREDEFINED_QUESTIONS:
+        # All predefined answers come back in one query; the rest are memoized for the rerun
+        stored = request_loader.load_many(
+            ("answer", user_email, version), PREDEFINED_QUESTIONS,
+            lambda questions: read_stored_answers(user_email, questions, version)
+        )[question]
+        if stored is not None:
+            answer = stored
+            cache_sync.cache.set(user_email, ("answer", question), version, answer)
+    return answer
+
+def read_stored_answers(user_email, questions, version):
+    conn = get_db_connection(read_only=True, user_email=user_email)
+    cur = conn.cursor()
+    answers = answer_warmer.load_answers(cur, user_email, questions, version)
+    cur.close()
+    conn.close()
+    return answers
+
+def store_answer(user_email, question, version, answer):
+    get_cache_sync().cache.set(user_email, ("answer", question), version, answer)
+    if question in PREDEFINED_QUESTIONS:
+        conn = get_db_connection(user_email=user_email)
+        cur = conn.cursor()
+        answer_warmer.store_answer(cur, user_email, question, version, answer)
+        conn.commit()
+        cur.close()
+        conn.close()
+
+def warm_predefined_answers(user_email):
+    # Read the version before the entries, so an answer is never labelled newer than its data
+    version = get_cache_sync().get_version(user_email)
+    stored = read_stored_answers(user_email, PREDEFINED_QUESTIONS, version)
+    context = None
+    for question in PREDEFINED_QUESTIONS:
+        if question in stored or get_cache_sync().cache.get(user_email, ("answer", question), version) is not MISSING:
+            continue
+        if context is None:
+            context = build_rag_context(user_email, get_past_entries(user_email))
+        answer = chat_completion("rag", rag_messages(context, question), user_email=background_account(user_email), level=usage_ledger.NORMAL)
+        store_answer(user_email, question, version, answer)
+
+def recently_used_rag(user_email):
+    conn = get_db_connection(read_only=True, user_email=user_email)
     cur = conn.cursor()
-    cur.execute("DELETE FROM logs WHERE id = %s", (entry_id,))
+    active = answer_warmer.is_active(cur, user_email, RAG_WARM_ACTIVE_DAYS)
+    cur.close()
+    conn.close()
+    return active
+
+@st.cache_resource
+def get_answer_warmer():
+    return answer_warmer.AnswerWarmer(warm_predefined_answers, should_warm=recently_used_rag)
+
+def get_memory_block(user_email):
+    # Fixed-size summary of past entries for the chat prompt, reloaded only when data changes
+    cache_sync = get_cache_sync()
+    version = cache_sync.get_version(user_email)
+    block = cache_sync.cache.get(user_email, "memory_block", version)
+    if block is MISSING:
+        conn = get_db_connection(user_email=user_email)
+        cur = conn.cursor()
+        profile = user_memory.load_profile(cur, user_email)
+        if profile is None and get_entries_count(user_email):
+            profile = user_memory.rebuild_profile(cur, user_email)
+            conn.commit()
+        cur.close()
+        conn.close()
+        block = user_memory.render(profile)
+        cache_sync.cache.set(user_email, "memory_block", version, block)
+    return block
+
+def get_similar_index(user_email):
+    # LSH index over the stored signatures, rebuilt only when the user's data version changes
+    version = get_cache_sync().get_version(user_email)
+    return request_loader.load(("similar_index", user_email, version), lambda: read_similar_index(user_email, version))
+
+def read_similar_index(user_email, version):
+    cache_sync = get_cache_sync()
+    index = cache_sync.cache.get(user_email, "similar_index", version)
+    if index is not MISSING:
+        return index
+    conn = get_db_connection(user_email=user_email)
+    cur = conn.cursor()
+    cur.execute("SELECT id, minhash FROM logs WHERE user_email = %s", (user_email,))
+    rows = cur.fetchall()
+    signatures = {entry_id: from_bytes(minhash) for entry_id, minhash in rows if minhash is not None}
+    missing = [entry_id for entry_id, minhash in rows if minhash is None]
+    if missing:
+        # Entries saved before signatures existed are signed once, here
+        cur.execute("SELECT id, summary, topics, people FROM logs WHERE id = ANY(%s)", (missing,))
+        for entry_id, summary, topics, people in cur.fetchall():
+            signature_bytes = entry_signature_bytes(summary, topics, people)
+            cur.execute("UPDATE logs SET minhash = %s WHERE id = %s", (psycopg2.Binary(signature_bytes), entry_id))
+            signatures[entry_id] = from_bytes(signature_bytes)
+        conn.commit()
+    cur.close()
+    conn.close()
+    ids = list(signatures)
+    index = LSHIndex(ids, [signatures[i] for i in ids])
+    cache_sync.cache.set(user_email, "similar_index", version, index)
+    return index
+
+def get_mood_data(user_email):
+    # Arrays are rebuilt only when the user's data version changes
+    cache_sync = get_cache_sync()
+    version = cache_sync.get_version(user_email)
+    data = cache_sync.cache.get(user_email, "mood_data", version)
+    if data is MISSING:
+        data = MoodData(get_past_entries(user_email))
+        cache_sync.cache.set(user_email, "mood_data", version, data)
+    return data
+
+def get_mood_analytics(user_email):
+    cache_sync = get_cache_sync()
+    version = cache_sync.get_version(user_email)
+    analytics = cache_sync.cache.get(user_email, "mood_analytics", version)
+    if analytics is MISSING:
+        analytics = analyze(get_mood_data(user_email))
+        cache_sync.cache.set(user_email, "mood_analytics", version, analytics)
+    return analytics
+
+BUCKET_LABELS = {"day": "Day", "week": "Week of", "month": "Month"}
+BUCKET_TICK_FORMATS = {"day": "%d %b %Y", "week": "%d %b %Y", "month": "%b %Y"}
+
+def get_trend_figure_json(user_email, start, end, granularity):
+    """Build (or reuse) the emotion trend chart, aggregated to the granularity before plotting"""
+    cache_sync = get_cache_sync()
+    version = cache_sync.get_version(user_email)
+    key = ("trend_figure", granularity, str(start), str(end))
+    figure_json = cache_sync.cache.get(user_email, key, version)
+    if figure_json is not MISSING:
+        return figure_json
+
+    buckets, counts = bucket_counts(get_mood_data(user_email), start, end, granularity)
+    fig = go.Figure()
+    for i, emotion in enumerate(EMOTIONS):
+        if counts[:, i].any():
+            fig.add_trace(go.Bar(
+                name=emotion,
+                x=buckets,
+                y=counts[:, i],
+                hovertemplate=f"{BUCKET_LABELS[granularity]}: %{{x}}<br>" +
+                             f"{emotion}: %{{y}}<br>" +
+                             "<extra></extra>"
+            ))
+    fig.update_layout(
+        barmode='stack',
+        title=f'My Emotions Trend (by {granularity})',
+        xaxis_title=BUCKET_LABELS[granularity],
+        yaxis_title="Days with Emotion" if granularity != "day" else "Number of Emotions",
+        legend_title="Emotions",
+        hovermode='x unified',
+        showlegend=True,
+        height=500,
+        # Let plotly pick tick spacing; one tick per bar is unreadable over long ranges
+        xaxis=dict(tickformat=BUCKET_TICK_FORMATS[granularity]),
+        # Format y-axis to show only whole numbers
+        yaxis=dict(tick0=0, rangemode='tozero', tickformat='d')
+    )
+    figure_json = fig.to_json()
+    cache_sync.cache.set(user_email, key, version, figure_json)
+    return figure_json
+
+def lift_heatmap(lift_matrix, names, title):
+    fig = go.Figure(go.Heatmap(
+        z=lift_matrix,
+        x=names,
+        y=EMOTIONS,
+        colorscale="RdBu",
+        zmid=1,
+        hovertemplate="%{y} with %{x}: %{z:.2f}x<extra></extra>",
+    ))
+    fig.update_layout(title=title, height=350)
+    return fig
+
+def delete_entry(user_email, entry_id):
+    conn = get_db_connection(user_email=user_email)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM logs WHERE user_email = %s AND id = %s RETURNING user_email, fingerprint, entry_date", (user_email, entry_id))
+    deleted = cur.fetchone()
+    if deleted and deleted[1] is not None:
+        transcripts.delete(cur, deleted[0], deleted[2], deleted[1])
+    if deleted:
+        # Deletes are rare, so the profile is simply recomputed without the entry
+        user_memory.rebuild_profile(cur, deleted[0])
+        version = get_cache_sync().bump_version(cur, deleted[0])
     conn.commit()
     cur.close()
     conn.close()
+    if deleted:
+        get_cache_sync().committed(deleted[0], version)
+        get_answer_warmer().schedule(deleted[0])
+
+def get_transcript(user_email, entry_id):
+    """The conversation an entry was summarized from, or None for entries saved before transcripts were kept"""
+    conn = get_db_connection(read_only=True, user_email=user_email)
+    cur = conn.cursor()
+    messages = transcripts.load(cur, get_transcript_codecs()[get_db().shard_for(user_email)], user_email, entry_id)
+    cur.close()
+    conn.close()
+    return messages
 
-def generate_summary(messages):
+def generate_summary(messages, placeholder=None, user_email=None):
     summary_prompt = f"Summarize the main points of the conversation, highlighting key emotions and discussion points. Format the summary as a concise journal entry. Today's date is {today}. Do not add extra information or assumptions which are not part of the conversation."
     summary_messages = [
         {"role": "system", "content": "You are a helpful assistant tasked with summarizing the conversation for users to then log the summary into their reflection journal. Write in the first-person."},
         {"role": "user", "content": summary_prompt},
     ] + messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=summary_messages,
-        temperature=0.1,
-        stream=False,
-    )
-    return response.choices[0].message.content
+    # Stream into the page when there's somewhere to show it
+    if placeholder is not None:
+        return stream_chat(summary_messages, placeholder, "summary", user_email)
+
+    return chat_completion("summary", summary_messages, hedge=True, user_email=user_email)
+
+def detect_emotions(messages, user_email=None):
+    # Try the local lexicon classifier first; only pay for an LLM call when it isn't sure
+    labels, confidence = classify_messages(messages)
+    if labels and confidence >= EMOTION_CONFIDENCE_THRESHOLD:
+        return ", ".join(labels)
 
-def detect_emotions(messages):
     emotion_prompt = "Analyze the conversation and detect the predominant emotions expressed. Tag the conversation with one or more of the following emotions: Joy, Sadness, Fear, Anger, Frustration. Return only the emotion tags separated by commas, without any additional text or explanation."
     emotion_messages = [
         {"role": "system", "content": "You are an emotion detection assistant. Analyze the conversation and return only the relevant emotion tags."},
         {"role": "user", "content": emotion_prompt},
     ] + messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=emotion_messages,
-        temperature=0.1,
-        stream=False,
-    )
-    return response.choices[0].message.content
+    return chat_completion("emotions", emotion_messages, hedge=True, user_email=user_email)
 
-def detect_people(messages):
+def detect_people(messages, user_email=None):
     people_prompt = "Analyze the conversation and identify the names of people mentioned. Return only the names of people separated by commas, without any additional text or explanation. If no names are mentioned, return 'None'."
     people_messages = [
         {"role": "system", "content": "You are a people detection assistant. Analyze the conversation and return only the names of people mentioned."},
         {"role": "user", "content": people_prompt},
     ] + messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=people_messages,
-        temperature=0.1,
-        stream=False,
-    )
-    return response.choices[0].message.content
+    return chat_completion("people", people_messages, hedge=True, user_email=user_email)
 
-def detect_topics(messages):
+def detect_topics(messages, user_email=None):
     topics_prompt = "Analyze the conversation and identify the main topics discussed. Return only the topic names separated by commas, without any additional text or explanation. If no specific topics are identified, return 'None'."
     topics_messages = [
         {"role": "system", "content": "You are a topic detection assistant. Analyze the conversation and return only the main topics discussed."},
         {"role": "user", "content": topics_prompt},
     ] + messages
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=topics_messages,
-        temperature=0.1,
-        stream=False,
-    )
-    return response.choices[0].message.content
+    return chat_completion("topics", topics_messages, hedge=True, user_email=user_email)
+
+def get_voice_session():
+    """One VAD + transcription worker per browser session"""
+    if "voice_session" not in st.session_state:
+        # Cassette runs don't record audio, so they get the offline stand-in too
+        use_local = VOICE_STT_BACKEND == "local" or isinstance(client, CassetteClient)
+        if use_local:
+            stt = LocalSpeechToText()
+        else:
+            # Transcriptions run on the session's worker thread, so the ledger and user are bound here
+            ledger, user_email = get_usage_ledger(), st.session_state.get("user_email")
+            stt = OpenAISpeechToText(client, on_usage=lambda model, usage, latency, error: ledger.record(
+                user_email, "transcription", model,
+                getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None),
+                latency, None, error,
+            ))
+        st.session_state.voice_session = VoiceSession(stt)
+        st.session_state.voice_resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+    return st.session_state.voice_session
+
+def close_voice_session():
+    """Stop the session's voice worker, if it has one"""
+    voice_session = st.session_state.pop("voice_session", None)
+    st.session_state.pop("voice_resampler", None)
+    if voice_session is not None:
+        voice_session.close()
+
+def listen_for_utterance(webrtc_ctx, placeholder):
+    """Pump microphone audio into the voice session until the user finishes a sentence"""
+    voice_session = get_voice_session()
+    while webrtc_ctx.state.playing and webrtc_ctx.audio_receiver:
+        try:
+            frames = webrtc_ctx.audio_receiver.get_frames(timeout=0.2)
+        except queue.Empty:
+            frames = []
+        if frames:
+            voice_session.feed(frames_to_samples(frames, st.session_state.voice_resampler))
+        utterance = voice_session.take_utterance()
+        if utterance:
+            return utterance
+        partial = voice_session.partial_text()
+        placeholder.caption(f"🎙️ {partial}" if partial else "🎙️ Listening...")
+    return None
 
 def emotion_tag(emotion):
     emotion_colors = {
@@ -224,7 +833,7 @@ def login_user(email, password):
             "password": password
         })
         if response:
-            persist_login(response.user)
+            persist_login(response.session)
             time.sleep(0.5)
             st.rerun()
         return response
@@ -235,32 +844,70 @@ def login_user(email, password):
 # Initialize the cookies controller
 cookie_controller = CookieController()
 
-def persist_login(user_data):
-    """Persist login data in cookies and session state"""
-    cookie_controller.set("user_email", user_data.email)
-    cookie_controller.set("user_name", user_data.user_metadata.get('name', ''))
-    st.session_state.user_email = user_data.email
-    st.session_state.user_name = user_data.user_metadata.get('name', '')
+def store_tokens(access_token, refresh_token):
+    """Keep the session's Supabase tokens in session state and cookies"""
+    if st.session_state.get("access_token") != access_token:
+        cookie_controller.set("access_token", access_token)
+        cookie_controller.set("refresh_token", refresh_token)
+    st.session_state.access_token = access_token
+    st.session_state.refresh_token = refresh_token
+
+def persist_login(session):
+    """Persist the Supabase session after sign-in"""
+    store_tokens(session.access_token, session.refresh_token)
+    st.session_state.user_email = session.user.email
+    st.session_state.user_name = session.user.user_metadata.get('name', '')
 
 def clear_login():
     """Clear login data from cookies and session state"""
-    cookie_controller.set("user_email", "", max_age=0)
-    cookie_controller.set("user_name", "", max_age=0)
+    for name in ("access_token", "refresh_token", "user_email", "user_name"):
+        cookie_controller.set(name, "", max_age=0)
+    st.session_state.access_token = None
+    st.session_state.refresh_token = None
     st.session_state.user_email = None
     st.session_state.user_name = None
 
 def check_login_session():
-    """Check if user is logged in via cookies"""
-    user_email = cookie_controller.get("user_email")
-    user_name = cookie_controller.get("user_name")
-    if user_email and user_name:
-        st.session_state.user_email = user_email
-        st.session_state.user_name = user_name
-        return True
-    return False
+    """Authenticate this rerun from the session's Supabase JWT, verified locally"""
+    access_token = st.session_state.get("access_token") or cookie_controller.get("access_token")
+    refresh_token = st.session_state.get("refresh_token") or cookie_controller.get("refresh_token")
+    if not access_token or not refresh_token:
+        st.session_state.user_email = None
+        st.session_state.user_name = None
+        return False
+    refresher = get_session_refresher()
+    try:
+        try:
+            claims = get_token_verifier().verify(access_token)
+        except InvalidToken:
+            claims = None  # expired while the tab sat idle
+        if claims is None or refresher.due(claims["exp"]):
+            # Refreshed here, so the new pair reaches the cookies in this same rerun
+            try:
+                session = refresher.exchange(refresh_token)
+                new_claims = get_token_verifier().verify(session["access_token"])
+                access_token, refresh_token, claims = session["access_token"], session["refresh_token"], new_claims
+            except (InvalidToken, OSError, ValueError, KeyError):
+                if claims is None:
+                    clear_login()
+                    return False
+                # The current token is good for a few more minutes; the next rerun tries again
+                logging.getLogger("auth_tokens").warning("Refreshing the session failed", exc_info=True)
+    except VerificationUnavailable:
+        # Supabase is unreachable: treat this rerun as signed out but keep the tokens for the next one
+        logging.getLogger("auth_tokens").warning("Could not verify the session token", exc_info=True)
+        st.session_state.user_email = None
+        st.session_state.user_name = None
+        return False
+    store_tokens(access_token, refresh_token)
+    st.session_state.user_email = claims.get("email")
+    st.session_state.user_name = (claims.get("user_metadata") or {}).get("name", "")
+    return True
 
 # Initialize database
 init_db()
+get_partition_maintainers()
+get_transcript_codecs()
 
 # Initialize session state
 if "messages" not in st.session_state:
@@ -281,7 +928,33 @@ if "page" not in st.session_state:
 # Check for existing login session
 check_login_session()
 
+# Resume an in-progress conversation saved by this or another replica, then persist any changes made since
+if st.session_state.user_email:
+    if st.session_state.get("session_restored_for") != st.session_state.user_email:
+        saved_state = get_session_writer().load(st.session_state.user_email)
+        if saved_state:
+            st.session_state.update(saved_state)
+        if "conversation_id" not in st.session_state:
+            st.session_state.conversation_id = uuid.uuid4().hex
+        draft = get_draft_log().load(st.session_state.user_email, st.session_state.conversation_id)
+        if draft:
+            st.session_state.messages = draft
+        else:
+            # Drafts saved before turns were logged separately carry their messages in the snapshot
+            for turn, message in enumerate(st.session_state.messages):
+                get_draft_log().append(st.session_state.user_email, st.session_state.conversation_id, turn, message)
+        st.session_state.session_restored_for = st.session_state.user_email
+    get_session_writer().stage(st.session_state.user_email, session_snapshot())
+
+# The voice worker lives only while voice mode is on for a conversation in progress
+if not (st.session_state.user_email and st.session_state.page == "main"
+        and st.session_state.get("voice_mode") and not st.session_state.conversation_ended):
+    close_voice_session()
+
 # Sidebar for user info and past entries
+if st.session_state.user_email is not None:
+    prefetch_page_data(st.session_state.user_email, st.session_state.page)
+
 with st.sidebar:    
     if st.session_state.user_email is None or st.session_state.user_name is None:
         st.title("Login or Register")
@@ -324,7 +997,7 @@ with st.sidebar:
         if st.button("New Journal Entry", key="new_entry_button", type="primary"):
             st.session_state.page = "main"
             st.session_state.conversation_ended = False
-            st.session_state.messages = []
+            start_conversation()
             st.session_state.first_response_given = False
             st.session_state.summary_generated = False
             if 'summary' in st.session_state:
@@ -345,6 +1018,9 @@ with st.sidebar:
         
         # Add "Share Feedback" and "Logout" link at the bottom of the sidebar
         if st.button("Logout"):
+            get_draft_log().flush(st.session_state.user_email, st.session_state.conversation_id)
+            get_session_writer().stage(st.session_state.user_email, session_snapshot())
+            get_session_writer().flush(st.session_state.user_email)
             # Sign out from Supabase
             st_supabase.auth.sign_out()
             # Clear local session data
@@ -373,17 +1049,31 @@ if st.session_state.page == "main":
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
+        # Voice mode: spoken utterances are fed into the same chat loop as typed messages
+        webrtc_ctx = None
+        if not st.session_state.conversation_ended and st.toggle("Voice mode", key="voice_mode"):
+            webrtc_ctx = webrtc_streamer(
+                key="voice_journal",
+                mode=WebRtcMode.SENDONLY,
+                audio_receiver_size=256,
+                media_stream_constraints={"video": False, "audio": True},
+            )
+            voice_placeholder = st.empty()
+
         # Chat input
-        if not st.session_state.conversation_ended and (prompt := st.chat_input("How are you feeling right now?")):
+        if not st.session_state.conversation_ended and (prompt := st.chat_input("How are you feeling right now?") or st.session_state.pop("voice_prompt", None)):
             # Set first_response_given to True
             st.session_state.first_response_given = True
             # Add user message to chat history
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            add_message("user", prompt)
             with st.chat_message("user"):
                 st.markdown(prompt)
 
             # Prepare messages for API call
             system_message = f"You are a close confidante. Your friend, {st.session_state.user_name}, will tell you how they are feeling and what's on their mind. Listen intently, prompt them to open up and share more about their thoughts and feelings without judgement. Be a friendly, supportive presence, and give a neutral, safe and comfortable tone. Compliment and encourage your friend as much as possible."
+            memory_block = get_memory_block(st.session_state.user_email)
+            if memory_block:
+                system_message += "\n\n" + memory_block
             
             messages = [
                 {"role": "system", "content": system_message},
@@ -395,43 +1085,46 @@ if st.session_state.page == "main":
             # Create a placeholder for the assistant's response
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
-                full_response = ""
 
             # Stream the response
-            for chunk in client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.1,
-                stream=True,
-            ):
-                if chunk.choices[0].delta.content is not None:
-                    full_response += chunk.choices[0].delta.content
-                    message_placeholder.markdown(full_response + "▌")
-            
-            # Remove the blinking cursor
-            message_placeholder.markdown(full_response)
+            full_response = stream_chat(messages, message_placeholder, "chat", st.session_state.user_email)
 
             # Add assistant message to chat history
-            st.session_state.messages.append({"role": "assistant", "content": full_response})
+            add_message("assistant", full_response)
+            get_session_writer().stage(st.session_state.user_email, session_snapshot())
 
         # End Conversation and Log Journal Entry button
         if st.session_state.first_response_given and not st.session_state.conversation_ended and not st.session_state.summary_generated:
             if st.button("Finish Conversation and Log Entry"):
                 st.session_state.conversation_ended = True
-                with st.spinner("Generating your journal entry summary, detecting emotions, people, and topics..."):
-                    summary = generate_summary(st.session_state.messages)
-                    emotions = detect_emotions(st.session_state.messages)
-                    people = detect_people(st.session_state.messages)
-                    topics = detect_topics(st.session_state.messages)
+                try:
+                    get_draft_log().flush(st.session_state.user_email, st.session_state.conversation_id)
+                except Exception:
+                    # The draft is only a safety net; the entry below is saved from this session's messages
+                    logging.getLogger("session_store").exception("Flushing the draft before saving failed")
+                # Show the summary as it is written instead of behind the spinner
+                st.success("Great job reflecting on your day! Here's your journal entry summary:")
+                summary = generate_summary(st.session_state.messages, placeholder=st.empty(), user_email=st.session_state.user_email)
+                with st.spinner("Detecting emotions, people, and topics..."):
+                    emotions = detect_emotions(st.session_state.messages, st.session_state.user_email)
+                    people = detect_people(st.session_state.messages, st.session_state.user_email)
+                    topics = detect_topics(st.session_state.messages, st.session_state.user_email)
                 
                 # Save summary, emotions, people, and topics to database
-                save_to_db(st.session_state.user_email, st.session_state.user_name, summary, emotions, people, topics)
-                
+                save_to_db(st.session_state.user_email, st.session_state.user_name, summary, emotions, people, topics, st.session_state.messages)
+                # The entry now holds the conversation, so its draft turns are no longer needed
+                try:
+                    get_draft_log().clear(st.session_state.user_email, st.session_state.conversation_id)
+                except Exception:
+                    logging.getLogger("session_store").exception("Clearing the saved conversation's draft failed")
+
                 st.session_state.summary = summary
                 st.session_state.emotions = emotions
                 st.session_state.people = people
                 st.session_state.topics = topics
                 st.session_state.summary_generated = True
+                get_session_writer().stage(st.session_state.user_email, session_snapshot())
+                get_session_writer().flush(st.session_state.user_email)
                 st.rerun()  # Force a rerun to update the UI
 
         # Display summary, emotions, people, and topics if they have been generated
@@ -458,12 +1151,18 @@ if st.session_state.page == "main":
         if st.session_state.conversation_ended:
             if st.button("Log a New Entry"):
                 st.session_state.conversation_ended = False
-                st.session_state.messages = []
+                start_conversation()
                 st.session_state.first_response_given = False
                 st.session_state.summary_generated = False
                 if 'summary' in st.session_state:
                     del st.session_state.summary
                 st.rerun()
+        # Keep listening last, so the page above stays interactive while the user talks
+        if webrtc_ctx is not None and not st.session_state.conversation_ended:
+            utterance = listen_for_utterance(webrtc_ctx, voice_placeholder)
+            if utterance:
+                st.session_state.voice_prompt = utterance
+                st.rerun()
     else:
         st.info("Enter your email and name in the sidebar to start journaling.")
 
@@ -478,23 +1177,27 @@ elif st.session_state.page == "rag":
     # Fetch all user's entries
     entries = get_past_entries(st.session_state.user_email)
 
-    # Combine all entries into a single context string
-    context = "\n\n".join([f"Date: {date}, Time: {time}\n{summary}\nEmotions: {emotions}\nPeople: {people}\nTopics: {topics}" for _, date, time, summary, emotions, people, topics in entries])
+    # Once per session: catch up on digests for weeks or months that closed since the last save,
+    # and mark the user as active so their predefined answers keep being warmed
+    if not st.session_state.get("rag_background_scheduled"):
+        get_digest_scheduler().schedule(st.session_state.user_email)
+        conn = get_db_connection(user_email=st.session_state.user_email)
+        cur = conn.cursor()
+        answer_warmer.touch_activity(cur, st.session_state.user_email)
+        conn.commit()
+        cur.close()
+        conn.close()
+        get_answer_warmer().schedule(st.session_state.user_email)
+        st.session_state.rag_background_scheduled = True
+
+    # Combine entries (and digests of older periods) into a single context string
+    context = build_rag_context(st.session_state.user_email, entries)
 
     # Text input for custom or selected question
     user_query = st.text_input("", value=st.session_state.get('selected_question', ''), placeholder="Select a question from below or type your own")
 
-    # Predefined questions
-    predefined_questions = [
-        "What brings me the most joy?",
-        "What drains my energy most?",
-        "What are some recurring topics from my entries?",
-        "What book recommendations do you have based on my entries?",
-        "Count of entries by emotions and give the corresponding dates",
-    ]
-
     # Create buttons for predefined questions
-    for question in predefined_questions:
+    for question in PREDEFINED_QUESTIONS:
           if st.button(question, key=f"btn_{question}"):
             st.session_state.selected_question = question
             st.rerun()  # Add this line to update the input box immediately
@@ -503,20 +1206,19 @@ elif st.session_state.page == "rag":
     analyze_button = st.button("Analyze Question", type="primary")
 
     if user_query and analyze_button:
-        with st.spinner("Analyzing your journal entries..."):
-            messages = [
-                {"role": "system", "content": "You are an AI assistant analyzing journal entries. Use the provided context to answer the user's question."},
-                {"role": "user", "content": f"Context: {context}\n\nQuestion: {user_query}"}
-            ]
-
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.1,
-            )
-
-            st.write("Answer:")
-            st.write(response.choices[0].message.content)
+        # Answers are reused until this user's entries change on any replica;
+        # predefined ones are usually already warmed in the background
+        version = get_cache_sync().get_version(st.session_state.user_email)
+        answer = get_cached_answer(st.session_state.user_email, user_query, version)
+        st.write("Answer:")
+        if answer is MISSING:
+            # Stream the answer in as it is generated; one made over the budget isn't kept for later
+            level = get_budget_policy().level(st.session_state.user_email)
+            answer = stream_chat(rag_messages(context, user_query), st.empty(), "rag", st.session_state.user_email, level)
+            if level == usage_ledger.NORMAL:
+                store_answer(st.session_state.user_email, user_query, version, answer)
+        else:
+            st.write(answer)
 
     # Add horizontal line and Visualisations header
     st.markdown("---")
@@ -541,8 +1243,13 @@ elif st.session_state.page == "past_entries":
         st.session_state.page = "main"
         st.rerun()
     
-    entries = get_past_entries(st.session_state.user_email)
+    st.toggle(f"Include entries older than {PAST_ENTRIES_RECENT_MONTHS} months", key="past_entries_show_older")
+    since = past_entries_since()
+    entries = get_past_entries(st.session_state.user_email, since)
     if entries:
+        entries_by_id = {entry[0]: entry for entry in entries}
+        similar_index = get_similar_index(st.session_state.user_email)
+
         # Create sets of unique emotions, people, and topics from all entries
         all_emotions = set()
         all_people = set()
@@ -633,15 +1340,34 @@ elif st.session_state.page == "past_entries":
                 st.write("Topics:")
                 topics_html = "".join(topic_tag(t) for t in topics.split(',') if t.strip() != 'None')
                 st.markdown(topics_html if topics_html else "No specific topics identified", unsafe_allow_html=True)
+
+                # Entries with overlapping themes
+                similar = [(entries_by_id[i], score) for i, score in similar_index.similar_to(entry_id, k=3) if i in entries_by_id]
+                if similar:
+                    st.write("Similar days:")
+                    for (_, similar_date, similar_time, similar_summary, _, _, _), score in similar:
+                        preview = similar_summary if len(similar_summary) <= 120 else similar_summary[:117] + "..."
+                        st.caption(f"**{similar_date}, {similar_time}** ({score:.0%} overlap) — {preview}")
+
+                # The full conversation is fetched and decompressed only when asked for
+                if st.toggle("Show conversation", key=f"transcript_{entry_id}"):
+                    messages = get_transcript(st.session_state.user_email, entry_id)
+                    if messages is None:
+                        st.caption("No conversation was kept for this entry.")
+                    for message in messages or []:
+                        with st.chat_message(message["role"]):
+                            st.markdown(message["content"])
                 
                 # Delete button for each entry
                 if st.button("Delete Entry", key=f"delete_{entry_id}"):
-                    delete_entry(entry_id)
+                    delete_entry(st.session_state.user_email, entry_id)
                     st.success("Entry deleted successfully!")
                     st.rerun()
                     
         if not filtered_entries:
             st.info("No entries match the selected filters.")
+    elif since is not None:
+        st.info(f"No entries in the last {PAST_ENTRIES_RECENT_MONTHS} months.")
     else:
         st.info("No past entries found.")
     
@@ -663,78 +1389,81 @@ elif st.session_state.page == "visualisations":
     entries = get_past_entries(st.session_state.user_email)
     
     if entries:
-        # Create a DataFrame for plotting
-        import plotly.graph_objects as go
-        
-        # Extract dates and emotions from entries
-        data = []
-        for _, date, _, _, emotions, _, _ in entries:
-            emotion_list = [e.strip() for e in emotions.split(',')]
-            # Count each emotion only once per date
-            unique_emotions = set(emotion_list)
-            for emotion in unique_emotions:
-                data.append({'Date': pd.to_datetime(date, format='%d %B %Y'), 'Emotion': emotion})
-        
-        df = pd.DataFrame(data)
-        
-        # Count emotions by date (now each emotion will be counted only once per date)
-        emotion_counts = df.pivot_table(
-            index='Date',
-            columns='Emotion',
-            aggfunc=len,
-            fill_value=0
-        )
-
-        # Create stacked bar chart
-        fig = go.Figure()
-        
-        # Add bars for each emotion
-        for emotion in emotion_counts.columns:
-            fig.add_trace(go.Bar(
-                name=emotion,
-                x=emotion_counts.index,
-                y=emotion_counts[emotion],
-                hovertemplate="Date: %{x}<br>" +
-                             f"{emotion}: %{{y}}<br>" +
-                             "<extra></extra>"
-            ))
+        data = get_mood_data(st.session_state.user_email)
+        first_day = data.start.astype(object)
+        last_day = data.dates()[-1].astype(object)
 
-        # Update layout for better readability
-        fig.update_layout(
-            barmode='stack',
-            title='My Emotions Trend',
-            xaxis_title="Date",
-            yaxis_title="Number of Emotions",
-            legend_title="Emotions",
-            hovermode='x unified',
-            showlegend=True,
-            height=500,
-            # Update x-axis format to show dates as "DD MMM YYYY"
-            xaxis=dict(
-                tickformat='%d %b %Y',
-                dtick='D1'  # Show tick for each day
-            ),
-            # Format y-axis to show only whole numbers
-            yaxis=dict(
-                dtick=1,
-                tick0=0,
-                tickmode='linear'
-            )
+        # Date range selector; the bucket size follows the span that's selected
+        selected_range = st.date_input(
+            "Date range",
+            value=(max(first_day, last_day - timedelta(days=89)), last_day),
+            min_value=first_day,
+            max_value=last_day,
         )
-        
+        range_start, range_end = selected_range if len(selected_range) == 2 else (selected_range[0], selected_range[0])
+        auto_granularity = choose_granularity(range_start, range_end)
+        granularity = st.radio(
+            "Group by",
+            ["day", "week", "month"],
+            index=["day", "week", "month"].index(auto_granularity),
+            format_func=str.capitalize,
+            horizontal=True,
+        )
+
         # Display the plot
+        fig = pio.from_json(get_trend_figure_json(st.session_state.user_email, range_start, range_end, granularity))
         st.plotly_chart(fig, use_container_width=True)
-        
+
         # Add a data table below the chart
-        st.subheader("Daily Emotion Counts")
-        
-        # Format the date without time before displaying
-        display_df = emotion_counts.reset_index()
-        display_df['Date'] = display_df['Date'].dt.strftime('%d %b %Y')
-        
+        st.subheader(f"Emotion Counts by {granularity.capitalize()}")
+        buckets, counts = bucket_counts(data, range_start, range_end, granularity)
+        display_df = pd.DataFrame(counts.astype(int), columns=EMOTIONS)
+        display_df.insert(0, BUCKET_LABELS[granularity], pd.to_datetime(buckets).strftime(BUCKET_TICK_FORMATS[granularity]))
+        display_df = display_df.loc[:, (display_df != 0).any(axis=0)]
+
         st.dataframe(
-            display_df.sort_values('Date', ascending=False),
+            display_df.iloc[::-1],
             hide_index=True
         )
+
+        analytics = get_mood_analytics(st.session_state.user_email)
+
+        # Streaks of consecutive days
+        st.subheader("Streaks")
+        streak_columns = st.columns(len(analytics["streaks"]))
+        for column, (name, (longest, current)) in zip(streak_columns, analytics["streaks"].items()):
+            column.metric(name, f"{current} days", f"best {longest}", delta_color="off")
+
+        # Rolling share of entries tagged with each emotion
+        st.subheader("Rolling Emotion Rates")
+        window = st.radio("Window", [7, 30], format_func=lambda w: f"{w} days", horizontal=True)
+        rates = analytics["rolling"][window]
+        rates_fig = go.Figure()
+        for i, emotion in enumerate(EMOTIONS):
+            rates_fig.add_trace(go.Scatter(
+                name=emotion,
+                x=analytics["dates"],
+                y=rates[:, i],
+                mode="lines",
+                hovertemplate=f"{emotion}: %{{y:.0%}}<extra></extra>"
+            ))
+        rates_fig.update_layout(
+            yaxis=dict(tickformat=".0%", range=[0, 1]),
+            hovermode="x unified",
+            height=400,
+        )
+        st.plotly_chart(rates_fig, use_container_width=True)
+
+        # How much more often an emotion shows up alongside a person or topic than by chance
+        st.subheader("What Goes With Each Emotion")
+        st.caption("Lift above 1 means the emotion appears with that person or topic more often than usual.")
+        people_lift, people_names = analytics["people_lift"]
+        if people_names:
+            st.plotly_chart(lift_heatmap(people_lift, people_names, "Emotions by Person"), use_container_width=True)
+        topic_lift, topic_names = analytics["topic_lift"]
+        if topic_names:
+            st.plotly_chart(lift_heatmap(topic_lift, topic_names, "Emotions by Topic"), use_container_width=True)
     else:
-        st.info("No entries found to visualize.")
\ No newline at end of file
+        st.info("No entries found to visualize.")
+
+request_loader.close()
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+class BackgroundLoop:
+    """An asyncio event loop on a daemon thread, callable from Streamlit's synchronous script.
+
+    Async clients (HTTP, database pools) are bound to the loop they first run on, so they
+    are created and used only through this one long-lived loop.
+    """
+
+    def __init__(self, name="async-bridge"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and block until it finishes"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def gather(self, *awaitables, timeout=None):
+        """Run awaitables concurrently on the loop and block until all finish; returns their results in order"""
+        async def gather():
+            return await asyncio.gather(*awaitables)
+        return self.run(gather(), timeout)
+
+    def submit(self, coro):
+        """Schedule a coroutine without waiting; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
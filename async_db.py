@@ -0,0 +1,34 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from data_loader import active_loader
+
+class AsyncDatabase:
+    """asyncio front end over the pooled, shard- and replica-aware psycopg2 connections.
+
+    psycopg2 blocks, so each query helper runs on a worker thread with its own pooled
+    connection; awaiting several of them with asyncio.gather overlaps their round trips and
+    a page waits only on the slowest. `max_workers` should not exceed a shard's pool size.
+    bind(fn), if given, is applied to each helper on the calling thread, e.g. to carry the
+    caller's Streamlit script context over to the worker.
+    """
+
+    def __init__(self, max_workers=8, bind=None):
+        self._bind = bind
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="async-db")
+
+    def call(self, fn, *args, **kwargs):
+        """An awaitable running a blocking function (a query helper) on the worker threads. Its
+        queries count toward the RequestLoader of the thread calling this, which is captured
+        here because the awaitable itself runs on the event loop's thread"""
+        work = functools.partial(fn, *args, **kwargs)
+        loader = active_loader()
+        if loader is not None:
+            work = loader.bind(work)
+        if self._bind is not None:
+            work = self._bind(work)
+        return self._run(work)
+
+    async def _run(self, work):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, work)
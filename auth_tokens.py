@@ -0,0 +1,262 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import jwt
+from cryptography.fernet import Fernet
+
+logger = logging.getLogger("auth_tokens")
+
+class InvalidToken(Exception):
+    pass
+
+class VerificationUnavailable(Exception):
+    """Neither the signing keys nor Supabase could be reached to check a token; says nothing about the token"""
+
+def _post_json(url, body, headers, timeout):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json", **headers})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+def _get_json(url, headers, timeout):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+        return json.loads(response.read())
+
+class TokenVerifier:
+    """Verifies Supabase access tokens locally.
+
+    Signing keys come from the project's JWKS endpoint and are cached in process; they are
+    refetched only when a token names an unknown key id, at most every `min_refetch`
+    seconds (every `retry_after` seconds while fetching fails). Projects still on a shared
+    HS256 secret pass it as `jwt_secret`. Tokens that can't be checked locally (an HS256
+    token without the secret, or keys that can't be fetched) are checked remotely with
+    Supabase's get-user endpoint instead. Verified claims are cached for `cache_seconds`
+    (never past the token's expiry), so verifying the same token on every rerun is a dict
+    lookup.
+    """
+
+    def __init__(self, supabase_url, api_key, jwt_secret=None, audience="authenticated", cache_seconds=30.0,
+                 leeway=5, min_refetch=60.0, retry_after=5.0, timeout=5.0):
+        self.jwks_url = f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json"
+        self.user_url = f"{supabase_url.rstrip('/')}/auth/v1/user"
+        self._headers = {"apikey": api_key}
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.cache_seconds = cache_seconds
+        self.leeway = leeway
+        self.min_refetch = min_refetch
+        self.retry_after = retry_after
+        self.timeout = timeout
+        self._keys = {}  # kid -> PyJWK
+        self._fetched_at = float("-inf")
+        self._failed_at = float("-inf")
+        self._verified = {}  # sha256(token) -> (claims, valid until)
+        self._lock = threading.Lock()
+
+    def refresh_keys(self):
+        """Fetch the signing keys; also called once at startup so the first login doesn't wait on it.
+        Raises VerificationUnavailable if they can't be fetched"""
+        try:
+            jwks = _get_json(self.jwks_url, self._headers, self.timeout)
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._failed_at = time.monotonic()
+            raise VerificationUnavailable(f"fetching signing keys failed: {e}") from e
+        keys = {}
+        for key in jwks.get("keys", []):
+            try:
+                keys[key.get("kid")] = jwt.PyJWK(key)
+            except jwt.PyJWKError:
+                continue  # algorithms this PyJWT build can't use
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _signing_key(self, header):
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise VerificationUnavailable("HS256 token but no JWT secret configured")
+            return self.jwt_secret, algorithm
+        kid = header.get("kid")
+        now = time.monotonic()
+        with self._lock:
+            key = self._keys.get(kid)
+            fetched = self._fetched_at > float("-inf")
+            may_refetch = now - self._fetched_at >= self.min_refetch and now - self._failed_at >= self.retry_after
+        if key is None and may_refetch:
+            # Keys rotated since the last fetch, or never fetched
+            self.refresh_keys()
+            with self._lock:
+                key = self._keys.get(kid)
+                fetched = True
+        if key is None:
+            if not fetched:
+                raise VerificationUnavailable("signing keys not fetched yet")
+            raise InvalidToken("unknown signing key")
+        return key.key, algorithm
+
+    def _verify_remote(self, token):
+        # Supabase checks the token itself; its own claims are then safe to read unverified
+        try:
+            user = _get_json(self.user_url, {**self._headers, "Authorization": f"Bearer {token}"}, self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                raise InvalidToken(f"rejected by Supabase ({e.code})") from e
+            raise VerificationUnavailable(f"checking the token with Supabase failed: {e}") from e
+        except (OSError, ValueError) as e:
+            raise VerificationUnavailable(f"checking the token with Supabase failed: {e}") from e
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False, "require": ["exp", "sub"]})
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e)) from e
+        claims["email"] = user.get("email", claims.get("email"))
+        claims["user_metadata"] = user.get("user_metadata", claims.get("user_metadata"))
+        return claims
+
+    def verify(self, token):
+        """The token's claims if it is validly signed and unexpired; raises InvalidToken otherwise,
+        or VerificationUnavailable if it can't be checked right now"""
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._verified.get(digest)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        try:
+            key, algorithm = self._signing_key(jwt.get_unverified_header(token))
+            claims = jwt.decode(token, key, algorithms=[algorithm], audience=self.audience, leeway=self.leeway,
+                                options={"require": ["exp", "sub"]})
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e)) from e
+        except VerificationUnavailable:
+            claims = self._verify_remote(token)
+        with self._lock:
+            self._verified[digest] = (claims, min(now + self.cache_seconds, claims["exp"]))
+            if len(self._verified) > 10000:
+                self._verified = {d: c for d, c in self._verified.items() if c[1] > now}
+        return claims
+
+class RotationStore:
+    """Refresh token rotations in Postgres, so any replica can answer for a token already exchanged.
+
+    Rows are keyed by a hash of the old refresh token and hold the new session encrypted with
+    a key derived from that token, so a row is useless to anyone who doesn't hold it. Rows
+    older than `keep` seconds are ignored and pruned as new ones are written.
+    """
+
+    def __init__(self, connect, keep=86400.0):
+        self._connect = connect
+        self.keep = keep
+
+    @staticmethod
+    def ensure_schema(cur):
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS auth_rotations
+            (token_hash BYTEA PRIMARY KEY,
+             session BYTEA NOT NULL,
+             rotated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+        ''')
+        cur.execute("CREATE INDEX IF NOT EXISTS auth_rotations_rotated_at_idx ON auth_rotations (rotated_at)")
+
+    @staticmethod
+    def _keys(refresh_token):
+        digest = hashlib.sha256(refresh_token.encode()).digest()
+        cipher = Fernet(base64.urlsafe_b64encode(hashlib.sha256(b"key" + digest).digest()))
+        return hashlib.sha256(b"id" + digest).digest(), cipher
+
+    def load(self, refresh_token):
+        token_hash, cipher = self._keys(refresh_token)
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT session FROM auth_rotations WHERE token_hash = %s AND rotated_at > now() - make_interval(secs => %s)",
+                    (token_hash, self.keep)
+                )
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        return json.loads(cipher.decrypt(bytes(row[0]))) if row else None
+
+    def save(self, refresh_token, session):
+        token_hash, cipher = self._keys(refresh_token)
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO auth_rotations (token_hash, session) VALUES (%s, %s) ON CONFLICT (token_hash) DO NOTHING",
+                    (token_hash, cipher.encrypt(json.dumps(session).encode()))
+                )
+                cur.execute("DELETE FROM auth_rotations WHERE rotated_at < now() - make_interval(secs => %s)", (self.keep,))
+            conn.commit()
+        finally:
+            conn.close()
+
+class SessionRefresher:
+    """Exchanges Supabase refresh tokens in line, during a rerun that then writes the new pair to the cookies.
+
+    `due(expires_at)` is true `margin` seconds before an access token expires, so sessions in
+    use are refreshed before it lapses. Refresh tokens are single-use, so every exchange is
+    recorded under the old token, in process and in `rotations` (a RotationStore) when given:
+    a rerun on any replica that presents the old token again (another tab, a cookie written
+    before a restart) gets the same new session instead of spending the token a second time.
+    """
+
+    def __init__(self, supabase_url, api_key, rotations=None, margin=300.0, keep=86400.0, timeout=10.0):
+        self.token_url = f"{supabase_url.rstrip('/')}/auth/v1/token?grant_type=refresh_token"
+        self._headers = {"apikey": api_key}
+        self.rotations = rotations
+        self.margin = margin
+        self.keep = keep
+        self.timeout = timeout
+        self._rotated = {}  # old refresh token -> (new session dict, exchanged at)
+        self._lock = threading.Lock()
+
+    def due(self, expires_at):
+        return expires_at - time.time() <= self.margin
+
+    def _recorded(self, refresh_token):
+        cutoff = time.time() - self.keep
+        with self._lock:
+            rotated = self._rotated.get(refresh_token)
+        if rotated is not None and rotated[1] > cutoff:
+            return rotated[0]
+        if self.rotations is None:
+            return None
+        try:
+            return self.rotations.load(refresh_token)
+        except Exception:
+            logger.exception("Reading refresh token rotations failed")
+            return None
+
+    def exchange(self, refresh_token):
+        """The session that replaces this refresh token, exchanging it unless that already happened (blocking)"""
+        session = self._recorded(refresh_token)
+        if session is not None:
+            return session
+        try:
+            session = _post_json(self.token_url, {"refresh_token": refresh_token}, self._headers, self.timeout)
+        except urllib.error.HTTPError:
+            # Possibly spent a moment ago by a rerun elsewhere, which recorded what it got
+            session = self._recorded(refresh_token)
+            if session is None:
+                raise
+            return session
+        now = time.time()
+        with self._lock:
+            self._rotated[refresh_token] = (session, now)
+            if len(self._rotated) > 10000:
+                self._rotated = {t: r for t, r in self._rotated.items() if r[1] > now - self.keep}
+        if self.rotations is not None:
+            try:
+                self.rotations.save(refresh_token, session)
+            except Exception:
+                # This rerun still gets the session; only other replicas miss the record
+                logger.exception("Recording a refresh token rotation failed")
+        return session
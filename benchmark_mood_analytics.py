@@ -0,0 +1,57 @@
+"""Time the mood analytics engine on synthetic entries.
+
+Usage: python benchmark_mood_analytics.py [--entries 10000] [--repeat 20]
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from mood_analytics import EMOTIONS, MoodData, analyze
+
+def synthetic_entries(n, seed=0):
+    rng = random.Random(seed)
+    people = [f"Person{i}" for i in range(200)]
+    topics = [f"Topic{i}" for i in range(300)]
+    start = date(2020, 1, 1)
+    entries = []
+    for i in range(n):
+        day = start + timedelta(days=int(i * 0.7) + rng.randint(0, 2))
+        emotions = ", ".join(rng.sample(EMOTIONS, rng.randint(1, 3)))
+        entry_people = ", ".join(rng.sample(people, rng.randint(0, 3))) or "None"
+        entry_topics = ", ".join(rng.sample(topics, rng.randint(1, 4)))
+        entries.append((i, day.strftime('%d %B %Y'), "09:00am", "", emotions, entry_people, entry_topics))
+    return entries
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return np.median(times) * 1000, np.max(times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    entries = synthetic_entries(args.entries)
+    data = MoodData(entries)
+    analyze(data)  # warm up
+
+    build_median, build_max = timed(lambda: MoodData(entries), args.repeat)
+    compute_median, compute_max = timed(lambda: analyze(data), args.repeat)
+    print(f"{args.entries} entries over {data.n_days} days, {len(data.people_names)} people, {len(data.topic_names)} topics")
+    print(f"build arrays (once per data version): median {build_median:.1f} ms, max {build_max:.1f} ms")
+    print(f"analytics (rolling, streaks, lift):   median {compute_median:.1f} ms, max {compute_max:.1f} ms")
+    # A new data version pays for both, so both count toward the target
+    total = build_median + compute_median
+    print(f"build + analytics:                    median {total:.1f} ms")
+    print("PASS" if total < 100 else "FAIL", "- target < 100 ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import json
+import select
+import threading
+import time
+from collections import OrderedDict
+
+# Postgres channel that save/delete notify on; payload is {"user": ..., "version": ...}
+CHANNEL = "journal_data_changed"
+
+# Returned by VersionedCache.get when there is no fresh value
+MISSING = object()
+
+class VersionedCache:
+    """LRU cache whose entries are only valid for the user data version they were computed at"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_email, key, version):
+        with self._lock:
+            item = self._data.get((user_email, key))
+            if item is None or item[0] != version:
+                return MISSING
+            self._data.move_to_end((user_email, key))
+            return item[1]
+
+    def set(self, user_email, key, version, value):
+        with self._lock:
+            self._data[(user_email, key)] = (version, value)
+            self._data.move_to_end((user_email, key))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def evict(self, user_email, key):
+        with self._lock:
+            self._data.pop((user_email, key), None)
+
+    def evict_user(self, user_email, older_than=None):
+        """Drop a user's entries, or only those computed before the given version"""
+        with self._lock:
+            stale = [k for k, (v, _) in self._data.items()
+                     if k[0] == user_email and (older_than is None or v < older_than)]
+            for k in stale:
+                del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class CacheSync:
+    """Keeps per-user data versions in step across processes via LISTEN/NOTIFY.
+
+    Writers call bump_version inside their transaction; the NOTIFY is delivered to every
+    process on commit and a listener thread advances the local version and evicts stale
+    cache entries, so other replicas stop serving old data within milliseconds. The writing
+    process calls committed() once its commit succeeds, so its own caches don't wait for the
+    notification (and never see the new version before the rows are visible).
+    """
+
+    def __init__(self, connect, channel=CHANNEL, reconnect_delay=1.0, listen_connect=None, on_change=None):
+        # connect(user_email) opens a connection to the database holding that user's versions
+        self._connect = connect
+        # The listener holds its connection for the life of the process, so it may want a dedicated one;
+        # a list of callables listens on several databases (one thread each), e.g. every shard
+        listen_connect = listen_connect or (lambda: connect(None))
+        self._listen_connects = list(listen_connect) if isinstance(listen_connect, (list, tuple)) else [listen_connect]
+        # Called with the user_email whenever this process learns of a newer version, or reads
+        # one it had not seen
+        self._on_change = on_change
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.cache = VersionedCache()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+
+    @staticmethod
+    def ensure_schema(cur):
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS user_data_versions
+            (user_email TEXT PRIMARY KEY,
+             version BIGINT NOT NULL DEFAULT 0)
+        ''')
+
+    def bump_version(self, cur, user_email):
+        """Increment the user's data version and queue a NOTIFY; both take effect on commit.
+        Pass the returned version to committed() after committing"""
+        cur.execute(
+            "INSERT INTO user_data_versions (user_email, version) VALUES (%s, 1) "
+            "ON CONFLICT (user_email) DO UPDATE SET version = user_data_versions.version + 1 "
+            "RETURNING version",
+            (user_email,)
+        )
+        version = cur.fetchone()[0]
+        cur.execute("SELECT pg_notify(%s, %s)", (self.channel, json.dumps({"user": user_email, "version": version})))
+        return version
+
+    def committed(self, user_email, version):
+        """The transaction that bumped the user to `version` has committed"""
+        self._apply(user_email, version)
+
+    def get_version(self, user_email):
+        with self._lock:
+            if user_email in self._versions:
+                return self._versions[user_email]
+        # First time this process sees the user: read the authoritative version once,
+        # the listener keeps it current from here on
+        conn = self._connect(user_email)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM user_data_versions WHERE user_email = %s", (user_email,))
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        version = row[0] if row else 0
+        with self._lock:
+            # A notification may have arrived while we were reading
+            if self._versions.get(user_email, -1) < version:
+                self._versions[user_email] = version
+            version = self._versions[user_email]
+        # The version came from the primary; a lagging replica may not have its rows yet, and
+        # whatever is read next gets cached under it, so this user's reads stay on the primary for now
+        if self._on_change is not None:
+            self._on_change(user_email)
+        return version
+
+    def _apply(self, user_email, version):
+        with self._lock:
+            if version <= self._versions.get(user_email, -1):
+                return
+            self._versions[user_email] = version
+        self.cache.evict_user(user_email, older_than=version)
+        if self._on_change is not None:
+            self._on_change(user_email)
+
+    def _forget_all(self):
+        # Notifications may have been missed while disconnected; re-read versions lazily
+        with self._lock:
+            self._versions.clear()
+        self.cache.clear()
+
+    def start(self):
+        if not self._threads:
+            for listen_connect in self._listen_connects:
+                thread = threading.Thread(target=self._run, args=(listen_connect,), name="cache-sync-listener", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, listen_connect):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = listen_connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel};")
+                self._forget_all()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            payload = json.loads(notify.payload)
+                            self._apply(payload["user"], int(payload["version"]))
+                        except (ValueError, KeyError, TypeError):
+                            continue
+            except Exception:
+                self._forget_all()
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
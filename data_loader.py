@@ -0,0 +1,140 @@
+import logging
+import threading
+from concurrent.futures import Future
+
+import psycopg2.extensions
+
+logger = logging.getLogger("data_loader")
+
+_active = threading.local()
+
+def active_loader():
+    """The RequestLoader of the rerun the calling thread is working for, if any"""
+    return getattr(_active, "loader", None)
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts its statements toward the calling thread's active RequestLoader.
+    Pools install it as every connection's cursor class, so queries are counted wherever
+    they come from (cached resources, catalog lookups) as long as a rerun issues them"""
+
+    def execute(self, query, vars=None):
+        loader = active_loader()
+        if loader is not None:
+            loader._count_query()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        loader = active_loader()
+        if loader is not None:
+            loader._count_query()
+        return super().copy_expert(sql, file, size)
+
+class RequestLoader:
+    """Memoizes, batches and counts the DB reads of one script rerun, in the style of DataLoader.
+
+    load(key, fetch) runs fetch() at most once per key for the rerun; a caller asking for a
+    key that another thread is already fetching waits for that result instead of issuing its
+    own query. load_many(kind, keys, batch_fetch) fetches every key of a kind not yet loaded
+    with a single batch_fetch(keys) call. Keys should include the user's data version so a
+    write within the rerun is never hidden by an older value. activate() makes it the
+    calling thread's loader, so every CountingCursor statement that thread runs is counted;
+    bind(fn) carries it to worker threads. close() logs the totals and turns the loader into
+    a pass-through, so code still holding it (background threads) neither shares nor counts.
+    """
+
+    def __init__(self, name="rerun"):
+        self.name = name
+        self.queries = 0
+        self.loads = 0
+        self.hits = 0
+        self._values = {}  # key -> Future
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _count_query(self):
+        with self._lock:
+            if not self._closed:
+                self.queries += 1
+
+    def activate(self):
+        """Count the calling thread's queries toward this loader"""
+        _active.loader = self
+        return self
+
+    def bind(self, fn):
+        """fn, run with this loader active on whichever thread calls it"""
+        def bound(*args, **kwargs):
+            previous = active_loader()
+            _active.loader = self
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _active.loader = previous
+        return bound
+
+    def peek(self, key, default=None):
+        """The value already loaded for key in this rerun, without fetching"""
+        with self._lock:
+            future = self._values.get(key)
+        if future is None or not future.done() or future.exception() is not None:
+            return default
+        return future.result()
+
+    def load(self, key, fetch):
+        with self._lock:
+            if self._closed:
+                return fetch()
+            self.loads += 1
+            future = self._values.get(key)
+            owner = future is None
+            if owner:
+                future = self._values[key] = Future()
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                # Don't memoize failures; the next caller retries
+                with self._lock:
+                    self._values.pop(key, None)
+                future.set_exception(e)
+                raise
+        return future.result()
+
+    def load_many(self, kind, keys, batch_fetch):
+        """{key: value} for keys, fetching the missing ones with one batch_fetch(missing keys) -> dict call;
+        keys the batch leaves out load as None"""
+        keys = list(keys)
+        with self._lock:
+            if self._closed:
+                found = batch_fetch(keys)
+                return {key: found.get(key) for key in keys}
+            self.loads += len(keys)
+            missing = [key for key in keys if (kind, key) not in self._values]
+            self.hits += len(keys) - len(missing)
+            futures = {key: self._values.setdefault((kind, key), Future()) for key in keys}
+        if missing:
+            try:
+                found = batch_fetch(missing)
+            except BaseException as e:
+                with self._lock:
+                    for key in missing:
+                        self._values.pop((kind, key), None)
+                for key in missing:
+                    futures[key].set_exception(e)
+                raise
+            for key in missing:
+                futures[key].set_result(found.get(key))
+        return {key: futures[key].result() for key in keys}
+
+    def close(self):
+        """Log this rerun's totals once and stop memoizing"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._values.clear()
+        if active_loader() is self:
+            _active.loader = None
+        logger.info("%s issued %d queries (%d loads, %d served from the rerun's memo)", self.name, self.queries, self.loads, self.hits)
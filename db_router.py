@@ -0,0 +1,161 @@
+import itertools
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+# Seconds the replica is behind; 0 when it has replayed everything it has received, so an idle
+# primary doesn't look like lag
+REPLICA_LAG_SQL = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose close() hands it back to its pool instead of disconnecting"""
+
+    _pool = None
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return super().close()
+        pool.release(self)
+
+    def disconnect(self):
+        self._pool = None
+        super().close()
+
+class Pool:
+    """ThreadedConnectionPool that waits up to `timeout` seconds for a free connection once
+    `maxconn` are checked out, instead of raising straight away"""
+
+    def __init__(self, dsn, minconn, maxconn, timeout=10.0, cursor_factory=psycopg2.extensions.cursor):
+        # dsn is a libpq connection string/URL or a dict of psycopg2.connect keyword arguments
+        args, kwargs = ((), dict(dsn)) if isinstance(dsn, dict) else ((dsn,), {})
+        self._cursor_factory = cursor_factory
+        self._pool = ThreadedConnectionPool(minconn, maxconn, *args, connection_factory=PooledConnection,
+                                            cursor_factory=cursor_factory, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.timeout = timeout
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no connection free after {self.timeout:g}s")
+        try:
+            while True:
+                conn = self._pool.getconn()
+                if not conn.closed:
+                    conn._pool = self
+                    return conn
+                self._pool.putconn(conn, close=True)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        broken = conn.closed or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if not broken and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Reads never commit; end their transaction so the connection goes back clean
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        # A caller may have installed its own cursor class
+        conn.cursor_factory = self._cursor_factory
+        if not broken and conn.autocommit:
+            conn.autocommit = False
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+class DatabaseRouter:
+    """Sends writes to the primary and spreads reads over replicas.
+
+    Read-your-writes: after a write for a key (the user), reads for that key go to the
+    primary for `pin_seconds`. Replicas more than `max_lag` seconds behind are skipped
+    (lag is re-measured at most every `lag_check_interval` seconds); with no usable
+    replica, reads fall back to the primary. Each pool holds up to `maxconn` connections
+    and callers wait up to `acquire_timeout` seconds for one when all are in use.
+    `cursor_factory` is every connection's default cursor class.
+    """
+
+    def __init__(self, primary_dsn, replica_dsns=(), pin_seconds=5.0, max_lag=2.0, lag_check_interval=1.0, minconn=1, maxconn=20,
+                 acquire_timeout=10.0, cursor_factory=psycopg2.extensions.cursor):
+        self.primary = Pool(primary_dsn, minconn, maxconn, acquire_timeout, cursor_factory)
+        self.replicas = [Pool(dsn, minconn, maxconn, acquire_timeout, cursor_factory) for dsn in replica_dsns]
+        self.pin_seconds = pin_seconds
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._pins = {}
+        self._lag = {}  # replica index -> (measured at, lag seconds or None if unreachable)
+        self._next_replica = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+        self._lock = threading.Lock()
+
+    def connect(self, read_only=False, key=None):
+        """A pooled connection; conn.close() returns it to its pool"""
+        if read_only and self.replicas and not self._pinned(key):
+            replica = self._pick_replica()
+            if replica is not None:
+                try:
+                    return replica.acquire()
+                except psycopg2.Error:
+                    pass
+        return self.primary.acquire()
+
+    def pin(self, key):
+        """Route this key's reads to the primary for the next pin_seconds"""
+        if key is None:
+            return
+        with self._lock:
+            self._pins[key] = time.monotonic() + self.pin_seconds
+            if len(self._pins) > 10000:
+                now = time.monotonic()
+                self._pins = {k: until for k, until in self._pins.items() if until > now}
+
+    def _pinned(self, key):
+        if key is None:
+            return False
+        with self._lock:
+            return self._pins.get(key, 0) > time.monotonic()
+
+    def _pick_replica(self):
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                index = next(self._next_replica)
+            lag = self.replica_lag(index)
+            if lag is not None and lag <= self.max_lag:
+                return self.replicas[index]
+        return None
+
+    def replica_lag(self, index):
+        now = time.monotonic()
+        with self._lock:
+            measured = self._lag.get(index)
+        if measured is not None and now - measured[0] < self.lag_check_interval:
+            return measured[1]
+        lag = None
+        try:
+            conn = self.replicas[index].acquire()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    lag = float(cur.fetchone()[0])
+            finally:
+                conn.close()
+        except psycopg2.Error:
+            lag = None
+        with self._lock:
+            self._lag[index] = (now, lag)
+        return lag
+
+    def closeall(self):
+        self.primary.closeall()
+        for replica in self.replicas:
+            replica.closeall()
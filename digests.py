@@ -0,0 +1,227 @@
+import logging
+import queue
+import threading
+import uuid
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger("digests")
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+def month_start(day):
+    return day.replace(day=1)
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def ensure_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS digests
+        (user_email TEXT NOT NULL,
+         period_type TEXT NOT NULL,
+         period_start DATE NOT NULL,
+         period_end DATE NOT NULL,
+         summary TEXT NOT NULL,
+         entry_count INTEGER NOT NULL,
+         closed BOOLEAN NOT NULL,
+         created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+         PRIMARY KEY (user_email, period_type, period_start))
+    ''')
+    # Who is building a user's digests, until when (see DigestScheduler)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS digest_builds
+        (user_email TEXT PRIMARY KEY,
+         owner TEXT NOT NULL,
+         lease_until TIMESTAMPTZ NOT NULL)
+    ''')
+
+def load_digests(cur, user_email):
+    """{(period_type, period_start): row dict} for a user"""
+    cur.execute(
+        "SELECT period_type, period_start, period_end, summary, entry_count, closed FROM digests WHERE user_email = %s",
+        (user_email,)
+    )
+    return {
+        (period_type, period_start): {"period_type": period_type, "period_start": period_start, "period_end": period_end,
+                                      "summary": summary, "entry_count": entry_count, "closed": closed}
+        for period_type, period_start, period_end, summary, entry_count, closed in cur.fetchall()
+    }
+
+def _save_digest(cur, user_email, period_type, start, end, summary, entry_count, closed):
+    cur.execute(
+        "INSERT INTO digests (user_email, period_type, period_start, period_end, summary, entry_count, closed) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (user_email, period_type, period_start) DO UPDATE SET period_end = EXCLUDED.period_end, "
+        "summary = EXCLUDED.summary, entry_count = EXCLUDED.entry_count, closed = EXCLUDED.closed, created_at = now()",
+        (user_email, period_type, start, end, summary, entry_count, closed)
+    )
+
+def _needs_build(existing, entry_count):
+    # A closed period is rebuilt only if it was built while open or its entries changed since
+    return existing is None or not existing["closed"] or existing["entry_count"] != entry_count
+
+def _transaction(connect, user_email, work):
+    """Run work(cur) in its own short transaction on a connection held only for that long"""
+    conn = connect(user_email)
+    try:
+        cur = conn.cursor()
+        result = work(cur)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def build_digests(connect, user_email, summarize, today, renew=lambda: True):
+    """Bring a user's weekly and monthly digests up to date; returns how many were (re)built or removed.
+
+    Weekly digests summarize raw entries; monthly digests summarize the weekly digests of
+    the weeks starting in that month, so no LLM call ever sees a whole month of raw entries.
+    Only closed periods get a digest: the RAG context reads them only for periods well in
+    the past, and open ones are still sent as raw entries.
+    summarize(kind, period_label, text) returns the digest text. No connection is held
+    during an LLM call: entries are read up front and each digest is committed as soon as
+    it is built, so a failure keeps the digests built before it. renew() is called before
+    each LLM call and stops the build when it returns False.
+    """
+    def read(cur):
+        cur.execute(
+            "SELECT date, time, summary, emotions, people, topics FROM logs WHERE user_email = %s ORDER BY date, time",
+            (user_email,)
+        )
+        return cur.fetchall(), load_digests(cur, user_email)
+
+    def save(*digest):
+        _transaction(connect, user_email, lambda cur: _save_digest(cur, user_email, *digest))
+
+    entries, existing = _transaction(connect, user_email, read)
+    built = 0
+
+    weeks = {}
+    for row in entries:
+        weeks.setdefault(week_start(datetime.strptime(row[0], '%Y-%m-%d').date()), []).append(row)
+
+    months = {}
+    for start in weeks:
+        months.setdefault(month_start(start), []).append(start)
+
+    # Periods whose entries were all deleted no longer get a digest
+    stale_weeks = [start for period_type, start in existing if period_type == "week" and start not in weeks]
+    stale_months = [start for period_type, start in existing if period_type == "month" and start not in months]
+    if stale_weeks or stale_months:
+        _transaction(connect, user_email, lambda cur: cur.execute(
+            "DELETE FROM digests WHERE user_email = %s AND (period_type = 'week' AND period_start = ANY(%s) "
+            "OR period_type = 'month' AND period_start = ANY(%s))", (user_email, stale_weeks, stale_months)
+        ))
+        for start in stale_weeks:
+            del existing[("week", start)]
+        for start in stale_months:
+            del existing[("month", start)]
+        built += len(stale_weeks) + len(stale_months)
+
+    for start, week_entries in sorted(weeks.items()):
+        end = start + timedelta(days=6)
+        if end >= today or not _needs_build(existing.get(("week", start)), len(week_entries)):
+            continue
+        if not renew():
+            return built
+        text = "\n\n".join(f"{d} {t}\n{s}\nEmotions: {e}\nPeople: {p}\nTopics: {tp}" for d, t, s, e, p, tp in week_entries)
+        summary = summarize("week", f"the week of {start:%d %B %Y}", text)
+        save("week", start, end, summary, len(week_entries), True)
+        existing[("week", start)] = {"period_type": "week", "period_start": start, "period_end": end,
+                                     "summary": summary, "entry_count": len(week_entries), "closed": True}
+        built += 1
+
+    for start, week_starts in sorted(months.items()):
+        end = next_month(start) - timedelta(days=1)
+        week_digests = [existing.get(("week", w)) for w in sorted(week_starts)]
+        # A month is final only once every week starting in it is final too
+        if end >= today or not all(d is not None and d["closed"] for d in week_digests):
+            continue
+        entry_count = sum(d["entry_count"] for d in week_digests)
+        if not _needs_build(existing.get(("month", start)), entry_count):
+            continue
+        if not renew():
+            return built
+        text = "\n\n".join(f"Week of {d['period_start']:%d %B %Y}:\n{d['summary']}" for d in week_digests)
+        summary = summarize("month", f"{start:%B %Y}", text)
+        save("month", start, end, summary, entry_count, True)
+        built += 1
+    return built
+
+class DigestScheduler:
+    """Builds digests on a low-priority background thread.
+
+    schedule(user) is cheap and deduplicated: a user already queued isn't queued twice.
+    A per-user lease in digest_builds keeps two replicas from building the same digests at
+    once without holding a connection for the whole build; it lasts `lease_seconds` and is
+    renewed before every LLM call, so a crashed builder's lease simply runs out.
+    connect(user_email) opens a connection to the database holding that user's data;
+    summarize(user_email, kind, period_label, text) returns a digest's text. After a build
+    that changed any digest, bump_version(cur, user_email) advances the user's data version
+    (so every replica drops what it cached from the old digests) and on_built(user_email,
+    version) runs once that has committed.
+    """
+
+    def __init__(self, connect, summarize, bump_version=None, on_built=None, today=date.today, lease_seconds=300):
+        self._connect = connect
+        self.lease_seconds = lease_seconds
+        self._today = today
+        self._summarize = summarize
+        self._bump_version = bump_version
+        self._on_built = on_built
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="digest-scheduler", daemon=True)
+        self._thread.start()
+
+    def schedule(self, user_email):
+        with self._lock:
+            if user_email in self._queued:
+                return
+            self._queued.add(user_email)
+        self._queue.put(user_email)
+
+    def _run(self):
+        while True:
+            user_email = self._queue.get()
+            with self._lock:
+                self._queued.discard(user_email)
+            try:
+                self._build(user_email)
+            except Exception:
+                logger.exception("Building digests for a user failed")
+
+    def _claim(self, user_email, owner):
+        """Take or renew the user's build lease; False if another builder holds it"""
+        def claim(cur):
+            cur.execute(
+                "INSERT INTO digest_builds (user_email, owner, lease_until) VALUES (%s, %s, now() + %s * interval '1 second') "
+                "ON CONFLICT (user_email) DO UPDATE SET owner = EXCLUDED.owner, lease_until = EXCLUDED.lease_until "
+                "WHERE digest_builds.owner = EXCLUDED.owner OR digest_builds.lease_until < now() "
+                "RETURNING 1",
+                (user_email, owner, self.lease_seconds)
+            )
+            return cur.fetchone() is not None
+        return _transaction(self._connect, user_email, claim)
+
+    def _build(self, user_email):
+        owner = uuid.uuid4().hex
+        if not self._claim(user_email, owner):
+            return
+        try:
+            built = build_digests(self._connect, user_email, lambda *args: self._summarize(user_email, *args), self._today(),
+                                  renew=lambda: self._claim(user_email, owner))
+        finally:
+            _transaction(self._connect, user_email, lambda cur: cur.execute(
+                "DELETE FROM digest_builds WHERE user_email = %s AND owner = %s", (user_email, owner)
+            ))
+        if not built:
+            return
+        version = _transaction(self._connect, user_email, lambda cur: self._bump_version(cur, user_email)) if self._bump_version else None
+        if self._on_built:
+            self._on_built(user_email, version)
@@ -0,0 +1,164 @@
+import functools
+import re
+import numpy as np
+from numba import njit
+
+# Same five labels the LLM is asked to choose from in detect_emotions
+EMOTIONS = ["Joy", "Sadness", "Fear", "Anger", "Frustration"]
+
+# Word -> {emotion: weight}. Weights are rough evidence strengths, 1.0 being a clear signal.
+LEXICON = {
+    # Joy
+    "happy": {"Joy": 1.0}, "happiness": {"Joy": 1.0}, "joy": {"Joy": 1.0}, "joyful": {"Joy": 1.0},
+    "glad": {"Joy": 0.8}, "excited": {"Joy": 0.9, "Fear": 0.1}, "excite": {"Joy": 0.8},
+    "grateful": {"Joy": 0.9}, "thankful": {"Joy": 0.8}, "proud": {"Joy": 0.8},
+    "love": {"Joy": 0.7}, "loved": {"Joy": 0.7}, "enjoy": {"Joy": 0.8}, "fun": {"Joy": 0.7},
+    "great": {"Joy": 0.5}, "amazing": {"Joy": 0.7}, "wonderful": {"Joy": 0.8}, "awesome": {"Joy": 0.7},
+    "relieved": {"Joy": 0.6}, "calm": {"Joy": 0.4}, "peaceful": {"Joy": 0.5}, "content": {"Joy": 0.4},
+    "laugh": {"Joy": 0.7}, "smile": {"Joy": 0.6}, "celebrate": {"Joy": 0.8}, "accomplished": {"Joy": 0.7},
+    "delighted": {"Joy": 1.0}, "hopeful": {"Joy": 0.6}, "good": {"Joy": 0.3},
+    # Sadness
+    "sad": {"Sadness": 1.0}, "sadness": {"Sadness": 1.0}, "unhappy": {"Sadness": 0.9},
+    "depressed": {"Sadness": 1.0}, "down": {"Sadness": 0.4}, "lonely": {"Sadness": 0.9},
+    "alone": {"Sadness": 0.5}, "cry": {"Sadness": 0.9}, "cried": {"Sadness": 0.9}, "tears": {"Sadness": 0.8},
+    "miss": {"Sadness": 0.6}, "lost": {"Sadness": 0.5}, "grief": {"Sadness": 1.0}, "hurt": {"Sadness": 0.7, "Anger": 0.2},
+    "heartbroken": {"Sadness": 1.0}, "disappointed": {"Sadness": 0.6, "Frustration": 0.4},
+    "empty": {"Sadness": 0.7}, "tired": {"Sadness": 0.3, "Frustration": 0.2}, "exhausted": {"Sadness": 0.4, "Frustration": 0.3},
+    "hopeless": {"Sadness": 1.0, "Fear": 0.2}, "gloomy": {"Sadness": 0.8}, "regret": {"Sadness": 0.7},
+    "upset": {"Sadness": 0.5, "Anger": 0.3},
+    # Fear
+    "afraid": {"Fear": 1.0}, "scared": {"Fear": 1.0}, "fear": {"Fear": 1.0}, "terrified": {"Fear": 1.0},
+    "anxious": {"Fear": 0.9}, "anxiety": {"Fear": 0.9}, "worried": {"Fear": 0.9}, "worry": {"Fear": 0.8},
+    "nervous": {"Fear": 0.8}, "panic": {"Fear": 1.0}, "stressed": {"Fear": 0.5, "Frustration": 0.4},
+    "stress": {"Fear": 0.4, "Frustration": 0.4}, "uncertain": {"Fear": 0.6}, "insecure": {"Fear": 0.7},
+    "overwhelmed": {"Fear": 0.6, "Frustration": 0.5}, "dread": {"Fear": 1.0}, "unsafe": {"Fear": 0.9},
+    "pressure": {"Fear": 0.4, "Frustration": 0.3}, "deadline": {"Fear": 0.3, "Frustration": 0.2},
+    # Anger
+    "angry": {"Anger": 1.0}, "anger": {"Anger": 1.0}, "mad": {"Anger": 0.9}, "furious": {"Anger": 1.0},
+    "hate": {"Anger": 0.9}, "rage": {"Anger": 1.0}, "pissed": {"Anger": 0.9}, "outraged": {"Anger": 1.0},
+    "resent": {"Anger": 0.8}, "unfair": {"Anger": 0.7, "Frustration": 0.3}, "yelled": {"Anger": 0.8},
+    "shout": {"Anger": 0.7}, "betrayed": {"Anger": 0.8, "Sadness": 0.4}, "disrespected": {"Anger": 0.8},
+    "livid": {"Anger": 1.0}, "irritated": {"Anger": 0.5, "Frustration": 0.6},
+    # Frustration
+    "frustrated": {"Frustration": 1.0}, "frustrating": {"Frustration": 1.0}, "frustration": {"Frustration": 1.0},
+    "annoyed": {"Frustration": 0.9, "Anger": 0.2}, "annoying": {"Frustration": 0.8}, "stuck": {"Frustration": 0.8},
+    "fed": {"Frustration": 0.3}, "struggle": {"Frustration": 0.6, "Sadness": 0.2}, "struggling": {"Frustration": 0.6, "Sadness": 0.2},
+    "difficult": {"Frustration": 0.4}, "hard": {"Frustration": 0.3}, "useless": {"Frustration": 0.6, "Sadness": 0.3},
+    "failed": {"Frustration": 0.6, "Sadness": 0.4}, "fail": {"Frustration": 0.5, "Sadness": 0.3},
+    "impatient": {"Frustration": 0.8}, "blocked": {"Frustration": 0.7}, "wasted": {"Frustration": 0.7},
+    "ugh": {"Frustration": 0.8}, "argh": {"Frustration": 0.8},
+}
+
+NEGATIONS = {"not", "no", "never", "dont", "don't", "didnt", "didn't", "isnt", "isn't", "wasnt", "wasn't", "without", "hardly"}
+INTENSIFIERS = {"very": 1.5, "really": 1.4, "so": 1.3, "extremely": 1.8, "super": 1.5, "incredibly": 1.7, "totally": 1.4, "quite": 1.2, "slightly": 0.6, "bit": 0.7}
+
+# How many tokens after a negation word it still applies to
+NEGATION_WINDOW = 3
+
+_TOKEN_RE = re.compile(r"[a-z']+|[.,;!?]")
+# Punctuation that ends the reach of a negation or intensifier
+_CLAUSE_BREAKS = {".", ",", ";", "!", "?"}
+
+# Dense lookup structures built once at import: vocabulary index and an (n_words, n_emotions) weight matrix
+_VOCAB = {word: i for i, word in enumerate(LEXICON)}
+_WEIGHTS = np.zeros((len(LEXICON), len(EMOTIONS)), dtype=np.float64)
+for _word, _i in _VOCAB.items():
+    for _emotion, _weight in LEXICON[_word].items():
+        _WEIGHTS[_i, EMOTIONS.index(_emotion)] = _weight
+
+# Tokens come from user text, so the vocabulary seen is unbounded; keep the most recent ones
+@functools.lru_cache(maxsize=65536)
+def _lookup(token):
+    """Map a token to its lexicon index, trying a few cheap suffix strips"""
+    index = _VOCAB.get(token, -1)
+    if index < 0:
+        for suffix in ("ing", "ed", "es", "s", "ly"):
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                index = _VOCAB.get(token[:-len(suffix)], -1)
+                if index >= 0:
+                    break
+    return index
+
+def _encode(text):
+    """Turn text into parallel arrays of lexicon ids, negation flags and intensity multipliers"""
+    tokens = _TOKEN_RE.findall(text.lower())
+    ids = np.full(len(tokens), -1, dtype=np.int64)
+    negated = np.zeros(len(tokens), dtype=np.bool_)
+    intensity = np.ones(len(tokens), dtype=np.float64)
+    negate_until = -1
+    boost = 1.0
+    for i, token in enumerate(tokens):
+        if token in _CLAUSE_BREAKS:
+            negate_until = -1
+            boost = 1.0
+            continue
+        if token in NEGATIONS:
+            negate_until = i + NEGATION_WINDOW
+            continue
+        if token in INTENSIFIERS:
+            boost = INTENSIFIERS[token]
+            continue
+        ids[i] = _lookup(token)
+        negated[i] = i <= negate_until
+        intensity[i] = boost
+        boost = 1.0
+    return ids, negated, intensity
+
+@njit(cache=True)
+def _score(ids, negated, intensity, weights):
+    """Accumulate per-emotion evidence; negated hits are dropped and count against the emotion"""
+    n_emotions = weights.shape[1]
+    scores = np.zeros(n_emotions)
+    hits = 0
+    for i in range(ids.shape[0]):
+        idx = ids[i]
+        if idx < 0:
+            continue
+        hits += 1
+        for e in range(n_emotions):
+            w = weights[idx, e]
+            if w == 0.0:
+                continue
+            if negated[i]:
+                scores[e] -= 0.5 * w
+            else:
+                scores[e] += w * intensity[i]
+    for e in range(n_emotions):
+        if scores[e] < 0.0:
+            scores[e] = 0.0
+    return scores, hits
+
+@njit(cache=True)
+def _select(scores, hits, relative_cutoff):
+    """Pick every emotion within relative_cutoff of the top score and estimate confidence"""
+    total = scores.sum()
+    selected = np.zeros(scores.shape[0], dtype=np.bool_)
+    if total <= 0.0:
+        return selected, 0.0
+    top = scores.max()
+    selected_mass = 0.0
+    for e in range(scores.shape[0]):
+        if scores[e] >= relative_cutoff * top:
+            selected[e] = True
+            selected_mass += scores[e]
+    # Confidence grows with the amount of evidence and with how cleanly it separates into the chosen labels
+    evidence = 1.0 - np.exp(-total / 2.0)
+    separation = selected_mass / total
+    coverage = min(1.0, hits / 2.0)
+    return selected, evidence * separation * coverage
+
+def classify_text(text, relative_cutoff=0.5):
+    """Return (emotion labels, confidence in [0, 1]) for a piece of text"""
+    ids, negated, intensity = _encode(text)
+    scores, hits = _score(ids, negated, intensity, _WEIGHTS)
+    selected, confidence = _select(scores, hits, relative_cutoff)
+    labels = [EMOTIONS[i] for i in np.flatnonzero(selected)]
+    return labels, float(confidence)
+
+def classify_messages(messages, relative_cutoff=0.5):
+    """Classify a chat transcript, looking only at what the user wrote"""
+    text = "\n".join(m["content"] for m in messages if m["role"] == "user")
+    return classify_text(text, relative_cutoff)
+
+# Compile the kernels at import so the first journal entry doesn't pay the JIT cost
+classify_text("warm up")
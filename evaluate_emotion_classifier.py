@@ -0,0 +1,101 @@
+"""Measure how well the local emotion classifier agrees with the LLM labels on stored entries.
+
+Each entry's conversation transcript is classified the way the app does it (the user's own
+messages) and compared with the emotions the LLM tagged it with, on every shard. Entries
+saved before transcripts were stored are skipped.
+
+Usage: DATABASE_URL=... [DATABASE_SHARDS=...] python evaluate_emotion_classifier.py [--user EMAIL] [--threshold 0.6]
+"""
+import argparse
+import json
+import os
+import time
+import psycopg2
+from emotion_classifier import EMOTIONS, classify_messages
+from sharding import load_shard_urls
+from transcripts import TranscriptCodec
+
+ENTRIES_SQL = (
+    "SELECT l.emotions, t.dict_id, t.body FROM logs l LEFT JOIN transcripts t ON t.user_email = l.user_email "
+    "AND t.entry_date = l.entry_date AND t.transcript_key = (l.fingerprint >> 32)"
+)
+
+def fetch_entries(user_email=None):
+    """(messages, emotions) for every entry with a transcript, and how many entries had none"""
+    rows, missing = [], 0
+    for url, _ in load_shard_urls(os.environ).values():
+        conn = psycopg2.connect(url)
+        try:
+            cur = conn.cursor()
+            if user_email:
+                cur.execute(ENTRIES_SQL + " WHERE l.user_email = %s", (user_email,))
+            else:
+                cur.execute(ENTRIES_SQL)
+            shard_rows = cur.fetchall()
+            # Each shard trains its own dictionaries, so each gets its own codec
+            codec = TranscriptCodec(None, interval=None)
+            for emotions, dict_id, body in shard_rows:
+                if body is None:
+                    missing += 1
+                    continue
+                rows.append((json.loads(codec.decompress(cur, dict_id, body)), emotions))
+            cur.close()
+        finally:
+            conn.close()
+    return rows, missing
+
+def parse_labels(emotions):
+    return {e.strip() for e in (emotions or "").split(',') if e.strip() in EMOTIONS}
+
+def evaluate(rows, threshold):
+    per_label = {e: {"tp": 0, "fp": 0, "fn": 0} for e in EMOTIONS}
+    exact = jaccard_sum = confident = confident_exact = 0
+    started = time.perf_counter()
+    for messages, emotions in rows:
+        expected = parse_labels(emotions)
+        labels, confidence = classify_messages(messages)
+        predicted = set(labels)
+        for e in EMOTIONS:
+            if e in predicted and e in expected:
+                per_label[e]["tp"] += 1
+            elif e in predicted:
+                per_label[e]["fp"] += 1
+            elif e in expected:
+                per_label[e]["fn"] += 1
+        union = predicted | expected
+        jaccard_sum += len(predicted & expected) / len(union) if union else 1.0
+        exact += predicted == expected
+        if labels and confidence >= threshold:
+            confident += 1
+            confident_exact += predicted == expected
+    elapsed = time.perf_counter() - started
+    return per_label, exact, jaccard_sum, confident, confident_exact, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", help="Only evaluate entries for this user_email")
+    parser.add_argument("--threshold", type=float, default=float(os.environ.get("EMOTION_CONFIDENCE_THRESHOLD", "0.6")))
+    args = parser.parse_args()
+
+    rows, missing = fetch_entries(args.user)
+    if not rows:
+        print(f"No entries with a transcript found ({missing} without one).")
+        return
+    per_label, exact, jaccard_sum, confident, confident_exact, elapsed = evaluate(rows, args.threshold)
+    n = len(rows)
+
+    print(f"Entries evaluated:        {n} ({missing} without a transcript skipped)")
+    print(f"Exact label-set match:    {exact / n:.1%}")
+    print(f"Mean Jaccard agreement:   {jaccard_sum / n:.3f}")
+    print(f"Handled locally (>= {args.threshold}): {confident / n:.1%} of entries, exact match {confident_exact / max(confident, 1):.1%}")
+    print(f"Mean classify time:       {elapsed / n * 1e6:.1f} µs")
+    print()
+    print(f"{'Emotion':<12} {'Precision':>9} {'Recall':>7} {'F1':>6}")
+    for emotion, c in per_label.items():
+        precision = c["tp"] / max(c["tp"] + c["fp"], 1)
+        recall = c["tp"] / max(c["tp"] + c["fn"], 1)
+        f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+        print(f"{emotion:<12} {precision:>9.2f} {recall:>7.2f} {f1:>6.2f}")
+
+if __name__ == "__main__":
+    main()
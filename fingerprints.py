@@ -0,0 +1,28 @@
+import google_crc32c
+
+# Entry fingerprints are 64 bits: CRC32C of the normalized transcript in the high half and
+# CRC32C of the normalized summary in the low half. The transcript half identifies the
+# conversation (a double-clicked save produces the same one, even if the regenerated
+# summary differs); the full value changes whenever either text does.
+
+def normalize_text(text):
+    return " ".join((text or "").split())
+
+def crc32c(text):
+    # google_crc32c uses the SSE4.2 / ARMv8 CRC instructions via its C extension when available
+    return google_crc32c.value(normalize_text(text).encode("utf-8"))
+
+def transcript_text(messages):
+    return "\n".join(f"{m['role']}: {normalize_text(m['content'])}" for m in messages)
+
+def _to_bigint(high, low):
+    """Pack two 32-bit halves into a signed value that fits a Postgres BIGINT"""
+    value = (high << 32) | low
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def entry_fingerprint(messages, summary):
+    return _to_bigint(crc32c(transcript_text(messages)), crc32c(summary))
+
+def legacy_fingerprint(entry_id, summary):
+    """For rows saved before transcripts were fingerprinted; the id keeps the transcript half unique"""
+    return _to_bigint(crc32c(f"legacy:{entry_id}"), crc32c(summary))
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+class Hedger:
+    """Hedged requests for idempotent calls.
+
+    If the first attempt hasn't finished by the task's latency percentile deadline, a
+    duplicate is started; whichever finishes first wins and the other is cancelled. Hedges
+    are capped at `budget` (e.g. 0.05 = 5%) of requests, plus a small burst allowance.
+    """
+
+    def __init__(self, tracker, percentile=95, budget=0.05, burst=2, min_samples=20, default_deadline=5.0, min_deadline=0.5):
+        self.tracker = tracker
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.default_deadline = default_deadline
+        self.min_deadline = min_deadline
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def deadline(self, key):
+        if self.tracker.count(key) < self.min_samples:
+            return self.default_deadline
+        p = self.tracker.percentile(key, self.percentile)
+        return max(self.min_deadline, p) if p is not None else self.default_deadline
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedges >= self.budget * self.requests + self.burst:
+                return False
+            self.hedges += 1
+            return True
+
+    async def run(self, key, make_call):
+        """Await make_call(), hedging with a second make_call() past the deadline"""
+        with self._lock:
+            self.requests += 1
+        primary = asyncio.ensure_future(make_call())
+        done, _ = await asyncio.wait({primary}, timeout=self.deadline(key))
+        if done or not self._take_hedge():
+            return await primary
+
+        hedge = asyncio.ensure_future(make_call())
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; surface the primary's error
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "win_rate": self.hedge_wins / self.hedges if self.hedges else 0.0,
+            }
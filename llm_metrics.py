@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+class LatencyTracker:
+    """Rolling window of recent LLM call timings, keyed by any label (task, model, ...)"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._latency = defaultdict(lambda: deque(maxlen=self.window))
+        self._ttft = defaultdict(lambda: deque(maxlen=self.window))
+        self._errors = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, key, latency, ttft=None, error=False):
+        with self._lock:
+            self._errors[key].append(1 if error else 0)
+            if not error:
+                self._latency[key].append(latency)
+                if ttft is not None:
+                    self._ttft[key].append(ttft)
+
+    def percentile(self, key, q, metric="latency"):
+        with self._lock:
+            values = list((self._ttft if metric == "ttft" else self._latency).get(key, ()))
+        return float(np.percentile(values, q)) if values else None
+
+    def error_rate(self, key):
+        with self._lock:
+            errors = list(self._errors.get(key, ()))
+        return sum(errors) / len(errors) if errors else 0.0
+
+    def count(self, key):
+        with self._lock:
+            return len(self._errors.get(key, ()))
+
+    def summary(self):
+        with self._lock:
+            keys = list(self._errors)
+        return {
+            key: {
+                "calls": self.count(key),
+                "p50": self.percentile(key, 50),
+                "p95": self.percentile(key, 95),
+                "ttft_p50": self.percentile(key, 50, metric="ttft"),
+                "ttft_p95": self.percentile(key, 95, metric="ttft"),
+                "error_rate": self.error_rate(key),
+            }
+            for key in keys
+        }
+
+def stream_text(stream, on_text=None, started=None, on_usage=None):
+    """Collect a streamed chat completion, calling on_text(partial) as tokens arrive.
+
+    Returns (full text, time to first token, total time) in seconds, measured from
+    `started` (pass the time the request was sent) or from the first iteration.
+    on_usage(usage) gets the final usage chunk of a stream requested with include_usage.
+    """
+    if started is None:
+        started = time.perf_counter()
+    ttft = None
+    full_response = ""
+    for chunk in stream:
+        if on_usage is not None and getattr(chunk, "usage", None) is not None:
+            on_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            full_response += chunk.choices[0].delta.content
+            if on_text is not None:
+                on_text(full_response)
+    return full_response, ttft, time.perf_counter() - started
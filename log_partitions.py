@@ -0,0 +1,243 @@
+import logging
+import re
+import threading
+from datetime import date
+
+logger = logging.getLogger("log_partitions")
+
+# Monthly partitions are named logs_YYYY_MM; once moved to the archive tier they become logs_YYYY_MM_archive
+ARCHIVE_SUFFIX = "_archive"
+_PARTITION_RE = re.compile(r"^logs_(\d{4})_(\d{2})(" + ARCHIVE_SUFFIX + r")?$")
+
+# Every column except the partition key, in table order; shared by the migration copy
+COLUMNS = ["id", "user_email", "user_name", "date", "time", "summary", "emotions", "people", "topics", "fingerprint", "minhash"]
+# Wide columns worth compressing in the archive tier
+_COMPRESSED_COLUMNS = ["user_name", "summary", "emotions", "people", "topics", "minhash"]
+
+def add_months(day, months):
+    """First day of the month `months` after (or before, if negative) the month of `day`"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f"logs_{month:%Y_%m}"
+
+def _create_table(cur, name):
+    cur.execute(f'''
+        CREATE TABLE {name}
+        (id INTEGER NOT NULL DEFAULT nextval('logs_id_seq'),
+         user_email TEXT,
+         user_name TEXT,
+         date TEXT,
+         time TEXT,
+         summary TEXT,
+         emotions TEXT,
+         people TEXT,
+         topics TEXT,
+         fingerprint BIGINT,
+         minhash BYTEA,
+         entry_date DATE NOT NULL,
+         PRIMARY KEY (id, entry_date))
+        PARTITION BY RANGE (entry_date)
+    ''')
+
+def ensure_schema(cur, today, months_ahead=3):
+    """Create `logs` range-partitioned by month on entry_date, migrating a plain `logs` table in place.
+
+    The migration runs once, inside the caller's transaction, under an advisory lock so
+    replicas starting together don't race it. Ids and the id sequence are kept. Once the
+    table and its index exist this only checks the catalog, taking no lock on `logs`.
+    """
+    cur.execute("SELECT (SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')) = 'p' "
+                "AND to_regclass('logs_user_date_transcript_key') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        _migrate(cur)
+    ensure_partitions(cur, today, months_ahead)
+
+def _migrate(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('logs_partitioning'))")
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")
+    row = cur.fetchone()
+    if row is None or row[0] != 'p':
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS logs_id_seq")
+        _create_table(cur, "logs_partitioned")
+        if row is not None:
+            # Columns added to the plain table by later schema changes may not exist yet
+            cur.execute("ALTER TABLE logs ADD COLUMN IF NOT EXISTS fingerprint BIGINT")
+            cur.execute("ALTER TABLE logs ADD COLUMN IF NOT EXISTS minhash BYTEA")
+            cur.execute("SELECT min(date), max(date) FROM logs")
+            first, last = cur.fetchone()
+            if first is not None:
+                create_partitions(cur, date.fromisoformat(first), date.fromisoformat(last), parent="logs_partitioned")
+            columns = ", ".join(COLUMNS)
+            cur.execute(f"INSERT INTO logs_partitioned ({columns}, entry_date) SELECT {columns}, to_date(date, 'YYYY-MM-DD') FROM logs")
+            cur.execute("ALTER SEQUENCE logs_id_seq OWNED BY NONE")
+            cur.execute("DROP TABLE logs")
+        cur.execute("ALTER TABLE logs_partitioned RENAME TO logs")
+        cur.execute("ALTER SEQUENCE logs_id_seq OWNED BY logs.id")
+    # Leads with (user_email, entry_date) so per-user reads of recent months prune to those partitions
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS logs_user_date_transcript_key ON logs (user_email, entry_date, (fingerprint >> 32))")
+
+def list_partitions(cur, parent="logs"):
+    """{month start: (partition name, archived)} for the partitions of `parent`"""
+    cur.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+        (parent,)
+    )
+    partitions = {}
+    for (name,) in cur.fetchall():
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = (name, match.group(3) is not None)
+    return partitions
+
+def create_partitions(cur, first, last, parent="logs"):
+    """Create any missing monthly partitions covering first..last; returns how many were created"""
+    existing = list_partitions(cur, parent)
+    month = add_months(first, 0)
+    created = 0
+    while month <= last:
+        if month not in existing:
+            cur.execute(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)",
+                (month, add_months(month, 1))
+            )
+            created += 1
+        month = add_months(month, 1)
+    return created
+
+def ensure_partitions(cur, today, months_ahead=3):
+    """Make sure partitions exist from the current month through `months_ahead` months from now"""
+    return create_partitions(cur, add_months(today, 0), add_months(today, months_ahead))
+
+def archive_partitions(conn, today, archive_after_months, tablespace=None, compression="lz4"):
+    """Move monthly partitions that ended more than `archive_after_months` months ago to the archive tier.
+
+    The archive copy stores its text columns compressed (`compression`, with a low
+    toast_tuple_target so even ordinary summaries get compressed) and optionally lives in
+    a cheaper `tablespace`. It is attached back under the same range, so queries over the
+    whole history still see it. `conn` must be in autocommit mode (DETACH ... CONCURRENTLY
+    runs outside a transaction). Returns the archived partition names.
+    """
+    cutoff = add_months(today, -archive_after_months)
+    cur = conn.cursor()
+    months = {month for month, (_, is_archived) in list_partitions(cur).items() if not is_archived}
+    # Partitions an interrupted run already detached
+    cur.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition AND relname ~ '^logs_[0-9]{4}_[0-9]{2}$'")
+    for (name,) in cur.fetchall():
+        match = _PARTITION_RE.match(name)
+        months.add(date(int(match.group(1)), int(match.group(2)), 1))
+    archived = []
+    for month in sorted(months):
+        if add_months(month, 1) <= cutoff:
+            archived.append(archive_partition(cur, month, tablespace, compression))
+    return archived
+
+def archive_partition(cur, month, tablespace=None, compression="lz4"):
+    """Swap one month's partition for a compressed archive copy without an exclusive lock on `logs`.
+
+    The copy is built while the partition is still attached and serving reads and writes.
+    DETACH ... CONCURRENTLY then takes the partition out; rows changed during the copy are
+    reconciled from the detached table, and the copy is attached in its place in the same
+    transaction that drops the original. Queries over that month see no rows between the
+    detach and the attach. Each step checks what an interrupted earlier run left behind.
+    """
+    name = partition_name(month)
+    archive, end = name + ARCHIVE_SUFFIX, add_months(month, 1)
+    try:
+        cur.execute("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(%s)", (name,))
+        row = cur.fetchone()
+        if row is not None and row[0]:
+            cur.execute(f"ALTER TABLE logs DETACH PARTITION {name} FINALIZE")
+            row = None
+        attached = row is not None
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (archive,))
+        if not cur.fetchone()[0]:
+            cur.execute("BEGIN")
+            cur.execute(
+                f"CREATE TABLE {archive} (LIKE {name} INCLUDING DEFAULTS INCLUDING INDEXES) WITH (toast_tuple_target = 128)"
+                + (f" TABLESPACE {tablespace}" if tablespace else "")
+            )
+            if compression:
+                for column in _COMPRESSED_COLUMNS:
+                    cur.execute(f"ALTER TABLE {archive} ALTER COLUMN {column} SET COMPRESSION {compression}")
+            cur.execute(f"INSERT INTO {archive} SELECT * FROM {name}")
+            # The matching CHECK lets ATTACH skip its validation scan
+            cur.execute(
+                f"ALTER TABLE {archive} ADD CONSTRAINT {archive}_range CHECK (entry_date >= %s AND entry_date < %s)",
+                (month, end)
+            )
+            cur.execute("COMMIT")
+        if attached:
+            cur.execute(f"ALTER TABLE logs DETACH PARTITION {name} CONCURRENTLY")
+        cur.execute("BEGIN")
+        # Catch up with deletes, updates and inserts made to the month while the copy was built
+        cur.execute(f"DELETE FROM {archive} a WHERE NOT EXISTS (SELECT 1 FROM {name} o WHERE o.id = a.id)")
+        cur.execute(f"DELETE FROM {archive} a USING {name} o WHERE o.id = a.id AND ROW(o.*) IS DISTINCT FROM ROW(a.*)")
+        cur.execute(f"INSERT INTO {archive} SELECT * FROM {name} o WHERE NOT EXISTS (SELECT 1 FROM {archive} a WHERE a.id = o.id)")
+        cur.execute(f"ALTER TABLE logs ATTACH PARTITION {archive} FOR VALUES FROM (%s) TO (%s)", (month, end))
+        cur.execute(f"DROP TABLE {name}")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    return archive
+
+class PartitionMaintainer:
+    """Creates upcoming monthly partitions and archives old ones on a background thread.
+
+    Runs once at start and then every `interval` seconds; an advisory lock keeps
+    replicas from doing the same maintenance at once. archive_after_months=None
+    disables archiving.
+    """
+
+    def __init__(self, connect, months_ahead=3, archive_after_months=12, tablespace=None, compression="lz4",
+                 interval=6 * 3600, today=date.today):
+        self._connect = connect
+        self.months_ahead = months_ahead
+        self.archive_after_months = archive_after_months
+        self.tablespace = tablespace
+        self.compression = compression
+        self.interval = interval
+        self._today = today
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Log partition maintenance failed")
+            self._stop.wait(self.interval)
+
+    def maintain(self):
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            # A session lock, since archiving commits several times
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('logs_partition_maintenance'))")
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return
+            try:
+                today = self._today()
+                created = ensure_partitions(cur, today, self.months_ahead)
+                conn.commit()
+                archived = []
+                if self.archive_after_months is not None:
+                    conn.autocommit = True
+                    archived = archive_partitions(conn, today, self.archive_after_months, self.tablespace, self.compression)
+            finally:
+                conn.rollback()
+                conn.autocommit = True
+                cur.execute("SELECT pg_advisory_unlock(hashtext('logs_partition_maintenance'))")
+                conn.autocommit = False
+            if created or archived:
+                logger.info("Created %d log partitions; archived %s", created, archived or "none")
+        finally:
+            conn.close()
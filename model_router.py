@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from llm_metrics import LatencyTracker
+
+logger = logging.getLogger("model_router")
+
+# Task -> ordered candidate models plus request limits and the p95 latency SLO (seconds) for the task.
+# The first model is the primary; later ones are used when it breaches its SLO or error budget.
+# Streamed tasks hold their SLO to time to first token ("slo_metric": "ttft"), since total time
+# grows with the length of the answer. max_tokens only guards against runaway output: summaries
+# are a few hundred words and RAG answers rarely run past a thousand, well inside their caps.
+DEFAULT_ROUTES = {
+    "chat": {"models": ["gpt-4o-mini", "gpt-4o"], "max_tokens": 600, "timeout": 30, "temperature": 0.1, "slo_p95": 2.5, "slo_metric": "ttft"},
+    "summary": {"models": ["gpt-4o-mini", "gpt-4o"], "max_tokens": 1500, "timeout": 60, "temperature": 0.1, "slo_p95": 4.0, "slo_metric": "ttft"},
+    "emotions": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "max_tokens": 20, "timeout": 10, "temperature": 0.1, "slo_p95": 3.0},
+    "people": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "max_tokens": 60, "timeout": 10, "temperature": 0.1, "slo_p95": 3.0},
+    "topics": {"models": ["gpt-4o-mini", "gpt-3.5-turbo"], "max_tokens": 60, "timeout": 10, "temperature": 0.1, "slo_p95": 3.0},
+    "rag": {"models": ["gpt-4o-mini", "gpt-4o"], "max_tokens": 2500, "timeout": 90, "temperature": 0.1, "slo_p95": 5.0, "slo_metric": "ttft"},
+    "digest": {"models": ["gpt-4o-mini", "gpt-4o"], "max_tokens": 400, "timeout": 60, "temperature": 0.1, "slo_p95": 20.0},
+}
+
+def load_routes():
+    """DEFAULT_ROUTES, with per-task overrides from the MODEL_ROUTES env var (JSON)"""
+    routes = {task: dict(route) for task, route in DEFAULT_ROUTES.items()}
+    for task, override in json.loads(os.environ.get("MODEL_ROUTES", "{}")).items():
+        routes.setdefault(task, dict(DEFAULT_ROUTES["chat"])).update(override)
+    return routes
+
+class ModelRouter:
+    """Chooses a model per task from live latency and error rates.
+
+    A model is unhealthy for a task once it has min_samples recent calls and either its
+    p95 latency (or time to first token, per the route's slo_metric) exceeds the task's SLO
+    or its error rate exceeds max_error_rate. While the primary is unhealthy a small
+    probe_rate of traffic still goes to it so it can recover.
+    """
+
+    def __init__(self, routes=None, tracker=None, min_samples=20, max_error_rate=0.2, probe_rate=0.05, decision_log_size=1000):
+        self.routes = routes or load_routes()
+        self.tracker = tracker or LatencyTracker()
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.probe_rate = probe_rate
+        self.decisions = deque(maxlen=decision_log_size)
+        self._lock = threading.Lock()
+
+    def _healthy(self, task, model):
+        key = (task, model)
+        if self.tracker.count(key) < self.min_samples:
+            return True, None
+        p95 = self.tracker.percentile(key, 95, metric=self.routes[task].get("slo_metric", "latency"))
+        if self.tracker.error_rate(key) > self.max_error_rate:
+            return False, p95
+        return p95 is None or p95 <= self.routes[task]["slo_p95"], p95
+
+    def choose(self, task):
+        """Return (model, request kwargs) for a task"""
+        route = self.routes[task]
+        primary = route["models"][0]
+        model, reason = primary, "primary"
+        healthy, p95 = self._healthy(task, primary)
+        if not healthy:
+            if random.random() < self.probe_rate:
+                reason = "probe"
+            else:
+                reason = "failover"
+                for candidate in route["models"][1:]:
+                    if self._healthy(task, candidate)[0]:
+                        model = candidate
+                        break
+                else:
+                    reason = "all_unhealthy"
+        decision = {"ts": time.time(), "task": task, "model": model, "reason": reason, "primary_p95": p95}
+        with self._lock:
+            self.decisions.append(decision)
+        if reason != "primary":
+            logger.info("routing %s", json.dumps(decision))
+        params = {"max_tokens": route["max_tokens"], "timeout": route["timeout"], "temperature": route["temperature"]}
+        return model, params
+
+    def record(self, task, model, latency, ttft=None, error=False):
+        self.tracker.record((task, model), latency, ttft, error)
+
+    def decision_counts(self):
+        """{(task, model, reason): count} over the recent decision log"""
+        counts = {}
+        with self._lock:
+            for d in self.decisions:
+                key = (d["task"], d["model"], d["reason"])
+                counts[key] = counts.get(key, 0) + 1
+        return counts
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+
+EMOTIONS = ["Joy", "Sadness", "Fear", "Anger", "Frustration"]
+
+_MONTHS = {name: i for i, name in enumerate(
+    ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"], 1)}
+
+def _tag_hits(values, index=None):
+    """(rows, columns) of every tag in a column of comma-separated tag strings. Columns come
+    from `index` (unknown tags dropped) or number tags in order of first appearance, in which
+    case the names are returned too"""
+    # One split over the joined column instead of one per entry
+    values = [v or '' for v in values]
+    rows = np.repeat(np.arange(len(values)), [v.count(',') + 1 for v in values])
+    tags = pd.Series([t.strip() for t in ','.join(values).split(',')] if values else [], dtype=object)
+    keep = ((tags != '') & (tags != 'None')).to_numpy()
+    rows, tags = rows[keep], tags[keep]
+    if index is not None:
+        cols = tags.map(index)
+        known = cols.notna().to_numpy()
+        return rows[known], cols[known].to_numpy(dtype=np.int64)
+    cols, names = pd.factorize(tags, sort=False)
+    return (rows, cols), list(names)
+
+def _parse_dates(values, date_format):
+    """datetime64[D] array for date strings, parsing each distinct string once"""
+    unique, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    if date_format == '%d %B %Y':
+        # The app's own format; splitting it by hand is several times faster than strptime
+        try:
+            iso = [f"{y}-{_MONTHS[m]:02d}-{int(d):02d}" for d, m, y in (u.split() for u in unique)]
+            return np.array(iso, dtype='datetime64[D]')[inverse]
+        except (KeyError, ValueError):
+            pass
+    return pd.to_datetime(pd.Series(unique, dtype=object), format=date_format).values.astype('datetime64[D]')[inverse]
+
+class MoodData:
+    """A user's entries as arrays, built once per data version.
+
+    entry_day   (n_entries,)              day index of each entry, 0 = first day with an entry
+    emotions    (n_entries, n_emotions)   emotion incidence
+    people      (n_entries, n_people)     person incidence, columns named by people_names
+    topics      (n_entries, n_topics)     topic incidence, columns named by topic_names
+    day_emotion (n_days, n_emotions)      number of entries per day tagged with each emotion
+    day_entries (n_days,)                 number of entries per day
+    """
+
+    def __init__(self, entries, date_format='%d %B %Y'):
+        # entries are get_past_entries rows: (id, date, time, summary, emotions, people, topics)
+        n = len(entries)
+        dates = _parse_dates([e[1] for e in entries], date_format) if n else np.zeros(0, dtype='datetime64[D]')
+        self.start = dates.min() if n else np.datetime64('today', 'D')
+        self.entry_day = (dates - self.start).astype(np.int64) if n else np.zeros(0, dtype=np.int64)
+        self.n_days = int(self.entry_day.max()) + 1 if n else 0
+        self.emotion_names = list(EMOTIONS)
+
+        # Tag strings are split, stripped and numbered a whole column at a time rather than per entry
+        emotion_hits = _tag_hits([e[4] for e in entries], {e: i for i, e in enumerate(self.emotion_names)})
+        people_hits, people_names = _tag_hits([e[5] for e in entries])
+        topic_hits, topic_names = _tag_hits([e[6] for e in entries])
+
+        self.people_names = people_names
+        self.topic_names = topic_names
+        self.emotions = self._incidence(n, len(self.emotion_names), emotion_hits)
+        self.people = self._incidence(n, len(self.people_names), people_hits)
+        self.topics = self._incidence(n, len(self.topic_names), topic_hits)
+
+        self.day_emotion = np.zeros((self.n_days, len(self.emotion_names)), dtype=np.float64)
+        np.add.at(self.day_emotion, self.entry_day, self.emotions)
+        self.day_entries = np.bincount(self.entry_day, minlength=self.n_days).astype(np.float64)
+
+    @staticmethod
+    def _incidence(n_rows, n_cols, hits):
+        matrix = np.zeros((n_rows, n_cols), dtype=np.float32)
+        if len(hits[0]):
+            matrix[hits[0], hits[1]] = 1.0
+        return matrix
+
+    def dates(self):
+        return self.start + np.arange(self.n_days).astype('timedelta64[D]')
+
+def rolling_rates(data, window):
+    """(n_days, n_emotions) share of entries in the trailing `window` days tagged with each emotion"""
+    zero = np.zeros((1, data.day_emotion.shape[1]))
+    emotion_cum = np.vstack([zero, np.cumsum(data.day_emotion, axis=0)])
+    entries_cum = np.concatenate([[0.0], np.cumsum(data.day_entries)])
+    upper = np.arange(1, data.n_days + 1)
+    lower = np.maximum(upper - window, 0)
+    emotion_sums = emotion_cum[upper] - emotion_cum[lower]
+    entry_sums = (entries_cum[upper] - entries_cum[lower])[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(entry_sums > 0, emotion_sums / entry_sums, np.nan)
+
+def streaks(presence):
+    """Longest and current run of consecutive True days for each column of a (n_days, k) matrix"""
+    n_days, k = presence.shape
+    padded = np.zeros((k, n_days + 2), dtype=np.int8)
+    padded[:, 1:-1] = presence.T
+    edges = np.diff(padded, axis=1)
+    # Row-major nonzero keeps starts and ends of each column's runs aligned
+    start_cols, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    lengths = ends - starts
+    longest = np.zeros(k, dtype=np.int64)
+    np.maximum.at(longest, start_cols, lengths)
+    current = np.zeros(k, dtype=np.int64)
+    running = ends == n_days
+    current[start_cols[running]] = lengths[running]
+    return longest, current
+
+def emotion_streaks(data):
+    """{name: (longest, current)} for each emotion plus 'Journaling' (any entry that day)"""
+    presence = np.hstack([data.day_emotion > 0, (data.day_entries > 0)[:, None]])
+    longest, current = streaks(presence)
+    names = data.emotion_names + ["Journaling"]
+    return {name: (int(l), int(c)) for name, l, c in zip(names, longest, current)}
+
+def lift(emotions, other, min_support=2):
+    """Co-occurrence lift P(e and x) / (P(e) P(x)) for every emotion/column pair.
+
+    Pairs seen together fewer than min_support times are NaN. Returns (lift, joint counts).
+    """
+    n = emotions.shape[0]
+    joint = emotions.T @ other
+    expected = np.outer(emotions.sum(axis=0), other.sum(axis=0)) / max(n, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.where((joint >= min_support) & (expected > 0), joint / expected, np.nan)
+    return result, joint
+
+def top_columns(matrix, names, limit):
+    """Keep the `limit` most frequent columns of an incidence matrix"""
+    if matrix.shape[1] <= limit:
+        return matrix, names
+    order = np.argsort(-matrix.sum(axis=0), kind='stable')[:limit]
+    return matrix[:, order], [names[i] for i in order]
+
+def analyze(data, windows=(7, 30), top_n=15, min_support=2):
+    people, people_names = top_columns(data.people, data.people_names, top_n)
+    topics, topic_names = top_columns(data.topics, data.topic_names, top_n)
+    people_lift, _ = lift(data.emotions, people, min_support)
+    topic_lift, _ = lift(data.emotions, topics, min_support)
+    return {
+        "dates": data.dates(),
+        "rolling": {w: rolling_rates(data, w) for w in windows},
+        "streaks": emotion_streaks(data),
+        "people_lift": (people_lift, people_names),
+        "topic_lift": (topic_lift, topic_names),
+    }
+
+# Widest date range (in days) shown at each granularity before switching to a coarser one
+GRANULARITY_LIMITS = (("day", 62), ("week", 366))
+
+def choose_granularity(start, end):
+    span = (np.datetime64(end, 'D') - np.datetime64(start, 'D')).astype(int) + 1
+    for granularity, limit in GRANULARITY_LIMITS:
+        if span <= limit:
+            return granularity
+    return "month"
+
+def bucket_counts(data, start, end, granularity):
+    """Days each emotion was present, summed per day/week/month bucket between start and end.
+
+    Returns (bucket start dates, (n_buckets, n_emotions) counts); buckets with no entries are omitted.
+    """
+    days = data.dates()
+    if not len(days):
+        return days, np.zeros((0, len(data.emotion_names)))
+    in_range = (days >= np.datetime64(start, 'D')) & (days <= np.datetime64(end, 'D')) & (data.day_entries > 0)
+    days = days[in_range]
+    presence = (data.day_emotion[in_range] > 0).astype(np.float64)
+    if granularity == "week":
+        # 1970-01-01 was a Thursday, so (epoch day + 3) % 7 is days since Monday
+        epoch_days = days.astype(np.int64)
+        keys = days - ((epoch_days + 3) % 7).astype('timedelta64[D]')
+    elif granularity == "month":
+        keys = days.astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        keys = days
+    buckets, inverse = np.unique(keys, return_inverse=True)
+    counts = np.zeros((len(buckets), presence.shape[1]))
+    np.add.at(counts, inverse, presence)
+    return buckets, counts
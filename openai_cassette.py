@@ -0,0 +1,189 @@
+"""Record/replay layer for OpenAI chat completions.
+
+Wrap a client with CassetteClient (or an AsyncOpenAI client with AsyncCassetteClient) and
+set mode="record" to save every request/response pair, streamed chunks included, as a
+gzip-compressed cassette keyed by a hash of the request. mode="replay" serves them back
+with no network, using either the recorded timing or a synthetic one.
+
+Replay every cassette in a directory and print timings:
+    python openai_cassette.py CASSETTE_DIR [--timing original|synthetic|none]
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# Request options that don't change the response and so are left out of the cassette key
+_UNKEYED = {"timeout", "extra_headers"}
+
+class CassetteMissError(KeyError):
+    pass
+
+def request_key(kwargs):
+    canonical = json.dumps({k: v for k, v in kwargs.items() if k not in _UNKEYED}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+class Cassettes:
+    """Directory of cassettes plus the replay timing policy shared by the sync and async wrappers"""
+
+    def __init__(self, directory, mode="replay", timing="original", synthetic_ttft=0.25, synthetic_interval=0.015):
+        if mode not in ("record", "replay", "passthrough"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if timing not in ("original", "synthetic", "none"):
+            raise ValueError(f"Unknown cassette timing: {timing}")
+        self.directory = directory
+        self.mode = mode
+        self.timing = timing
+        self.synthetic_ttft = synthetic_ttft
+        self.synthetic_interval = synthetic_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def load(self, kwargs):
+        key = request_key(kwargs)
+        try:
+            with gzip.open(self.path(key), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CassetteMissError(f"No cassette for request {key} in {self.directory}") from None
+
+    def save(self, kwargs, cassette):
+        key = request_key(kwargs)
+        cassette["request"] = {k: v for k, v in kwargs.items() if k not in _UNKEYED}
+        tmp_path = self.path(key) + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(cassette, f, default=str)
+        os.replace(tmp_path, self.path(key))
+
+    def delays(self, cassette):
+        """Seconds to wait before each chunk (or before the single response)"""
+        if cassette.get("stream"):
+            offsets = [c["t"] for c in cassette["chunks"]]
+        else:
+            offsets = [cassette["latency"]]
+        if self.timing == "none":
+            return [0.0] * len(offsets)
+        if self.timing == "synthetic":
+            return [self.synthetic_ttft] + [self.synthetic_interval] * (len(offsets) - 1)
+        return [b - a for a, b in zip([0.0] + offsets, offsets)]
+
+def _replay_chunks(cassette, delays):
+    for chunk, delay in zip(cassette["chunks"], delays):
+        if delay > 0:
+            time.sleep(delay)
+        yield ChatCompletionChunk.model_validate(chunk["data"])
+
+def _record_chunks(cassettes, kwargs, stream, started):
+    chunks = []
+    for chunk in stream:
+        chunks.append({"t": time.perf_counter() - started, "data": chunk.model_dump(mode="json")})
+        yield chunk
+    cassettes.save(kwargs, {"stream": True, "chunks": chunks})
+
+class _Completions:
+    def __init__(self, cassettes, completions):
+        self._cassettes = cassettes
+        self._completions = completions
+
+    def create(self, **kwargs):
+        cassettes = self._cassettes
+        if cassettes.mode == "passthrough":
+            return self._completions.create(**kwargs)
+        if cassettes.mode == "replay":
+            cassette = cassettes.load(kwargs)
+            delays = cassettes.delays(cassette)
+            if cassette.get("stream"):
+                return _replay_chunks(cassette, delays)
+            if delays[0] > 0:
+                time.sleep(delays[0])
+            return ChatCompletion.model_validate(cassette["response"])
+        started = time.perf_counter()
+        response = self._completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _record_chunks(cassettes, kwargs, response, started)
+        cassettes.save(kwargs, {"stream": False, "latency": time.perf_counter() - started, "response": response.model_dump(mode="json")})
+        return response
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+class CassetteClient:
+    """Drop-in for OpenAI() exposing chat.completions.create with record/replay"""
+
+    def __init__(self, client, directory, mode="replay", **timing):
+        self.cassettes = Cassettes(directory, mode, **timing)
+        self.chat = _Chat(_Completions(self.cassettes, client.chat.completions if client else None))
+
+async def _replay_chunks_async(cassette, delays):
+    for chunk, delay in zip(cassette["chunks"], delays):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield ChatCompletionChunk.model_validate(chunk["data"])
+
+async def _record_chunks_async(cassettes, kwargs, stream, started):
+    chunks = []
+    async for chunk in stream:
+        chunks.append({"t": time.perf_counter() - started, "data": chunk.model_dump(mode="json")})
+        yield chunk
+    cassettes.save(kwargs, {"stream": True, "chunks": chunks})
+
+class _AsyncCompletions(_Completions):
+    async def create(self, **kwargs):
+        cassettes = self._cassettes
+        if cassettes.mode == "passthrough":
+            return await self._completions.create(**kwargs)
+        if cassettes.mode == "replay":
+            cassette = cassettes.load(kwargs)
+            delays = cassettes.delays(cassette)
+            if cassette.get("stream"):
+                return _replay_chunks_async(cassette, delays)
+            if delays[0] > 0:
+                await asyncio.sleep(delays[0])
+            return ChatCompletion.model_validate(cassette["response"])
+        started = time.perf_counter()
+        response = await self._completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return _record_chunks_async(cassettes, kwargs, response, started)
+        cassettes.save(kwargs, {"stream": False, "latency": time.perf_counter() - started, "response": response.model_dump(mode="json")})
+        return response
+
+class AsyncCassetteClient:
+    """Drop-in for AsyncOpenAI() exposing chat.completions.create with record/replay"""
+
+    def __init__(self, client, directory, mode="replay", **timing):
+        self.cassettes = Cassettes(directory, mode, **timing)
+        self.chat = _Chat(_AsyncCompletions(self.cassettes, client.chat.completions if client else None))
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay every cassette in a directory and report timings")
+    parser.add_argument("directory")
+    parser.add_argument("--timing", choices=["original", "synthetic", "none"], default="original")
+    args = parser.parse_args()
+
+    client = CassetteClient(None, args.directory, mode="replay", timing=args.timing)
+    files = sorted(f for f in os.listdir(args.directory) if f.endswith(".json.gz"))
+    print(f"{'cassette':<34} {'stream':>6} {'ttft_s':>8} {'total_s':>8}")
+    for name in files:
+        with gzip.open(os.path.join(args.directory, name), "rt", encoding="utf-8") as f:
+            request = json.load(f)["request"]
+        started = time.perf_counter()
+        ttft = None
+        response = client.chat.completions.create(**request)
+        if request.get("stream"):
+            for _ in response:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+        total = time.perf_counter() - started
+        ttft = total if ttft is None else ttft
+        print(f"{name[:-8]:<34} {str(bool(request.get('stream'))):>6} {ttft:>8.3f} {total:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("readiness")
+
+class Readiness:
+    """Whether this replica has warmed up and can reach its dependencies.
+
+    `probes` maps dependency name -> a blocking callable that raises if the dependency is
+    unreachable (each should bound itself with a short timeout). status() runs them
+    concurrently and caches the result for `cache_seconds`, so a load balancer polling every
+    replica costs each dependency at most one probe per interval. The replica is ready once
+    warm_up() has finished and every probe passes.
+    """
+
+    def __init__(self, probes, cache_seconds=5.0):
+        self.probes = probes
+        self.cache_seconds = cache_seconds
+        self.warm_up_ms = {}  # step -> duration
+        self._warmed_up = threading.Event()
+        self._status = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max(1, len(probes)), thread_name_prefix="readiness")
+
+    @property
+    def warmed_up(self):
+        return self._warmed_up.is_set()
+
+    def warm_up(self, steps):
+        """Run (name, callable) warm-up steps in order, then mark the replica warmed up; a failed
+        step is logged and left to the probes to report"""
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception:
+                logger.exception("Warm-up step %s failed", name)
+            self.warm_up_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("Warmed up in %.0f ms: %s", sum(self.warm_up_ms.values()), self.warm_up_ms)
+        self._warmed_up.set()
+
+    def _probe(self, probe):
+        started = time.perf_counter()
+        try:
+            probe()
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return {"ok": error is None, "latency_ms": round((time.perf_counter() - started) * 1000, 1), "error": error}
+
+    def status(self):
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.cache_seconds:
+                return self._status
+        futures = {name: self._executor.submit(self._probe, probe) for name, probe in self.probes.items()}
+        dependencies = {name: future.result() for name, future in futures.items()}
+        status = {
+            "ready": self.warmed_up and all(d["ok"] for d in dependencies.values()),
+            "warmed_up": self.warmed_up,
+            "warm_up_ms": dict(self.warm_up_ms),
+            "dependencies": dependencies,
+        }
+        with self._lock:
+            self._status, self._checked_at = status, time.monotonic()
+        return status
+
+class HealthServer:
+    """Liveness and readiness over HTTP on a daemon thread, beside the Streamlit server.
+
+    GET /healthz answers 200 while the process is up; GET /readyz answers 200 when the
+    replica is ready and 503 otherwise, with Readiness.status() as the JSON body either way.
+    """
+
+    def __init__(self, readiness, host="0.0.0.0", port=8502):
+        self.readiness = readiness
+        health = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._send(200, {"status": "ok"})
+                elif self.path == "/readyz":
+                    status = health.readiness.status()
+                    self._send(200 if status["ready"] else 503, status)
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def _send(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # polled every few seconds; not worth a log line each time
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="health-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,72 @@
+"""Move journal users between database shards.
+
+Usage:
+  DATABASE_SHARDS='{"a": {"url": "postgres://..."}, "b": {"url": "postgres://..."}}' DATABASE_CATALOG_SHARD=a python rebalance_shards.py plan
+  ... python rebalance_shards.py move EMAIL SHARD
+  ... python rebalance_shards.py rebalance [--limit N]
+  ... python rebalance_shards.py register
+
+`register` records every user who already has data on a shard as living there; run it once
+before the app first starts with a shard added (or with sharding newly turned on), so the
+ring never places an existing user on an empty shard. `plan` lists users who are not on
+the shard consistent hashing would pick for them (after adding a shard, roughly 1/N of
+users); `rebalance` moves them one at a time. Each move pauses only that user's writes,
+for a few seconds.
+"""
+import argparse
+import os
+
+from cache_sync import CacheSync
+from db_router import DatabaseRouter
+from sharding import (
+    ShardedDatabase, ensure_catalog_schema, load_catalog_shard, load_shard_urls, misplaced_users, move_user, register_existing_users,
+)
+
+def connect_shards():
+    return ShardedDatabase({name: DatabaseRouter(url, maxconn=4) for name, (url, _) in load_shard_urls(os.environ).items()},
+                           load_catalog_shard(os.environ))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("plan")
+    move = commands.add_parser("move")
+    move.add_argument("user_email")
+    move.add_argument("shard")
+    rebalance = commands.add_parser("rebalance")
+    rebalance.add_argument("--limit", type=int, default=None, help="move at most this many users")
+    commands.add_parser("register")
+    args = parser.parse_args()
+
+    db = connect_shards()
+    # Only used for bump_version, which notifies the app processes of the move
+    versions = CacheSync(db.connect)
+    try:
+        if args.command == "plan":
+            misplaced = misplaced_users(db)
+            for user_email, current, wanted in misplaced:
+                print(f"{user_email}\t{current} -> {wanted}")
+            print(f"{len(misplaced)} users to move")
+        elif args.command == "register":
+            conn = db.connect_shard(db.catalog)
+            try:
+                with conn.cursor() as cur:
+                    ensure_catalog_schema(cur)
+                conn.commit()
+            finally:
+                conn.close()
+            for shard in db.shards:
+                print(f"{shard}: registered {register_existing_users(db, shard)} users")
+        elif args.command == "move":
+            copied = move_user(db, args.user_email, args.shard, versions.bump_version)
+            print(f"Moved {args.user_email}: {copied}" if copied else f"{args.user_email} is already on {args.shard}")
+        else:
+            misplaced = misplaced_users(db)[:args.limit]
+            for i, (user_email, current, wanted) in enumerate(misplaced, 1):
+                copied = move_user(db, user_email, wanted, versions.bump_version)
+                print(f"[{i}/{len(misplaced)}] {user_email}: {current} -> {wanted} {copied}")
+    finally:
+        db.closeall()
+
+if __name__ == "__main__":
+    main()
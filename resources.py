@@ -0,0 +1,193 @@
+"""Process-wide resources shared by the app and its launcher.
+
+serve.py builds and warms them before Streamlit serves anyone, in the same process, so the
+first rerun finds the database pools open, the OpenAI and Supabase clients' keep-alive
+connections up, the token signing keys fetched and the schema in place. Each getter builds
+its resource once per process, on first use.
+"""
+import functools
+import logging
+import os
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+
+import psycopg2
+import pytz
+from openai import OpenAI, AsyncOpenAI
+from st_supabase_connection import SupabaseConnection
+
+import answer_warmer
+import auth_tokens
+import digests
+import log_partitions
+import sharding
+import transcripts
+import usage_ledger
+import user_memory
+from auth_tokens import TokenVerifier, SessionRefresher, RotationStore, VerificationUnavailable
+from cache_sync import CacheSync
+from data_loader import CountingCursor
+from db_router import DatabaseRouter
+from fingerprints import legacy_fingerprint
+from openai_cassette import CassetteClient, AsyncCassetteClient
+from session_store import PostgresSessionStore, DraftTurnLog
+from sharding import ShardedDatabase, load_shard_urls, load_catalog_shard
+
+timezone = pytz.timezone('Asia/Singapore')  # GMT+8
+
+# Record or replay OpenAI traffic for offline benchmarks and regression runs
+OPENAI_CASSETTE_MODE = os.environ.get("OPENAI_CASSETTE_MODE", "")  # "", "record" or "replay"
+OPENAI_CASSETTE_DIR = os.environ.get("OPENAI_CASSETTE_DIR", "cassettes")
+OPENAI_CASSETTE_TIMING = os.environ.get("OPENAI_CASSETTE_TIMING", "original")  # original, synthetic or none
+# Monthly log partitions: how far ahead to create them
+LOGS_MONTHS_AHEAD = int(os.environ.get("LOGS_MONTHS_AHEAD", "3"))
+# Connections per shard pool: one per concurrent script run plus the async-db workers and
+# background threads; past that, callers wait up to DB_POOL_TIMEOUT seconds for one.
+# DB_POOL_MIN of them are opened when the pool is built, i.e. during warm-up
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "50"))
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "4"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+
+def process_singleton(build):
+    """build() runs once per process, however many threads ask at the same time"""
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(build)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(build())
+        return built[0]
+    return get
+
+def make_openai_client(use_async=False):
+    if OPENAI_CASSETTE_MODE == "replay":
+        real_client = None  # Replay never touches the network, so no API key is needed
+    else:
+        real_client = (AsyncOpenAI if use_async else OpenAI)(api_key=os.environ["OPENAI_API_KEY"])
+        if not OPENAI_CASSETTE_MODE:
+            return real_client
+    wrapper = AsyncCassetteClient if use_async else CassetteClient
+    return wrapper(real_client, OPENAI_CASSETTE_DIR, mode=OPENAI_CASSETTE_MODE, timing=OPENAI_CASSETTE_TIMING)
+
+@process_singleton
+def get_openai_client():
+    # One client per process, so its HTTP keep-alive connections survive across reruns
+    return make_openai_client()
+
+def warm_openai_client(timeout=None):
+    """One request on the app's client, leaving a keep-alive connection (DNS, TLS done) in its pool"""
+    client = get_openai_client()
+    if isinstance(client, CassetteClient):
+        return  # cassette runs are offline benchmarks
+    (client.with_options(timeout=timeout, max_retries=0) if timeout else client).models.list()
+
+@process_singleton
+def get_supabase():
+    # Sign-up, sign-in and sign-out; shared by every session, as st.connection's would be
+    return SupabaseConnection("supabase", url=os.environ["SUPABASE_URL"], key=os.environ["SUPABASE_KEY"])
+
+def warm_supabase(timeout=None):
+    """One request on the auth client's HTTP pool, leaving a keep-alive connection to Supabase in it"""
+    auth = get_supabase().client.auth
+    http = getattr(auth, "_http_client", None)
+    if http is None:
+        return  # a client version that doesn't expose its pool; building it is all we can do
+    http.get(f"{auth._url}/health", headers={"apikey": os.environ["SUPABASE_KEY"]}, timeout=timeout).raise_for_status()
+
+@process_singleton
+def get_token_verifier():
+    verifier = TokenVerifier(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"], jwt_secret=os.environ.get("SUPABASE_JWT_SECRET"))
+    try:
+        verifier.refresh_keys()
+    except VerificationUnavailable:
+        # Retried on first use; meanwhile (and for HS256 projects without SUPABASE_JWT_SECRET)
+        # tokens are checked with Supabase instead
+        logging.getLogger("auth_tokens").warning("Could not prefetch Supabase signing keys", exc_info=True)
+    return verifier
+
+@process_singleton
+def get_session_refresher():
+    # Rotations are recorded on the catalog shard, where every replica looks for them
+    return SessionRefresher(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"], rotations=RotationStore(lambda: get_db().connect()))
+
+def db_connect_kwargs(db_url):
+    result = urlparse(db_url)
+    return dict(
+        database=result.path[1:],
+        user=result.username,
+        password=result.password,
+        host=result.hostname,
+        port=result.port,
+        options="-c timezone=Asia/Singapore",
+    )
+
+def open_direct_connection(db_url):
+    # Unpooled primary connection for long-lived sessions like LISTEN
+    return psycopg2.connect(**db_connect_kwargs(db_url))
+
+@process_singleton
+def get_db():
+    # Each user's data lives on one shard (DATABASE_SHARDS, or just DATABASE_URL) and DATABASE_CATALOG_SHARD
+    # records which. Per shard, writes go to its primary and reads may go to its replicas; every shard has its own pools
+    return ShardedDatabase({
+        name: DatabaseRouter(
+            db_connect_kwargs(url),
+            [db_connect_kwargs(replica_url) for replica_url in replica_urls],
+            pin_seconds=float(os.environ.get("DB_READ_YOUR_WRITES_SECONDS", "5")),
+            max_lag=float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "2")),
+            minconn=DB_POOL_MIN,
+            maxconn=DB_POOL_SIZE,
+            acquire_timeout=DB_POOL_TIMEOUT,
+            # Counts each statement toward the rerun that issued it (see RequestLoader)
+            cursor_factory=CountingCursor,
+        )
+        for name, (url, replica_urls) in load_shard_urls(os.environ).items()
+    }, load_catalog_shard(os.environ))
+
+@process_singleton
+def init_db():
+    # Schema setup takes locks on logs, so it runs once per process rather than on every rerun.
+    # Users with data from before sharding are registered by `rebalance_shards.py register`
+    db = get_db()
+    for shard in db.shards:
+        init_shard(db, shard)
+
+def init_shard(db, shard):
+    conn = db.connect_shard(shard)
+    cur = conn.cursor()
+    if shard == db.catalog:
+        sharding.ensure_catalog_schema(cur)
+        usage_ledger.ensure_schema(cur)
+        auth_tokens.RotationStore.ensure_schema(cur)
+
+    # Create the table if it doesn't exist, partitioned by month of the entry date
+    log_partitions.ensure_schema(cur, datetime.now(timezone).date(), LOGS_MONTHS_AHEAD)
+    CacheSync.ensure_schema(cur)
+    PostgresSessionStore.ensure_schema(cur)
+    DraftTurnLog.ensure_schema(cur)
+
+    # The logs table carries each entry's CRC32C fingerprint (the transcript half makes saves
+    # idempotent) and the MinHash signature of its themes; see log_partitions
+    backfill_fingerprints(cur)
+    user_memory.ensure_schema(cur)
+    digests.ensure_schema(cur)
+    answer_warmer.ensure_schema(cur)
+    transcripts.ensure_schema(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def backfill_fingerprints(cur):
+    # Rows saved before entries were fingerprinted. Part of init_db, so once per process; the
+    # lock serializing replicas that start together is only taken when there is work to do
+    cur.execute("SELECT EXISTS (SELECT 1 FROM logs WHERE fingerprint IS NULL)")
+    if not cur.fetchone()[0]:
+        return
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('logs_fingerprint_backfill'))")
+    cur.execute("SELECT id, summary FROM logs WHERE fingerprint IS NULL")
+    for entry_id, summary in cur.fetchall():
+        cur.execute("UPDATE logs SET fingerprint = %s WHERE id = %s", (legacy_fingerprint(entry_id, summary), entry_id))
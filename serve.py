@@ -0,0 +1,109 @@
+"""Start a replica warm: heavy imports, the app's own database pools, schema setup, OpenAI and
+Supabase clients and token signing keys (see resources), and a health endpoint come up before
+Streamlit serves its first user.
+
+Usage: python serve.py [streamlit run options]   (instead of: streamlit run app.py ...)
+The load balancer should route only to replicas whose GET :HEALTH_PORT/readyz answers 200.
+"""
+import importlib
+import logging
+import os
+import sys
+import threading
+import urllib.request
+
+import psycopg2
+
+from readiness import HealthServer, Readiness
+from sharding import load_shard_urls
+
+logger = logging.getLogger("serve")
+
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", "8502"))
+PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", "3"))
+# Imported once here so the first rerun finds them loaded; emotion_classifier compiles its
+# numba kernels at import, the slowest of them
+HEAVY_MODULES = [
+    "numpy", "pandas", "plotly.graph_objects", "plotly.io", "openai", "psycopg2.extras",
+    "supabase", "st_supabase_connection", "av", "streamlit_webrtc", "jwt", "zstandard",
+    "emotion_classifier", "mood_analytics", "similar_entries", "voice", "resources",
+]
+
+def _database_probe(url):
+    def probe():
+        conn = psycopg2.connect(url, connect_timeout=max(1, int(PROBE_TIMEOUT)))
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        finally:
+            conn.close()
+    return probe
+
+def _http_probe(url, headers=None):
+    def probe():
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=PROBE_TIMEOUT) as response:
+            response.read()
+    return probe
+
+def _openai_probe():
+    import resources
+    # The app's own client, so probes also keep its keep-alive connections fresh
+    return lambda: resources.warm_openai_client(timeout=PROBE_TIMEOUT)
+
+def _supabase_probe():
+    import resources
+    # Likewise through the app's own Supabase client
+    return lambda: resources.warm_supabase(timeout=PROBE_TIMEOUT)
+
+def build_probes(environ, streamlit_port):
+    probes = {}
+    for name, (url, replica_urls) in load_shard_urls(environ).items():
+        probes[f"db:{name}"] = _database_probe(url)
+        for i, replica_url in enumerate(replica_urls):
+            probes[f"db:{name}:replica{i}"] = _database_probe(replica_url)
+    if not environ.get("OPENAI_CASSETTE_MODE"):
+        probes["openai"] = _openai_probe()
+    probes["supabase"] = _supabase_probe()
+    probes["streamlit"] = _http_probe(f"http://127.0.0.1:{streamlit_port}/_stcore/health")
+    return probes
+
+def warm_up_steps(probes):
+    """Imports first, then the resources app.py uses: its database pools (opening DB_POOL_MIN
+    connections each), the schema setup its first rerun would otherwise run, a request on its
+    OpenAI and Supabase clients and the token verifier's signing keys; then one round trip to
+    each remaining dependency"""
+    resources = lambda: importlib.import_module("resources")  # imported by the first step
+    steps = [
+        ("imports", lambda: [importlib.import_module(module) for module in HEAVY_MODULES]),
+        ("db_pools", lambda: resources().get_db()),
+        ("schema", lambda: resources().init_db()),
+        ("openai_client", lambda: resources().warm_openai_client()),
+        ("supabase_client", lambda: resources().warm_supabase()),
+        ("token_verifier", lambda: resources().get_token_verifier()),
+        ("session_refresher", lambda: resources().get_session_refresher()),
+    ]
+    steps += [(name, probe) for name, probe in probes.items() if name not in ("streamlit", "openai", "supabase")]
+    return steps
+
+def _streamlit_port(args):
+    for i, arg in enumerate(args):
+        if arg.startswith("--server.port="):
+            return int(arg.split("=", 1)[1])
+        if arg == "--server.port" and i + 1 < len(args):
+            return int(args[i + 1])
+    return int(os.environ.get("STREAMLIT_SERVER_PORT", "8501"))
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    probes = build_probes(os.environ, _streamlit_port(args))
+    readiness = Readiness(probes)
+    HealthServer(readiness, port=HEALTH_PORT).start()
+    threading.Thread(target=readiness.warm_up, args=(warm_up_steps(probes),), name="warm-up", daemon=True).start()
+
+    from streamlit.web import cli
+    sys.argv = ["streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), *args]
+    sys.exit(cli.main())
+
+if __name__ == "__main__":
+    main()
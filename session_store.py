@@ -0,0 +1,312 @@
+import json
+import threading
+import time
+from psycopg2.extras import execute_values
+
+# st.session_state keys that make up an in-progress journal conversation; its messages are
+# kept turn by turn in the DraftTurnLog instead of being rewritten with every snapshot
+PERSISTED_KEYS = (
+    "conversation_id",
+    "conversation_ended",
+    "first_response_given",
+    "summary_generated",
+    "page",
+    "summary",
+    "emotions",
+    "people",
+    "topics",
+)
+
+def snapshot(session_state):
+    return {key: session_state[key] for key in PERSISTED_KEYS if key in session_state}
+
+class MemorySessionStore:
+    """In-process stand-in with the same interface as PostgresSessionStore"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            state = self._data.get(session_id)
+        return json.loads(state) if state else None
+
+    def save_many(self, states):
+        with self._lock:
+            self._data.update(states)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+class PostgresSessionStore:
+    """Session drafts in a Postgres table, so any replica can pick up a conversation.
+
+    connect(session_id) opens a connection to the database holding that session; with
+    sharded databases, shard_for(session_id) names its shard so batches are split per shard.
+    """
+
+    def __init__(self, connect, shard_for=None):
+        self._connect = connect
+        self._shard_for = shard_for
+
+    @staticmethod
+    def ensure_schema(cur):
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS session_state
+            (session_id TEXT PRIMARY KEY,
+             state JSONB NOT NULL,
+             updated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+        ''')
+
+    def load(self, session_id):
+        conn = self._connect(session_id)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT state FROM session_state WHERE session_id = %s", (session_id,))
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def save_many(self, states):
+        """Upsert {session_id: serialized state} in one statement per database"""
+        batches = {}
+        for session_id, state in states.items():
+            shard = self._shard_for(session_id) if self._shard_for else None
+            batches.setdefault(shard, []).append((session_id, state))
+        for batch in batches.values():
+            conn = self._connect(batch[0][0])
+            try:
+                with conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        "INSERT INTO session_state (session_id, state) VALUES %s "
+                        "ON CONFLICT (session_id) DO UPDATE SET state = EXCLUDED.state, updated_at = now()",
+                        batch,
+                        template="(%s, %s::jsonb)"
+                    )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def delete(self, session_id):
+        conn = self._connect(session_id)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM session_state WHERE session_id = %s", (session_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+class DebouncedSessionWriter:
+    """Write-behind buffer in front of a session store.
+
+    stage() only records the latest snapshot per session. A background thread writes
+    pending snapshots in a single batch once a session has been quiet for `delay`
+    seconds, or at the latest `max_delay` seconds after its first unsaved change.
+    """
+
+    def __init__(self, store, delay=2.0, max_delay=10.0):
+        self.store = store
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending = {}  # session_id -> (serialized state, first staged at, last staged at)
+        self._saved = {}  # session_id -> last serialized state written
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._thread.start()
+
+    def stage(self, session_id, state):
+        serialized = json.dumps(state, sort_keys=True, default=str)
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.get(session_id)
+            if pending is None and self._saved.get(session_id) == serialized:
+                return
+            first_staged = pending[1] if pending else now
+            self._pending[session_id] = (serialized, first_staged, now)
+        self._wake.set()
+
+    def load(self, session_id):
+        with self._lock:
+            pending = self._pending.get(session_id)
+        if pending:
+            return json.loads(pending[0])
+        return self.store.load(session_id)
+
+    def flush(self, session_id=None):
+        """Write pending snapshots now, for one session or all of them"""
+        with self._lock:
+            if session_id is None:
+                due = {sid: p[0] for sid, p in self._pending.items()}
+            elif session_id in self._pending:
+                due = {session_id: self._pending[session_id][0]}
+            else:
+                due = {}
+            for sid in due:
+                del self._pending[sid]
+        self._write(due)
+
+    def _write(self, due):
+        if not due:
+            return
+        try:
+            self.store.save_many(due)
+        except Exception:
+            # Put the snapshots back unless something newer was staged meanwhile
+            now = time.monotonic()
+            with self._lock:
+                for sid, serialized in due.items():
+                    self._pending.setdefault(sid, (serialized, now, now))
+            raise
+        with self._lock:
+            self._saved.update(due)
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.delay)
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                due = {sid: p[0] for sid, p in self._pending.items()
+                       if now - p[2] >= self.delay or now - p[1] >= self.max_delay}
+                for sid in due:
+                    del self._pending[sid]
+            try:
+                self._write(due)
+            except Exception:
+                time.sleep(self.delay)
+
+class DraftTurnLog:
+    """Append-only log of an in-progress conversation's turns, written behind.
+
+    append() only buffers a turn. The buffered turns of every user are written in one
+    multi-row insert per database once any user has `max_turns` waiting, or at the latest
+    `max_delay` seconds after they were buffered; flush() writes them now (on finish and
+    logout). Each conversation has its own id, so two sessions of one user (a phone and a
+    laptop) keep separate drafts; turns are keyed by their index in the conversation, so
+    retried writes are idempotent. connect(user_email) and shard_for are as for
+    PostgresSessionStore.
+    """
+
+    def __init__(self, connect, shard_for=None, max_turns=4, max_delay=5.0):
+        self._connect = connect
+        self._shard_for = shard_for
+        self.max_turns = max_turns
+        self.max_delay = max_delay
+        self._pending = {}  # (user_email, conversation_id) -> {turn: (role, content)}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps clear() from racing a write of the turns it drops
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="draft-turns", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def ensure_schema(cur):
+        cur.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'draft_turns' AND column_name = 'conversation_id'")
+        if cur.fetchone() is None:
+            # Drafts from before they were kept per conversation can't be told apart; they are short-lived anyway
+            cur.execute("DROP TABLE IF EXISTS draft_turns")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS draft_turns
+            (user_email TEXT NOT NULL,
+             conversation_id TEXT NOT NULL,
+             turn INTEGER NOT NULL,
+             role TEXT NOT NULL,
+             content TEXT NOT NULL,
+             created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+             PRIMARY KEY (user_email, conversation_id, turn))
+        ''')
+
+    def append(self, user_email, conversation_id, turn, message):
+        with self._lock:
+            pending = self._pending.setdefault((user_email, conversation_id), {})
+            pending[turn] = (message["role"], message["content"])
+            full = len(pending) >= self.max_turns
+        if full:
+            self._wake.set()
+
+    def load(self, user_email, conversation_id):
+        """The conversation's messages in order, including turns not written yet"""
+        conn = self._connect(user_email)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT turn, role, content FROM draft_turns WHERE user_email = %s AND conversation_id = %s",
+                    (user_email, conversation_id)
+                )
+                turns = {turn: (role, content) for turn, role, content in cur.fetchall()}
+        finally:
+            conn.close()
+        with self._lock:
+            turns.update(self._pending.get((user_email, conversation_id), {}))
+        return [{"role": role, "content": content} for _, (role, content) in sorted(turns.items())]
+
+    def flush(self, user_email=None, conversation_id=None):
+        """Write buffered turns now, for one conversation or all of them"""
+        with self._write_lock:
+            with self._lock:
+                if user_email is None:
+                    due, self._pending = self._pending, {}
+                else:
+                    key = (user_email, conversation_id)
+                    due = {key: self._pending.pop(key)} if key in self._pending else {}
+            self._write(due)
+
+    def clear(self, user_email, conversation_id):
+        """Drop the draft once its conversation is done with"""
+        with self._write_lock:
+            with self._lock:
+                self._pending.pop((user_email, conversation_id), None)
+            conn = self._connect(user_email)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "DELETE FROM draft_turns WHERE user_email = %s AND conversation_id = %s",
+                        (user_email, conversation_id)
+                    )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _write(self, due):
+        batches = {}
+        for (user_email, conversation_id), turns in due.items():
+            shard = self._shard_for(user_email) if self._shard_for else None
+            batches.setdefault(shard, []).extend(
+                (user_email, conversation_id, turn, role, content) for turn, (role, content) in turns.items()
+            )
+        try:
+            for shard, rows in list(batches.items()):
+                conn = self._connect(rows[0][0])
+                try:
+                    with conn.cursor() as cur:
+                        execute_values(
+                            cur,
+                            "INSERT INTO draft_turns (user_email, conversation_id, turn, role, content) VALUES %s "
+                            "ON CONFLICT (user_email, conversation_id, turn) DO UPDATE SET role = EXCLUDED.role, content = EXCLUDED.content",
+                            rows
+                        )
+                    conn.commit()
+                finally:
+                    conn.close()
+                del batches[shard]
+        except Exception:
+            # Put back what wasn't written, unless newer turns were buffered meanwhile
+            with self._lock:
+                for rows in batches.values():
+                    for user_email, conversation_id, turn, role, content in rows:
+                        self._pending.setdefault((user_email, conversation_id), {}).setdefault(turn, (role, content))
+            raise
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.max_delay)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.max_delay)
@@ -0,0 +1,296 @@
+import bisect
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+import log_partitions
+
+logger = logging.getLogger("sharding")
+
+# Per-user tables and the column holding the user; a user's rows in all of them live on one shard.
+# logs ids come from each shard's own sequence, so moved entries get new ids on arrival.
+USER_TABLES = [
+    ("logs", "user_email"),
+    ("user_data_versions", "user_email"),
+    ("session_state", "session_id"),
+    ("user_memory", "user_email"),
+    ("digests", "user_email"),
+    ("rag_answers", "user_email"),
+    ("rag_activity", "user_email"),
+    ("transcripts", "user_email"),
+    ("draft_turns", "user_email"),
+]
+_RENUMBERED = {"logs": "id"}
+
+class ShardFrozen(Exception):
+    """A user's rows are being moved between shards and writes are paused"""
+
+def ensure_catalog_schema(cur):
+    # Where each user lives; only on the catalog shard
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS shard_assignments
+        (user_email TEXT PRIMARY KEY,
+         shard TEXT NOT NULL,
+         frozen BOOLEAN NOT NULL DEFAULT false,
+         updated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+    ''')
+
+class HashRing:
+    """Consistent hashing of keys onto shard names, with `vnodes` points per shard so
+    adding a shard takes roughly an equal share from each existing one"""
+
+    def __init__(self, shards, vnodes=128):
+        points = sorted((self._hash(f"{shard}#{i}"), shard) for shard in shards for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def shard_for(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+class ShardedDatabase:
+    """Routes each user's connections to the shard holding their data.
+
+    `shards` maps shard name -> DatabaseRouter (its own primary/replica pools). `catalog`
+    names the shard whose shard_assignments table records where every user lives. A
+    user's first lookup places them by consistent hashing and records it, so adding a shard
+    never strands existing data; moving users is the rebalancer's job (move_user).
+    Assignments are cached for `assignment_ttl` seconds; a write for a frozen user waits up
+    to `freeze_wait` seconds for the move to finish, then raises ShardFrozen.
+    """
+
+    def __init__(self, shards, catalog, vnodes=128, assignment_ttl=2.0, freeze_wait=10.0):
+        self.shards = dict(shards)
+        if catalog not in self.shards:
+            raise ValueError(f"catalog shard {catalog!r} is not one of the shards")
+        self.catalog = catalog
+        self.ring = HashRing(self.shards, vnodes)
+        self.assignment_ttl = assignment_ttl
+        self.freeze_wait = freeze_wait
+        self._assignments = {}  # user -> (fetched at, shard, frozen)
+        self._lock = threading.Lock()
+
+    def connect_shard(self, shard, read_only=False, key=None):
+        return self.shards[shard].connect(read_only=read_only, key=key)
+
+    def connect(self, user_email=None, read_only=False):
+        """A pooled connection to the user's shard (the catalog shard when no user is given)"""
+        if user_email is None:
+            return self.connect_shard(self.catalog, read_only)
+        shard, frozen = self.assignment(user_email)
+        if frozen and not read_only:
+            deadline = time.monotonic() + self.freeze_wait
+            while frozen:
+                if time.monotonic() >= deadline:
+                    raise ShardFrozen(user_email)
+                time.sleep(0.2)
+                shard, frozen = self.assignment(user_email, refresh=True)
+        return self.connect_shard(shard, read_only, key=user_email)
+
+    def shard_for(self, user_email):
+        return self.assignment(user_email)[0]
+
+    def assignment(self, user_email, refresh=False):
+        """(shard, frozen) for a user, assigning new users by consistent hashing"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._assignments.get(user_email)
+        if cached is not None and not refresh and now - cached[0] < self.assignment_ttl:
+            return cached[1], cached[2]
+        conn = self.connect_shard(self.catalog)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT shard, frozen FROM shard_assignments WHERE user_email = %s", (user_email,))
+                row = cur.fetchone()
+                if row is None:
+                    # New user: only now does the lookup write (another process may race us to it)
+                    cur.execute(
+                        "INSERT INTO shard_assignments (user_email, shard) VALUES (%s, %s) ON CONFLICT (user_email) DO NOTHING",
+                        (user_email, self.ring.shard_for(user_email))
+                    )
+                    cur.execute("SELECT shard, frozen FROM shard_assignments WHERE user_email = %s", (user_email,))
+                    row = cur.fetchone()
+                    conn.commit()
+                shard, frozen = row
+        finally:
+            conn.close()
+        if shard not in self.shards:
+            raise KeyError(f"user is assigned to unknown shard {shard!r}")
+        with self._lock:
+            self._assignments[user_email] = (now, shard, frozen)
+            if len(self._assignments) > 10000:
+                self._assignments = {u: a for u, a in self._assignments.items() if now - a[0] < self.assignment_ttl}
+        return shard, frozen
+
+    def pin(self, user_email):
+        """Read-your-writes: send this user's reads to their shard's primary for a moment"""
+        with self._lock:
+            cached = self._assignments.get(user_email)
+        if cached is not None:
+            self.shards[cached[1]].pin(user_email)
+
+    def closeall(self):
+        for router in self.shards.values():
+            router.closeall()
+
+def register_existing_users(db, shard):
+    """Record users who already have data on `shard` as living there, so the ring never
+    sends them elsewhere (e.g. the original database when sharding is first turned on)"""
+    conn = db.connect_shard(shard)
+    try:
+        with conn.cursor() as cur:
+            # A shard that was just added has no tables yet
+            cur.execute("SELECT to_regclass('user_data_versions') IS NOT NULL AND to_regclass('session_state') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return 0
+            cur.execute("SELECT user_email FROM user_data_versions UNION SELECT session_id FROM session_state")
+            users = [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+    if not users:
+        return 0
+    conn = db.connect_shard(db.catalog)
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                "INSERT INTO shard_assignments (user_email, shard) VALUES %s ON CONFLICT (user_email) DO NOTHING",
+                [(user, shard) for user in users]
+            )
+            registered = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return registered
+
+def _set_assignment(db, user_email, shard=None, frozen=None):
+    conn = db.connect_shard(db.catalog)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE shard_assignments SET shard = COALESCE(%s, shard), frozen = COALESCE(%s, frozen), updated_at = now() "
+                "WHERE user_email = %s",
+                (shard, frozen, user_email)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _copy_table(source_cur, target_cur, table, column, user_email):
+    source_cur.execute(f"SELECT * FROM {table} LIMIT 0")
+    columns = ", ".join(d.name for d in source_cur.description if d.name != _RENUMBERED.get(table))
+    # Leftovers of an earlier, interrupted move of this user
+    target_cur.execute(f"DELETE FROM {table} WHERE {column} = %s", (user_email,))
+    buffer = io.StringIO()
+    source_cur.copy_expert(source_cur.mogrify(f"COPY (SELECT {columns} FROM {table} WHERE {column} = %s) TO STDOUT", (user_email,)).decode(), buffer)
+    buffer.seek(0)
+    target_cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buffer)
+    return target_cur.rowcount
+
+def _copy_transcript_dicts(source_cur, target_cur, user_email):
+    # Shared by all of a shard's users, so copied (never deleted) for the dictionaries the user's transcripts name
+    source_cur.execute(
+        "SELECT dict_id, dict, samples, trained_at FROM transcript_dicts WHERE dict_id IN "
+        "(SELECT DISTINCT dict_id FROM transcripts WHERE user_email = %s)",
+        (user_email,)
+    )
+    rows = source_cur.fetchall()
+    if rows:
+        execute_values(target_cur, "INSERT INTO transcript_dicts (dict_id, dict, samples, trained_at) VALUES %s ON CONFLICT (dict_id) DO NOTHING", rows)
+
+def move_user(db, user_email, target, bump_version, settle=None):
+    """Move one user's rows to the `target` shard; returns {table: rows copied}.
+
+    Writes for the user are frozen for the duration: the freeze is published in the
+    catalog, then we wait `settle` seconds (default: the assignment cache TTL plus a
+    second) so every process has seen it and in-flight writes have committed. The rows
+    are copied in one target transaction that also bumps the user's data version
+    (bump_version(cur, user_email), which notifies caches), the assignment is switched
+    and unfrozen, and the source rows are deleted once cached assignments have expired.
+    """
+    source, _ = db.assignment(user_email, refresh=True)
+    if source == target:
+        return {}
+    if target not in db.shards:
+        raise KeyError(f"unknown shard {target!r}")
+    _set_assignment(db, user_email, frozen=True)
+    try:
+        time.sleep(db.assignment_ttl + 1.0 if settle is None else settle)
+        source_conn = db.connect_shard(source)
+        target_conn = db.connect_shard(target)
+        try:
+            source_cur, target_cur = source_conn.cursor(), target_conn.cursor()
+            source_cur.execute("SELECT min(entry_date), max(entry_date) FROM logs WHERE user_email = %s", (user_email,))
+            first, last = source_cur.fetchone()
+            if first is not None:
+                log_partitions.create_partitions(target_cur, first, last)
+            _copy_transcript_dicts(source_cur, target_cur, user_email)
+            copied = {table: _copy_table(source_cur, target_cur, table, column, user_email) for table, column in USER_TABLES}
+            bump_version(target_cur, user_email)
+            target_conn.commit()
+        except Exception:
+            target_conn.rollback()
+            raise
+        finally:
+            source_conn.close()
+            target_conn.close()
+        _set_assignment(db, user_email, shard=target, frozen=False)
+    except Exception:
+        _set_assignment(db, user_email, frozen=False)
+        raise
+    # Processes may route reads to the source until their cached assignment expires
+    time.sleep(db.assignment_ttl + 1.0 if settle is None else settle)
+    source_conn = db.connect_shard(source)
+    try:
+        with source_conn.cursor() as cur:
+            for table, column in USER_TABLES:
+                cur.execute(f"DELETE FROM {table} WHERE {column} = %s", (user_email,))
+        source_conn.commit()
+    finally:
+        source_conn.close()
+    logger.info("Moved a user from shard %s to %s: %s", source, target, copied)
+    return copied
+
+def misplaced_users(db):
+    """[(user_email, current shard, ring shard)] for users not on the shard the ring would choose,
+    i.e. the moves that even out the shards after one is added"""
+    conn = db.connect_shard(db.catalog)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_email, shard FROM shard_assignments ORDER BY user_email")
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    return [(user, shard, db.ring.shard_for(user)) for user, shard in rows if db.ring.shard_for(user) != shard]
+
+def load_shard_urls(environ):
+    """{shard name: (primary url, [replica urls])} from DATABASE_SHARDS, e.g.
+    '{"a": {"url": "postgres://...", "replicas": ["postgres://..."]}, "b": {"url": ...}}';
+    without it, one shard named "default" from DATABASE_URL and DATABASE_REPLICA_URLS"""
+    if environ.get("DATABASE_SHARDS"):
+        return {name: (shard["url"], list(shard.get("replicas", [])))
+                for name, shard in json.loads(environ["DATABASE_SHARDS"]).items()}
+    replicas = [url.strip() for url in environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    return {"default": (environ["DATABASE_URL"], replicas)}
+
+def load_catalog_shard(environ):
+    """Name of the catalog shard: DATABASE_CATALOG_SHARD, which several shards require so that
+    reordering DATABASE_SHARDS can never move the catalog (and lose every assignment)"""
+    shards = load_shard_urls(environ)
+    catalog = environ.get("DATABASE_CATALOG_SHARD")
+    if catalog is None:
+        if len(shards) > 1:
+            raise ValueError("DATABASE_CATALOG_SHARD must name the catalog shard when DATABASE_SHARDS lists several")
+        catalog = next(iter(shards))
+    if catalog not in shards:
+        raise ValueError(f"DATABASE_CATALOG_SHARD {catalog!r} is not in DATABASE_SHARDS")
+    return catalog
@@ -0,0 +1,111 @@
+import re
+import google_crc32c
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 64
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 31) - 1
+
+# Fixed seed so signatures computed by any replica, at any time, are comparable
+_rng = np.random.default_rng(20240101)
+_A = _rng.integers(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+# Signature of an entry with no content words or tags; real hash values are always below _PRIME
+EMPTY = np.full(NUM_PERM, _PRIME, dtype=np.uint32)
+
+_WORD_RE = re.compile(r"[a-z][a-z']+")
+STOPWORDS = set("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves today day felt feel feeling feelings really
+also like got get went things thing lot much many even still well one two conversation journal entry discussed
+""".split())
+
+def shingles(summary, topics="", people=""):
+    """Content words of the summary plus the entry's topic and people tags"""
+    words = {w for w in _WORD_RE.findall((summary or "").lower()) if w not in STOPWORDS}
+    for tags, prefix in ((topics, "topic:"), (people, "person:")):
+        for tag in (tags or "").split(','):
+            tag = tag.strip().lower()
+            if tag and tag != 'none':
+                words.add(prefix + tag)
+    return words
+
+def signature(tokens):
+    """128 x uint32 MinHash signature of a token set; an empty set gets EMPTY, which matches nothing"""
+    if not tokens:
+        return EMPTY.copy()
+    hashes = np.fromiter((google_crc32c.value(t.encode("utf-8")) for t in tokens), dtype=np.uint64, count=len(tokens))
+    permuted = (_A[:, None] * (hashes[None, :] % _PRIME) + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+def to_bytes(sig):
+    return sig.astype('<u4').tobytes()
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype='<u4')
+
+def entry_signature_bytes(summary, topics="", people=""):
+    return to_bytes(signature(shingles(summary, topics, people)))
+
+def _band_keys(signatures):
+    """(n, BANDS) uint64 keys, one per band of ROWS signature values"""
+    bands = signatures.astype(np.uint64).reshape(len(signatures), BANDS, ROWS)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    for r in range(ROWS):
+        keys = keys * np.uint64(0x100000001B3) ^ bands[:, :, r]
+    return keys
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures for one user's entries.
+
+    Signatures live in one (n, NUM_PERM) uint32 array. Each band's ROWS values are folded
+    into a 64-bit key and every band keeps its keys sorted, so a lookup is a binary search
+    per band and touches only the entries that collide with the query. Entries with the
+    EMPTY signature share nothing with anything, so they are never returned or queried.
+    """
+
+    def __init__(self, ids, signatures):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.signatures = np.asarray(signatures, dtype=np.uint32).reshape(len(self.ids), NUM_PERM)
+        self._row_of = {int(entry_id): i for i, entry_id in enumerate(self.ids)}
+        self._empty = set(np.flatnonzero((self.signatures == EMPTY).all(axis=1)).tolist())
+        keys = _band_keys(self.signatures)  # (n, BANDS)
+        self._order = np.argsort(keys, axis=0, kind='stable').T  # (BANDS, n)
+        self._sorted_keys = np.take_along_axis(keys, self._order.T, axis=0).T
+
+    def candidates(self, sig):
+        sig = np.asarray(sig, dtype=np.uint32)
+        if (sig == EMPTY).all():
+            return set()
+        query_keys = _band_keys(sig[None, :])[0]
+        rows = set()
+        for band in range(BANDS):
+            keys = self._sorted_keys[band]
+            lo = np.searchsorted(keys, query_keys[band], side='left')
+            hi = np.searchsorted(keys, query_keys[band], side='right')
+            if hi > lo:
+                rows.update(self._order[band, lo:hi].tolist())
+        return rows - self._empty
+
+    def query(self, sig, k=5, min_similarity=0.1, exclude_id=None):
+        """Up to k (entry id, estimated Jaccard) pairs, most similar first"""
+        rows = self.candidates(sig)
+        if exclude_id is not None:
+            rows.discard(self._row_of.get(int(exclude_id)))
+        if not rows:
+            return []
+        rows = np.fromiter(rows, dtype=np.int64)
+        similarity = (self.signatures[rows] == np.asarray(sig, dtype=np.uint32)).mean(axis=1)
+        order = np.argsort(-similarity, kind='stable')[:k]
+        return [(int(self.ids[rows[i]]), float(similarity[i])) for i in order if similarity[i] >= min_similarity]
+
+    def similar_to(self, entry_id, k=5, min_similarity=0.1):
+        row = self._row_of.get(int(entry_id))
+        if row is None:
+            return []
+        return self.query(self.signatures[row], k, min_similarity, exclude_id=entry_id)
@@ -0,0 +1,138 @@
+"""Sharding tests. The move_user tests need two scratch Postgres databases, given as
+SHARDING_TEST_DSNS="postgresql://.../shard_a,postgresql://.../shard_b"; they are skipped
+otherwise. Their tables are created if missing and only the test's own user is touched."""
+import os
+import uuid
+from collections import Counter
+from datetime import date
+
+import pytest
+
+import answer_warmer
+import digests
+import log_partitions
+import sharding
+import transcripts
+import user_memory
+from cache_sync import CacheSync
+from db_router import DatabaseRouter
+from session_store import DraftTurnLog, PostgresSessionStore
+from sharding import HashRing, ShardedDatabase
+
+TEST_DSNS = [dsn for dsn in os.environ.get("SHARDING_TEST_DSNS", "").split(",") if dsn.strip()]
+
+needs_shards = pytest.mark.skipif(len(TEST_DSNS) < 2, reason="set SHARDING_TEST_DSNS to two or more database URLs")
+
+def test_ring_is_deterministic():
+    ring, again = HashRing(["a", "b", "c"]), HashRing(["a", "b", "c"])
+    for i in range(100):
+        assert ring.shard_for(f"user{i}@example.com") == again.shard_for(f"user{i}@example.com")
+
+def test_ring_spreads_keys_evenly():
+    ring = HashRing(["a", "b", "c", "d"])
+    counts = Counter(ring.shard_for(f"user{i}@example.com") for i in range(20000))
+    assert set(counts) == {"a", "b", "c", "d"}
+    for count in counts.values():
+        assert 3500 < count < 6500
+
+def test_catalog_shard_is_explicit_with_several_shards():
+    shards = '{"a": {"url": "postgresql://a"}, "b": {"url": "postgresql://b"}}'
+    with pytest.raises(ValueError):
+        sharding.load_catalog_shard({"DATABASE_SHARDS": shards})
+    with pytest.raises(ValueError):
+        sharding.load_catalog_shard({"DATABASE_SHARDS": shards, "DATABASE_CATALOG_SHARD": "c"})
+    assert sharding.load_catalog_shard({"DATABASE_SHARDS": shards, "DATABASE_CATALOG_SHARD": "b"}) == "b"
+    assert sharding.load_catalog_shard({"DATABASE_URL": "postgresql://default"}) == "default"
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before, after = HashRing(["a", "b", "c"]), HashRing(["a", "b", "c", "d"])
+    keys = [f"user{i}@example.com" for i in range(20000)]
+    moved = [key for key in keys if before.shard_for(key) != after.shard_for(key)]
+    assert all(after.shard_for(key) == "d" for key in moved)
+    # Roughly the new shard's fair share
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+@pytest.fixture
+def db():
+    db = ShardedDatabase({f"s{i}": DatabaseRouter(dsn, maxconn=4) for i, dsn in enumerate(TEST_DSNS)}, "s0")
+    for shard in db.shards:
+        conn = db.connect_shard(shard)
+        with conn.cursor() as cur:
+            if shard == db.catalog:
+                sharding.ensure_catalog_schema(cur)
+            log_partitions.ensure_schema(cur, date.today())
+            CacheSync.ensure_schema(cur)
+            PostgresSessionStore.ensure_schema(cur)
+            DraftTurnLog.ensure_schema(cur)
+            user_memory.ensure_schema(cur)
+            digests.ensure_schema(cur)
+            answer_warmer.ensure_schema(cur)
+            transcripts.ensure_schema(cur)
+        conn.commit()
+        conn.close()
+    yield db
+    db.closeall()
+
+@pytest.fixture
+def user_email(db):
+    user_email = f"move-{uuid.uuid4().hex}@example.com"
+    yield user_email
+    for shard in db.shards:
+        conn = db.connect_shard(shard)
+        with conn.cursor() as cur:
+            for table, column in sharding.USER_TABLES:
+                cur.execute(f"DELETE FROM {table} WHERE {column} = %s", (user_email,))
+            if shard == db.catalog:
+                cur.execute("DELETE FROM shard_assignments WHERE user_email = %s", (user_email,))
+        conn.commit()
+        conn.close()
+
+def _count(db, shard, user_email):
+    conn = db.connect_shard(shard)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM logs WHERE user_email = %s", (user_email,))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def _bump_version(cur, user_email):
+    cur.execute(
+        "INSERT INTO user_data_versions (user_email, version) VALUES (%s, 1) "
+        "ON CONFLICT (user_email) DO UPDATE SET version = user_data_versions.version + 1",
+        (user_email,)
+    )
+
+@needs_shards
+def test_assignment_is_recorded_once(db, user_email):
+    shard, frozen = db.assignment(user_email)
+    assert shard == db.ring.shard_for(user_email) and not frozen
+    assert db.assignment(user_email, refresh=True) == (shard, False)
+
+@needs_shards
+def test_move_user_copies_rows_and_switches_assignment(db, user_email):
+    source = db.shard_for(user_email)
+    target = next(shard for shard in db.shards if shard != source)
+    today = date.today()
+    conn = db.connect(user_email)
+    with conn.cursor() as cur:
+        for summary in ("first", "second"):
+            cur.execute(
+                "INSERT INTO logs (user_email, user_name, date, summary, entry_date) VALUES (%s, 'Test', %s, %s, %s)",
+                (user_email, today.isoformat(), summary, today)
+            )
+        _bump_version(cur, user_email)
+    conn.commit()
+    conn.close()
+
+    copied = sharding.move_user(db, user_email, target, _bump_version, settle=0)
+
+    assert copied["logs"] == 2
+    assert copied["user_data_versions"] == 1
+    assert db.assignment(user_email, refresh=True) == (target, False)
+    assert _count(db, target, user_email) == 2
+    assert _count(db, source, user_email) == 0
+
+@needs_shards
+def test_move_user_to_current_shard_is_a_no_op(db, user_email):
+    assert sharding.move_user(db, user_email, db.shard_for(user_email), _bump_version, settle=0) == {}
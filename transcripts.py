@@ -0,0 +1,238 @@
+"""Conversation transcripts, stored as zstd-compressed JSON next to the summaries in `logs`.
+
+Rows are compressed with a dictionary trained on the shard's own transcripts; short
+conversations share most of their structure (roles, JSON keys, the assistant's phrasing),
+which a dictionary turns into a few bytes each.
+
+Usage: DATABASE_URL=... [DATABASE_SHARDS=...] python transcripts.py train|stats
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+
+import psycopg2
+import zstandard
+
+from sharding import load_shard_urls
+
+logger = logging.getLogger("transcripts")
+
+LEVEL = 9
+DICT_SIZE = 32 * 1024
+MIN_SAMPLES = 200  # transcripts needed before a dictionary is worth training
+RETRAIN_GROWTH = 4  # retrain once the shard holds this many times the last training's samples
+NO_DICT = 0
+
+def ensure_schema(cur):
+    # Keyed like the logs dedup key (see fingerprints.py), which survives a user moving shards
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS transcripts
+        (user_email TEXT NOT NULL,
+         entry_date DATE NOT NULL,
+         transcript_key INTEGER NOT NULL,
+         dict_id BIGINT NOT NULL,
+         body BYTEA NOT NULL,
+         raw_size INTEGER NOT NULL,
+         PRIMARY KEY (user_email, entry_date, transcript_key))
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS transcript_dicts
+        (dict_id BIGINT PRIMARY KEY,
+         dict BYTEA NOT NULL,
+         samples INTEGER NOT NULL,
+         trained_at TIMESTAMPTZ NOT NULL DEFAULT now())
+    ''')
+
+def transcript_key(fingerprint):
+    # The transcript half of an entry fingerprint
+    return fingerprint >> 32
+
+def encode(messages):
+    return json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class TranscriptCodec:
+    """One shard's transcript compression: compresses with the shard's newest dictionary and
+    decompresses with whichever one a row names.
+
+    A background thread checks every `interval` seconds whether the shard holds enough
+    transcripts to train a (better) dictionary, trains it under an advisory lock so one
+    replica does it, and picks up dictionaries other replicas trained. Rows written before
+    any dictionary existed use plain zstd (dict_id 0) until training recompresses them.
+    interval=None runs no thread (the CLI).
+    """
+
+    def __init__(self, connect, interval=3600):
+        self._connect = connect
+        self.interval = interval
+        self._dicts = {}  # dict_id -> ZstdCompressionDict
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if interval is not None:
+            self._thread = threading.Thread(target=self._run, name="transcript-dicts", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Transcript dictionary maintenance failed")
+            self._stop.wait(self.interval)
+
+    def maintain(self):
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('transcript_dict_training'))")
+            if cur.fetchone()[0]:
+                if needs_training(cur):
+                    dict_id = train(cur, self)
+                    if dict_id is not None:
+                        logger.info("Trained transcript dictionary %s", dict_id)
+                recompress(cur, self)
+            else:
+                self.load_current(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def load_current(self, cur):
+        cur.execute("SELECT dict_id, dict FROM transcript_dicts ORDER BY trained_at DESC LIMIT 1")
+        row = cur.fetchone()
+        with self._lock:
+            if row is not None:
+                self._dicts.setdefault(row[0], zstandard.ZstdCompressionDict(bytes(row[1])))
+                self._current = row[0]
+        return self._current
+
+    def _dictionary(self, cur, dict_id):
+        with self._lock:
+            dictionary = self._dicts.get(dict_id)
+        if dictionary is None:
+            cur.execute("SELECT dict FROM transcript_dicts WHERE dict_id = %s", (dict_id,))
+            row = cur.fetchone()
+            if row is None:
+                raise KeyError(f"missing transcript dictionary {dict_id}")
+            dictionary = zstandard.ZstdCompressionDict(bytes(row[0]))
+            with self._lock:
+                self._dicts[dict_id] = dictionary
+        return dictionary
+
+    def compress(self, raw):
+        """(dict_id, compressed bytes)"""
+        with self._lock:
+            dict_id = self._current
+            dictionary = self._dicts.get(dict_id)
+        if dictionary is None:
+            return NO_DICT, zstandard.ZstdCompressor(level=LEVEL).compress(raw)
+        return dict_id, zstandard.ZstdCompressor(level=LEVEL, dict_data=dictionary).compress(raw)
+
+    def decompress(self, cur, dict_id, body):
+        """The raw JSON of a row; cur fetches the row's dictionary if it isn't loaded yet"""
+        if dict_id == NO_DICT:
+            return zstandard.ZstdDecompressor().decompress(bytes(body))
+        return zstandard.ZstdDecompressor(dict_data=self._dictionary(cur, dict_id)).decompress(bytes(body))
+
+def save(cur, codec, user_email, entry_date, fingerprint, messages):
+    """Store a conversation inside the caller's transaction (the one inserting its logs row)"""
+    raw = encode(messages)
+    dict_id, body = codec.compress(raw)
+    cur.execute(
+        "INSERT INTO transcripts (user_email, entry_date, transcript_key, dict_id, body, raw_size) VALUES (%s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT DO NOTHING",
+        (user_email, entry_date, transcript_key(fingerprint), dict_id, psycopg2.Binary(body), len(raw))
+    )
+
+def load(cur, codec, user_email, entry_id):
+    """The messages of a journal entry's conversation, or None if none was stored (older entries)"""
+    cur.execute(
+        "SELECT t.dict_id, t.body FROM logs l JOIN transcripts t ON t.user_email = l.user_email "
+        "AND t.entry_date = l.entry_date AND t.transcript_key = (l.fingerprint >> 32) "
+        "WHERE l.user_email = %s AND l.id = %s",
+        (user_email, entry_id)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return json.loads(codec.decompress(cur, row[0], row[1]))
+
+def delete(cur, user_email, entry_date, fingerprint):
+    cur.execute(
+        "DELETE FROM transcripts WHERE user_email = %s AND entry_date = %s AND transcript_key = %s",
+        (user_email, entry_date, transcript_key(fingerprint))
+    )
+
+def train(cur, codec, max_samples=5000):
+    """Train a new dictionary on a sample of the shard's transcripts and make it current;
+    returns its dict_id, or None if there are too few transcripts"""
+    cur.execute("SELECT dict_id, body FROM transcripts ORDER BY random() LIMIT %s", (max_samples,))
+    samples = [codec.decompress(cur, dict_id, body) for dict_id, body in cur.fetchall()]
+    if len(samples) < MIN_SAMPLES:
+        return None
+    dictionary = zstandard.train_dictionary(DICT_SIZE, samples, level=LEVEL)
+    dictionary_bytes = dictionary.as_bytes()
+    cur.execute(
+        "INSERT INTO transcript_dicts (dict_id, dict, samples) VALUES (%s, %s, %s) ON CONFLICT (dict_id) DO NOTHING",
+        (dictionary.dict_id(), psycopg2.Binary(dictionary_bytes), len(samples))
+    )
+    codec.load_current(cur)
+    return dictionary.dict_id()
+
+def recompress(cur, codec, batch=1000):
+    """Recompress up to `batch` rows stored without a dictionary; returns how many"""
+    if codec.load_current(cur) is None:
+        return 0
+    cur.execute(
+        "SELECT user_email, entry_date, transcript_key, body FROM transcripts WHERE dict_id = %s LIMIT %s",
+        (NO_DICT, batch)
+    )
+    rows = cur.fetchall()
+    for user_email, entry_date, key, body in rows:
+        dict_id, compressed = codec.compress(codec.decompress(cur, NO_DICT, body))
+        cur.execute(
+            "UPDATE transcripts SET dict_id = %s, body = %s WHERE user_email = %s AND entry_date = %s AND transcript_key = %s",
+            (dict_id, psycopg2.Binary(compressed), user_email, entry_date, key)
+        )
+    return len(rows)
+
+def needs_training(cur):
+    cur.execute("SELECT samples FROM transcript_dicts ORDER BY trained_at DESC LIMIT 1")
+    row = cur.fetchone()
+    cur.execute("SELECT count(*) FROM transcripts")
+    count = cur.fetchone()[0]
+    return count >= MIN_SAMPLES if row is None else count >= RETRAIN_GROWTH * row[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Train transcript compression dictionaries")
+    parser.add_argument("command", choices=["train", "stats"])
+    args = parser.parse_args()
+
+    for name, (url, _) in load_shard_urls(os.environ).items():
+        conn = psycopg2.connect(url)
+        try:
+            cur = conn.cursor()
+            if args.command == "train":
+                codec = TranscriptCodec(None, interval=None)
+                dict_id = train(cur, codec)
+                while recompress(cur, codec):
+                    pass
+                conn.commit()
+                print(f"{name}: " + (f"trained dictionary {dict_id}" if dict_id else "too few transcripts to train"))
+            cur.execute("SELECT count(*), coalesce(sum(raw_size), 0), coalesce(sum(length(body)), 0) FROM transcripts")
+            count, raw, stored = cur.fetchone()
+            ratio = raw / stored if stored else 0
+            print(f"{name}: {count} transcripts, {raw} bytes of JSON stored in {stored} ({ratio:.1f}x)")
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
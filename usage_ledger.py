@@ -0,0 +1,211 @@
+"""Append-only ledger of LLM usage per user, with daily token budgets.
+
+Usage (report): DATABASE_URL=... [DATABASE_SHARDS=... DATABASE_CATALOG_SHARD=...] python usage_ledger.py [--days 7] [--by user|task|model]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from sharding import load_shard_urls, load_catalog_shard
+
+logger = logging.getLogger("usage_ledger")
+
+# Budget levels, from least to most degraded
+NORMAL, REDUCED, ECONOMY = "normal", "reduced", "economy"
+
+def ensure_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS llm_usage
+        (id BIGSERIAL PRIMARY KEY,
+         created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+         user_email TEXT,
+         task TEXT NOT NULL,
+         model TEXT NOT NULL,
+         prompt_tokens INTEGER,
+         completion_tokens INTEGER,
+         latency_ms REAL NOT NULL,
+         ttft_ms REAL,
+         error BOOLEAN NOT NULL DEFAULT false,
+         budget_level TEXT NOT NULL DEFAULT 'normal')
+    ''')
+    cur.execute("CREATE INDEX IF NOT EXISTS llm_usage_user_created_idx ON llm_usage (user_email, created_at)")
+
+# Per-group totals and latency percentiles over a time range; {group} is a column name
+REPORT_SQL = """
+    SELECT {group}, count(*) AS calls,
+           sum(prompt_tokens) AS prompt_tokens, sum(completion_tokens) AS completion_tokens,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS p50_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS p95_ms,
+           avg(ttft_ms) AS avg_ttft_ms,
+           count(*) FILTER (WHERE error) AS errors,
+           count(*) FILTER (WHERE budget_level <> 'normal') AS degraded
+    FROM llm_usage
+    WHERE created_at >= %s AND created_at < %s
+    GROUP BY {group}
+    ORDER BY sum(coalesce(prompt_tokens, 0) + coalesce(completion_tokens, 0)) DESC
+"""
+
+def report(cur, since, until, group="user_email"):
+    if group not in ("user_email", "task", "model"):
+        raise ValueError(f"can't group usage by {group!r}")
+    cur.execute(REPORT_SQL.format(group=group), (since, until))
+    columns = [d.name for d in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+class UsageLedger:
+    """Buffers usage records and appends them to llm_usage in batches on a background thread.
+
+    record() never touches the database: records are written every `flush_interval` seconds,
+    or sooner once `max_batch` are waiting. Tokens used today per user are kept in process,
+    seeded from the table at most every `refresh_interval` seconds so other replicas' usage
+    is counted too. `day_start()` returns the start of the budget day.
+    """
+
+    def __init__(self, connect, day_start, flush_interval=2.0, max_batch=500, refresh_interval=60.0):
+        self._connect = connect
+        self._day_start = day_start
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.refresh_interval = refresh_interval
+        self._buffer = []
+        self._today = {}  # user -> (day start, tokens in the table when fetched, fetched at, tokens recorded here since)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self._thread.start()
+
+    def record(self, user_email, task, model, prompt_tokens, completion_tokens, latency, ttft=None, error=False, budget_level=NORMAL):
+        """latency and ttft in seconds"""
+        row = (user_email, task, model, prompt_tokens, completion_tokens, latency * 1000,
+               None if ttft is None else ttft * 1000, error, budget_level)
+        tokens = (prompt_tokens or 0) + (completion_tokens or 0)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.max_batch
+            if user_email in self._today:
+                day, fetched, fetched_at, local = self._today[user_email]
+                self._today[user_email] = (day, fetched, fetched_at, local + tokens)
+        if full:
+            self._wake.set()
+
+    def tokens_today(self, user_email):
+        day = self._day_start()
+        with self._lock:
+            cached = self._today.get(user_email)
+        if cached is not None and cached[0] == day and time.monotonic() - cached[2] < self.refresh_interval:
+            return cached[1] + cached[3]
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT coalesce(sum(coalesce(prompt_tokens, 0) + coalesce(completion_tokens, 0)), 0) "
+                    "FROM llm_usage WHERE user_email = %s AND created_at >= %s",
+                    (user_email, day)
+                )
+                fetched = int(cur.fetchone()[0])
+        finally:
+            conn.close()
+        with self._lock:
+            # Records still in the buffer aren't in the table yet
+            pending = sum((row[3] or 0) + (row[4] or 0) for row in self._buffer if row[0] == user_email)
+            self._today[user_email] = (day, fetched, time.monotonic(), pending)
+        return fetched + pending
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO llm_usage (user_email, task, model, prompt_tokens, completion_tokens, latency_ms, ttft_ms, error, budget_level) VALUES %s",
+                    rows
+                )
+            conn.commit()
+        except Exception:
+            with self._lock:
+                self._buffer[:0] = rows  # retried on the next flush
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing usage records failed")
+
+class BudgetPolicy:
+    """Maps a user's tokens used today to a budget level.
+
+    Past `soft` of `daily_tokens` requests run REDUCED (shorter context and answers where
+    the caller allows it); past the full budget they run ECONOMY (additionally on the cheap
+    model). daily_tokens=0 disables budgets.
+    """
+
+    def __init__(self, ledger, daily_tokens, soft=0.8):
+        self.ledger = ledger
+        self.daily_tokens = daily_tokens
+        self.soft = soft
+
+    def level(self, user_email):
+        if not self.daily_tokens or user_email is None:
+            return NORMAL
+        used = self.ledger.tokens_today(user_email)
+        if used >= self.daily_tokens:
+            return ECONOMY
+        if used >= self.soft * self.daily_tokens:
+            return REDUCED
+        return NORMAL
+
+def _shorten(text, max_chars):
+    # Keep both ends: instructions tend to lead and the question tends to close a message
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return text[:half] + "\n[...]\n" + text[-half:]
+
+def trim_messages(messages, keep_last, max_chars):
+    """A shorter context: system messages, the first other message (the task's instructions or the
+    opening turn) and the last `keep_last` others, in order, each cut to about max_chars"""
+    others = [i for i, m in enumerate(messages) if m["role"] != "system"]
+    keep = set(others[:1] + others[-keep_last:])
+    return [dict(m, content=_shorten(m["content"], max_chars))
+            for i, m in enumerate(messages) if m["role"] == "system" or i in keep]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM usage from the llm_usage ledger")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--by", choices=["user", "task", "model"], default="user")
+    args = parser.parse_args()
+
+    until = datetime.now().astimezone()
+    # The ledger lives on the catalog shard
+    catalog_url, _ = load_shard_urls(os.environ)[load_catalog_shard(os.environ)]
+    conn = psycopg2.connect(catalog_url)
+    try:
+        with conn.cursor() as cur:
+            rows = report(cur, until - timedelta(days=args.days), until, {"user": "user_email"}.get(args.by, args.by))
+    finally:
+        conn.close()
+    print(f"{args.by:<32} {'calls':>7} {'prompt':>10} {'completion':>10} {'p50_ms':>8} {'p95_ms':>8} {'ttft_ms':>8} {'errors':>6} {'degraded':>8}")
+    for row in rows:
+        values = list(row.values())
+        print(f"{str(values[0]):<32} {row['calls']:>7} {row['prompt_tokens'] or 0:>10} {row['completion_tokens'] or 0:>10} "
+              f"{row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} {row['avg_ttft_ms'] or 0:>8.0f} {row['errors']:>6} {row['degraded']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+import re
+
+EMOTIONS = ["Joy", "Sadness", "Fear", "Anger", "Frustration"]
+
+# Weight of the newest entry in the emotional baseline (exponential moving average)
+BASELINE_ALPHA = 0.15
+MAX_TRACKED = 50  # people/topics kept in the profile; the least recent beyond this are dropped
+MAX_THREADS = 5
+
+# Sentences that point at something still unresolved or upcoming
+_THREAD_RE = re.compile(r"\b(will|going to|plan(?:ning)? to|need to|have to|hope to|worried about|looking forward|tomorrow|next week|upcoming|haven't yet|not sure (?:if|whether|how))\b", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"[^.!?]+[.!?]?")
+
+def empty_profile():
+    return {
+        "entries": 0,
+        "people": {},
+        "topics": {},
+        "baseline": {e: 0.0 for e in EMOTIONS},
+        "threads": [],
+    }
+
+def _tags(value):
+    return [t.strip() for t in (value or "").split(',') if t.strip() and t.strip() != 'None']
+
+def _track(counter, names, date):
+    for name in names:
+        item = counter.setdefault(name, {"count": 0, "last": date})
+        item["count"] += 1
+        item["last"] = max(item["last"], date)
+    if len(counter) > MAX_TRACKED:
+        keep = sorted(counter, key=lambda n: (counter[n]["last"], counter[n]["count"]), reverse=True)[:MAX_TRACKED]
+        for name in set(counter) - set(keep):
+            del counter[name]
+
+def merge_entry(profile, date, summary, emotions, people, topics):
+    """Fold one new entry into the profile in place; date is 'YYYY-MM-DD'"""
+    profile["entries"] += 1
+    _track(profile["people"], _tags(people), date)
+    _track(profile["topics"], _tags(topics), date)
+
+    present = set(_tags(emotions))
+    alpha = max(BASELINE_ALPHA, 1.0 / profile["entries"])  # plain average until there's enough history
+    for emotion in EMOTIONS:
+        previous = profile["baseline"].get(emotion, 0.0)
+        profile["baseline"][emotion] = previous + alpha * ((emotion in present) - previous)
+
+    new_threads = [s.strip() for s in _SENTENCE_RE.findall(summary or "") if _THREAD_RE.search(s)]
+    profile["threads"] = ([{"date": date, "text": t} for t in new_threads[-2:]] + profile["threads"])[:MAX_THREADS]
+    return profile
+
+def render(profile, max_people=5, max_topics=5, max_threads=3, max_chars=900):
+    """Fixed-size text block describing the user, for the chat system prompt"""
+    if not profile or not profile["entries"]:
+        return ""
+
+    def top(counter, limit):
+        ranked = sorted(counter.items(), key=lambda kv: (kv[1]["count"], kv[1]["last"]), reverse=True)[:limit]
+        return ", ".join(f"{name} ({item['count']}x, last {item['last']})" for name, item in ranked)
+
+    lines = [f"What you remember from their {profile['entries']} past journal entries:"]
+    if profile["people"]:
+        lines.append(f"- People they often mention: {top(profile['people'], max_people)}")
+    if profile["topics"]:
+        lines.append(f"- Recurring topics: {top(profile['topics'], max_topics)}")
+    baseline = sorted(profile["baseline"].items(), key=lambda kv: kv[1], reverse=True)
+    lines.append("- Usual emotional mix: " + ", ".join(f"{e} {rate:.0%}" for e, rate in baseline if rate >= 0.05))
+    for thread in profile["threads"][:max_threads]:
+        text = thread["text"] if len(thread["text"]) <= 160 else thread["text"][:157] + "..."
+        lines.append(f"- Open thread ({thread['date']}): {text}")
+    lines.append("Refer to these naturally when relevant, and gently follow up on open threads.")
+    block = "\n".join(lines)
+    return block if len(block) <= max_chars else block[:max_chars - 3] + "..."
+
+def ensure_schema(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_memory
+        (user_email TEXT PRIMARY KEY,
+         profile JSONB NOT NULL,
+         updated_at TIMESTAMPTZ NOT NULL DEFAULT now())
+    ''')
+
+def load_profile(cur, user_email, for_update=False):
+    cur.execute(
+        "SELECT profile FROM user_memory WHERE user_email = %s" + (" FOR UPDATE" if for_update else ""),
+        (user_email,)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def save_profile(cur, user_email, profile):
+    cur.execute(
+        "INSERT INTO user_memory (user_email, profile) VALUES (%s, %s::jsonb) "
+        "ON CONFLICT (user_email) DO UPDATE SET profile = EXCLUDED.profile, updated_at = now()",
+        (user_email, json.dumps(profile))
+    )
+
+def rebuild_profile(cur, user_email):
+    """Recompute from the full history; used when there's no profile yet or after a delete"""
+    cur.execute(
+        "SELECT date, summary, emotions, people, topics FROM logs WHERE user_email = %s ORDER BY date, time",
+        (user_email,)
+    )
+    profile = empty_profile()
+    for row in cur.fetchall():
+        merge_entry(profile, *row)
+    save_profile(cur, user_email, profile)
+    return profile
+
+def record_entry(cur, user_email, date, summary, emotions, people, topics):
+    """Merge a just-inserted entry into the stored profile, inside the caller's transaction"""
+    profile = load_profile(cur, user_email, for_update=True)
+    if profile is None:
+        # First profile for this user: the new row is already visible to this transaction
+        return rebuild_profile(cur, user_email)
+    merge_entry(profile, date, summary, emotions, people, topics)
+    save_profile(cur, user_email, profile)
+    return profile
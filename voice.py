@@ -0,0 +1,225 @@
+import io
+import queue
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+
+class VoiceActivitySegmenter:
+    """Energy-based voice activity detection over 16 kHz mono int16 audio.
+
+    Audio is cut into 30 ms frames; a frame is speech when its RMS energy is well above a
+    slowly adapting noise floor. A segment closes after `segment_silence_ms` of silence
+    (so it can be transcribed while the user keeps talking) or at `max_segment_s`, and the
+    utterance is marked finished after `utterance_silence_ms`. Buffers never grow past one
+    segment, so memory stays flat however long the session runs.
+    """
+
+    def __init__(self, segment_silence_ms=300, utterance_silence_ms=1200, max_segment_s=15, pre_roll_ms=150, threshold=3.0, min_speech_ms=200):
+        self.segment_silence_frames = segment_silence_ms // FRAME_MS
+        self.utterance_silence_frames = utterance_silence_ms // FRAME_MS
+        self.max_segment_frames = max_segment_s * 1000 // FRAME_MS
+        self.min_speech_frames = min_speech_ms // FRAME_MS
+        self.threshold = threshold
+        self.noise_floor = 100.0
+        self._pre_roll = deque(maxlen=pre_roll_ms // FRAME_MS)
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._segment = []
+        self._speech_frames = 0
+        self._silent_frames = 0
+        self._in_utterance = False
+
+    def feed(self, samples):
+        """Consume int16 samples; returns a list of events ("segment", array) and ("end_of_utterance", None)"""
+        audio = np.concatenate([self._pending, samples.astype(np.int16, copy=False)])
+        n_frames = len(audio) // FRAME_SAMPLES
+        self._pending = audio[n_frames * FRAME_SAMPLES:]
+        if n_frames == 0:
+            return []
+        frames = audio[:n_frames * FRAME_SAMPLES].reshape(n_frames, FRAME_SAMPLES)
+        rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+
+        events = []
+        for frame, energy in zip(frames, rms):
+            is_speech = energy > self.threshold * self.noise_floor
+            if not is_speech:
+                # Track background noise only on non-speech frames
+                self.noise_floor = max(30.0, 0.95 * self.noise_floor + 0.05 * energy)
+            if self._segment:
+                self._segment.append(frame)
+                if is_speech:
+                    self._speech_frames += 1
+                    self._silent_frames = 0
+                else:
+                    self._silent_frames += 1
+                if self._silent_frames >= self.segment_silence_frames or len(self._segment) >= self.max_segment_frames:
+                    events.extend(self._close_segment())
+            elif is_speech:
+                self._segment = list(self._pre_roll) + [frame]
+                self._speech_frames = 1
+                self._silent_frames = 0
+                self._in_utterance = True
+            else:
+                self._silent_frames += 1
+                if self._in_utterance and self._silent_frames >= self.utterance_silence_frames:
+                    self._in_utterance = False
+                    events.append(("end_of_utterance", None))
+            self._pre_roll.append(frame)
+        return events
+
+    def _close_segment(self):
+        segment, speech = self._segment, self._speech_frames
+        self._segment = []
+        self._speech_frames = 0
+        if speech < self.min_speech_frames:
+            return []
+        return [("segment", np.concatenate(segment))]
+
+def to_wav_bytes(samples):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.astype(np.int16).tobytes())
+    return buffer.getvalue()
+
+class OpenAISpeechToText:
+    """Transcribe segments with the OpenAI audio API.
+
+    Segments are a few seconds long, so a request taking longer than `timeout` seconds has
+    stalled; it fails rather than hold up the segments queued behind it. on_usage(model,
+    usage, latency, error) is called after every request, failed ones too; usage is None
+    when the model doesn't report tokens (whisper-1 bills by audio length).
+    """
+
+    def __init__(self, client, model="whisper-1", on_usage=None, timeout=15.0):
+        self.client = client
+        self.model = model
+        self.on_usage = on_usage
+        self.timeout = timeout
+
+    def transcribe(self, samples):
+        started = time.perf_counter()
+        try:
+            result = self.client.audio.transcriptions.create(
+                model=self.model,
+                file=("segment.wav", to_wav_bytes(samples), "audio/wav"),
+                timeout=self.timeout,
+            )
+        except Exception:
+            if self.on_usage:
+                self.on_usage(self.model, None, time.perf_counter() - started, True)
+            raise
+        if self.on_usage:
+            self.on_usage(self.model, getattr(result, "usage", None), time.perf_counter() - started, False)
+        return result.text.strip()
+
+class LocalSpeechToText:
+    """Offline stand-in: returns scripted phrases in order, or describes the segment length"""
+
+    def __init__(self, phrases=None):
+        self._phrases = deque(phrases or [])
+
+    def transcribe(self, samples):
+        if self._phrases:
+            return self._phrases.popleft()
+        return f"[{len(samples) / SAMPLE_RATE:.1f}s of speech]"
+
+class VoiceSession:
+    """Runs VAD and transcription on a worker thread so capture never waits on speech-to-text.
+
+    feed() takes raw int16 audio from the capture loop; partial_text() is what has been
+    transcribed of the current utterance so far; take_utterance() returns the full text
+    once the speaker pauses. The worker exits on close() or after `idle_timeout` seconds
+    without audio (e.g. the browser session went away) and is restarted by the next feed().
+    """
+
+    def __init__(self, stt, segmenter=None, max_queued_chunks=200, idle_timeout=60.0):
+        self.stt = stt
+        self.segmenter = segmenter or VoiceActivitySegmenter()
+        self.idle_timeout = idle_timeout
+        self._audio = queue.Queue(maxsize=max_queued_chunks)
+        self._lock = threading.Lock()
+        self._parts = []
+        self._utterances = deque(maxlen=8)
+        self._thread = None
+        self._closed = False
+        self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="voice-session", daemon=True)
+                self._thread.start()
+
+    def feed(self, samples):
+        try:
+            self._audio.put_nowait(samples)
+        except queue.Full:
+            # Drop the oldest audio rather than grow without bound if transcription falls behind
+            try:
+                self._audio.get_nowait()
+            except queue.Empty:
+                pass
+            self._audio.put_nowait(samples)
+        self._start()
+
+    def close(self):
+        """Stop the worker; never blocks, even while it is stuck on a slow transcription"""
+        with self._lock:
+            self._closed = True
+        try:
+            self._audio.put_nowait(None)  # wakes an idle worker
+        except queue.Full:
+            pass  # a busy one sees _closed before its next chunk
+
+    def partial_text(self):
+        with self._lock:
+            return " ".join(self._parts)
+
+    def take_utterance(self):
+        with self._lock:
+            return self._utterances.popleft() if self._utterances else None
+
+    def _run(self):
+        while True:
+            try:
+                samples = self._audio.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._audio.empty():
+                        self._thread = None
+                        return
+                continue
+            with self._lock:
+                if samples is None or self._closed:
+                    return
+            for kind, segment in self.segmenter.feed(samples):
+                if kind == "segment":
+                    try:
+                        text = self.stt.transcribe(segment)
+                    except Exception:
+                        continue
+                    if text:
+                        with self._lock:
+                            self._parts.append(text)
+                else:
+                    with self._lock:
+                        if self._parts:
+                            self._utterances.append(" ".join(self._parts))
+                            self._parts = []
+
+def frames_to_samples(frames, resampler):
+    """Convert av.AudioFrames from streamlit_webrtc to 16 kHz mono int16"""
+    chunks = []
+    for frame in frames:
+        for resampled in resampler.resample(frame):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)